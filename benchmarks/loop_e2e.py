@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Benchmark de ponta a ponta do tocainstall em dispositivos loop.
+
+Cria discos esparsos, associa cada um a um /dev/loopN (com partscan) e roda o
+instalador completo, sem interação, a partir de um repositório local gerado
+com --build-offline-repo (que faz o papel do espelho). O tempo de parede de
+cada etapa vem do trace (--trace) e é acrescentado ao histórico em JSON; a
+execução é comparada com a anterior de mesma configuração.
+
+Uso (como root):
+    python3 benchmarks/loop_e2e.py --repo /srv/toca-repo --runs 3
+    python3 benchmarks/loop_e2e.py --repo /srv/toca-repo --disks 2 --luks --fail-on-regression
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSTALLER = os.path.join(ROOT, "tocainstall.py")
+HISTORY = os.path.join(ROOT, "benchmarks", "history.json")
+# Hash qualquer no formato crypt(3): a instalação não é usada para login
+PASSWORD_HASH = "$6$tocabench$w6GZzZQ6bVj9ZQ8lq0vRk1dN6XGfVJb9zLpD0xYhY5r7QYk3sXoWq2Cq1m3Jx8Tn4u9Hc0aRb7eKfLgMpNsAt."
+
+def run(cmd, check=True):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)}: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+def release_label():
+    """Versão sendo medida: git describe quando disponível."""
+    try:
+        return run(["git", "-C", ROOT, "describe", "--always", "--dirty"])
+    except (OSError, RuntimeError):
+        return "desconhecida"
+
+def write_answers(path, suite, luks):
+    lines = ['hostname = "toca-bench"', f'suite = "{suite}"',
+             "[user]", 'name = "tocauser"', f'password_hash = "{PASSWORD_HASH}"']
+    if luks:
+        lines += ["[luks]", "enabled = true", 'password = "benchmark"']
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def stage_times(trace_path):
+    """{etapa: segundos} a partir dos intervalos "etapa" do trace."""
+    with open(trace_path) as f:
+        spans = json.load(f)["traceEvents"]
+    return {s["name"]: s["dur"] / 1e6 for s in spans if s["cat"] == "etapa"}
+
+def cleanup_target(loops):
+    # Se o instalador falhou no meio, sobram montagens e o container LUKS
+    for suffix in [""] + [str(i) for i in range(1, len(loops))]:
+        subprocess.run(["umount", "-R", f"/mnt/toca_install{suffix}"], stderr=subprocess.DEVNULL)
+        subprocess.run(["cryptsetup", "close", f"cryptroot{suffix}"], stderr=subprocess.DEVNULL)
+    for loop in loops:
+        subprocess.run(["losetup", "-d", loop], stderr=subprocess.DEVNULL)
+
+def run_once(args, suite, workdir):
+    """Uma instalação completa; retorna ({etapa: s}, total em s, código de saída)."""
+    images, loops = [], []
+    try:
+        for i in range(args.disks):
+            image = os.path.join(workdir, f"disk{i}.img")
+            with open(image, "wb") as f:
+                f.truncate(args.size_gb * 1024 ** 3)
+            images.append(image)
+            loops.append(run(["losetup", "--find", "--show", "--partscan", image]))
+
+        answers = os.path.join(workdir, "answers.toml")
+        write_answers(answers, suite, args.luks)
+        trace = os.path.join(workdir, "trace.json")
+        env = dict(os.environ,
+                   TOCA_CACHE_DIR=args.cache or os.path.join(workdir, "cache"),
+                   TOCA_JOURNAL=os.path.join(workdir, "journal.json"),
+                   TOCA_LOG=os.path.join(workdir, "tocainstall.log"))
+        cmd = [sys.executable, INSTALLER, "--answers", answers, "--offline-repo", args.repo,
+               "--trace", trace] + [arg for loop in loops for arg in ("--target", loop)]
+        cmd += args.installer_args
+
+        start = time.monotonic()
+        with open(os.path.join(workdir, "output.log"), "w") as out:
+            returncode = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL,
+                                        stdout=out, stderr=subprocess.STDOUT).returncode
+        total = time.monotonic() - start
+        stages = stage_times(trace) if os.path.exists(trace) else {}
+        return stages, total, returncode
+    finally:
+        cleanup_target(loops)
+        for image in images:
+            os.remove(image)
+
+def config_key(args):
+    return {"disks": args.disks, "size_gb": args.size_gb, "luks": args.luks,
+            "installer_args": args.installer_args}
+
+def compare(previous, current, threshold):
+    """Imprime a tabela etapa a etapa; retorna as etapas que pioraram além do limite."""
+    regressions = []
+    print(f"\n  {'Etapa':<24} {'anterior':>10} {'atual':>10} {'variação':>10}")
+    for name, now in current["stages"].items():
+        before = previous["stages"].get(name) if previous else None
+        if before:
+            delta = (now - before) / before
+            flag = "  <- regressão" if delta > threshold and now - before > 1.0 else ""
+            print(f"  {name:<24} {before:>9.1f}s {now:>9.1f}s {delta:>+9.0%}{flag}")
+            if flag:
+                regressions.append(name)
+        else:
+            print(f"  {name:<24} {'-':>10} {now:>9.1f}s {'-':>10}")
+    if previous:
+        print(f"  {'total':<24} {previous['total']:>9.1f}s {current['total']:>9.1f}s "
+              f"{(current['total'] - previous['total']) / previous['total']:>+9.0%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do tocainstall em dispositivos loop")
+    parser.add_argument("--repo", required=True, help="repositório gerado com tocainstall.py --build-offline-repo")
+    parser.add_argument("--runs", type=int, default=1, help="execuções (usa a mediana de cada etapa)")
+    parser.add_argument("--disks", type=int, default=1, help="discos loop por execução (>1 testa a replicação)")
+    parser.add_argument("--size-gb", type=int, default=16, help="tamanho de cada disco esparso")
+    parser.add_argument("--luks", action="store_true", help="instala com criptografia")
+    parser.add_argument("--cache", help="cache de pacotes compartilhado entre execuções (padrão: vazio a cada uma)")
+    parser.add_argument("--workdir", default="/var/tmp", help="onde criar os discos esparsos")
+    parser.add_argument("--history", default=HISTORY, help="histórico em JSON")
+    parser.add_argument("--label", default=None, help="nome da versão medida (padrão: git describe)")
+    parser.add_argument("--threshold", type=float, default=0.15, help="piora relativa tolerada por etapa")
+    parser.add_argument("--fail-on-regression", action="store_true", help="sai com código 1 se alguma etapa piorar")
+    parser.add_argument("installer_args", nargs="*", help="argumentos extras para o instalador (após --)")
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit("O benchmark precisa de root (losetup, mkfs, mount).")
+    try:
+        with open(os.path.join(args.repo, "toca-repo.json")) as f:
+            suite = json.load(f)["suite"]
+    except (OSError, ValueError, KeyError):
+        sys.exit(f"{args.repo} não parece um repositório gerado com --build-offline-repo.")
+
+    runs = []
+    for i in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="toca-bench-", dir=args.workdir)
+        try:
+            stages, total, returncode = run_once(args, suite, workdir)
+            if returncode != 0:
+                print(f"Execução {i + 1} falhou (código {returncode}); log mantido em {workdir}")
+                sys.exit(1)
+            print(f"Execução {i + 1}/{args.runs}: {total:.1f}s")
+            runs.append({"stages": stages, "total": total})
+        finally:
+            if runs and len(runs) == i + 1:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    current = {
+        "label": args.label or release_label(),
+        "time": time.time(),
+        "config": config_key(args),
+        "runs": runs,
+        "stages": {name: statistics.median(r["stages"].get(name, 0.0) for r in runs)
+                   for name in runs[0]["stages"]},
+        "total": statistics.median(r["total"] for r in runs),
+    }
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    previous = next((h for h in reversed(history) if h["config"] == current["config"]), None)
+    print(f"\nVersão {current['label']}" + (f" comparada com {previous['label']}" if previous else ""))
+    regressions = compare(previous, current, args.threshold)
+
+    history.append(current)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=1)
+    print(f"\nHistórico atualizado: {args.history}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"Etapas mais lentas que a versão anterior: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Answers: validação e aplicação do arquivo de respostas com discos falsos."""
+
+import os
+import sys
+import copy
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import Answers, TocaInstaller  # noqa: E402
+
+GB = 10 ** 9
+
+DISKS = [
+    {"name": "nvme0n1", "size_bytes": 1000 * GB, "model": "Samsung SSD 980"},
+    {"name": "sda", "size_bytes": 250 * GB, "model": "Samsung SSD 870"},
+    {"name": "sdb", "size_bytes": 32 * GB, "model": "USB Flash"},
+]
+
+VALID = {
+    "hostname": "Toca-Lab-01",
+    "suite": "bookworm",
+    "mirrors": ["http://deb.debian.org/debian", "file:///media/repo"],
+    "locale": "pt_BR.UTF-8",
+    "trim": "deferred",
+    "disk": {"model": "Samsung", "min_size_gb": 100, "prefer": "largest"},
+    "luks": {"enabled": True, "password": "segredo", "unlock_ms": 2000},
+    "user": {"name": "aluno", "password_hash": "$6$sal$hash"},
+    "initramfs": {"modules": "dep", "compress": "lz4", "level": 1},
+    "partitions": {"esp_mib": 256, "swap_mib": 2048, "seed": "lab-01"},
+    "subvolumes": {"@": "/", "@home": "/home"},
+}
+
+VALID_TOML = """\
+hostname = "toca-lab-01"
+suite = "bookworm"
+[disk]
+path = "/dev/null"
+[user]
+password_hash = "$6$sal$hash"
+"""
+
+
+def answers(**changes):
+    """Cópia de VALID com as chaves alteradas (seção.chave ou chave); None remove a chave."""
+    data = copy.deepcopy(VALID)
+    for name, value in changes.items():
+        section, _, key = name.rpartition("__")
+        target = data[section] if section else data
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = value
+    return Answers(data)
+
+
+class AnswersValidateTest(unittest.TestCase):
+
+    def assertInvalid(self, a, fragment, require_disk=True):
+        errors = a.validate(DISKS, require_disk=require_disk)
+        self.assertTrue(any(fragment in e for e in errors), errors)
+
+    def test_valid_file(self):
+        a = answers()
+        self.assertEqual(a.validate(DISKS), [])
+        self.assertEqual(a.disk, "/dev/nvme0n1")
+        self.assertEqual(a.hostname, "toca-lab-01")
+
+    def test_toml_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".toml") as f:
+            f.write(VALID_TOML)
+            f.flush()
+            a = Answers.load(f.name)
+        self.assertEqual(a.validate(DISKS), [])
+        self.assertEqual(a.disk, "/dev/null")
+
+    def test_scalar_types_checked_up_front(self):
+        for name, value, fragment in [
+                ("suite", 12, "suite deve ser um texto"),
+                ("hostname", 7, "hostname deve ser um texto"),
+                ("trim", False, "trim deve ser um texto"),
+                ("luks__enabled", "false", "luks.enabled deve ser true ou false"),
+                ("luks__password", 1234, "luks.password deve ser um texto"),
+                ("luks__unlock_ms", True, "luks.unlock_ms deve ser um inteiro"),
+                ("initramfs__compress", ["zstd"], "initramfs.compress deve ser um texto"),
+                ("initramfs__level", "3", "initramfs.level deve ser um inteiro"),
+                ("partitions__swap_mib", 1.5, "partitions.swap_mib deve ser um inteiro"),
+                ("disk__min_size_gb", "100", "disk.min_size_gb deve ser um número"),
+                ("user__name", 1000, "user.name deve ser um texto")]:
+            with self.subTest(name=name):
+                self.assertInvalid(answers(**{name: value}), fragment)
+
+    def test_invalid_values(self):
+        for name, value, fragment in [
+                ("suite", "Bookworm!", "suite inválida"),
+                ("mirrors", ["ftp://x"], "mirror/mirrors"),
+                ("locale", "pt BR", "locale inválido"),
+                ("hostname", "-toca", "hostname inválido"),
+                ("hostname", "toca-{nada}", "modelo de hostname inválido"),
+                ("trim", "sempre", "trim deve ser um de"),
+                ("initramfs__compress", "bzip2", "initramfs.compress inválido"),
+                ("partitions__esp_mib", 50, "partitions.esp_mib deve ter pelo menos 100"),
+                ("partitions__swap_mib", -1, "partitions.swap_mib deve ser um inteiro não negativo"),
+                ("luks__password", None, "luks.enabled exige luks.password"),
+                ("user__name", "Root", "nome de usuário inválido"),
+                ("user__password_hash", "toca", "user.password_hash deve ser um hash crypt(3)"),
+                ("extra", 1, "chave desconhecida: extra"),
+                ("luks", "sim", "[luks] deve ser uma tabela")]:
+            with self.subTest(name=name, value=value):
+                self.assertInvalid(answers(**{name: value}), fragment)
+
+    def test_disk_rules(self):
+        self.assertInvalid(answers(disk__prefer=None), "mais de um disco atende")
+        self.assertInvalid(answers(disk__min_size_gb=5000), "nenhum disco atende")
+        self.assertInvalid(answers(disk={}), "[disk] precisa de")
+        self.assertInvalid(answers(disk__model="("), "regra de disco inválida")
+        a = answers(disk__prefer="smallest")
+        self.assertEqual(a.validate(DISKS), [])
+        self.assertEqual(a.disk, "/dev/sda")
+
+    def test_disk_optional_with_target(self):
+        a = answers(disk=None)
+        self.assertEqual(a.validate(DISKS, require_disk=False), [])
+        self.assertIsNone(a.disk)
+
+    def test_validation_does_not_modify_the_answers(self):
+        a = answers(suite=12, luks__unlock_ms="2000")
+        a.validate(DISKS)
+        self.assertEqual(a.data["suite"], 12)
+        self.assertEqual(a.data["luks"]["unlock_ms"], "2000")
+
+    def test_not_a_table(self):
+        self.assertEqual(len(Answers(["x"]).validate(DISKS)), 1)
+
+
+class AnswersApplyTest(unittest.TestCase):
+
+    def test_apply(self):
+        a = answers()
+        self.assertEqual(a.validate(DISKS), [])
+        installer = TocaInstaller()
+        a.apply(installer)
+        self.assertTrue(installer.unattended)
+        self.assertEqual(installer.hostname, "toca-lab-01")
+        self.assertEqual(installer.disk, "/dev/nvme0n1")
+        self.assertEqual(installer.mirror, "http://deb.debian.org/debian")
+        self.assertEqual(installer.mirrors, VALID["mirrors"])
+        self.assertEqual(installer.selected_locale, "pt_BR.UTF-8")
+        self.assertTrue(installer.use_luks)
+        self.assertEqual(installer.luks_password, "segredo")
+        self.assertEqual(installer.luks_unlock_ms, 2000)
+        self.assertEqual((installer.username, installer.password_hash), ("aluno", "$6$sal$hash"))
+        self.assertEqual((installer.initramfs_modules, installer.initramfs_compress, installer.initramfs_level),
+                         ("dep", "lz4", 1))
+        self.assertEqual(installer.subvolumes, {"@": "/", "@home": "/home"})
+        self.assertEqual(installer.trim, "deferred")
+        layout = installer.layout
+        self.assertEqual((layout.esp_mib, layout.swap_mib, layout.seed), (256, 2048, "lab-01"))
+
+    def test_apply_keeps_defaults(self):
+        a = Answers({"disk": {"path": "/dev/null"}, "user": {"password_hash": "$6$sal$hash"}})
+        self.assertEqual(a.validate(DISKS), [])
+        installer = TocaInstaller()
+        defaults = (installer.suite, installer.mirror, installer.username, installer.luks_unlock_ms)
+        a.apply(installer)
+        self.assertFalse(installer.use_luks)
+        self.assertEqual((installer.suite, installer.mirror, installer.username, installer.luks_unlock_ms),
+                         defaults)
+        self.assertEqual(installer.hostname, "toca-machine")
+
+
+if __name__ == "__main__":
+    unittest.main()
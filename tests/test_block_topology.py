@@ -0,0 +1,120 @@
+"""BlockTopology contra uma árvore sysfs e /dev falsa."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import BlockTopology  # noqa: E402
+
+GIB = 1024 ** 3
+
+# disco: (tamanho em bytes, modelo, {partição: número})
+DISKS = {
+    "sda": (500 * GIB, "Samsung SSD", {"sda1": 1, "sda2": 2}),
+    "nvme0n1": (1024 * GIB, "WD Black", {"nvme0n1p1": 1, "nvme0n1p2": 2}),
+    "mmcblk0": (32 * GIB, "SD32G", {"mmcblk0p1": 1}),
+    "mmcblk0boot0": (4 * 1024 ** 2, None, {}),
+    "mmcblk0rpmb": (4 * 1024 ** 2, None, {}),
+    "loop0": (8 * GIB, None, {"loop0p1": 1}),
+    "zram0": (4 * GIB, None, {}),
+    "sdb": (0, "Leitor de cartão", {}),
+}
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class BlockTopologyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sysfs = os.path.join(self.tmp.name, "sys")
+        self.dev = os.path.join(self.tmp.name, "dev")
+        for disk, (size, model, parts) in DISKS.items():
+            base = os.path.join(self.sysfs, "block", disk)
+            write(os.path.join(base, "size"), f"{size // 512}\n")
+            write(os.path.join(base, "queue", "rotational"), "0\n")
+            if model and disk.startswith("mmc"):
+                # Cartões MMC/SD expõem o nome em device/name, não em device/model
+                write(os.path.join(base, "device", "name"), model)
+            elif model:
+                write(os.path.join(base, "device", "model"), f"{model}   \n")
+            write(os.path.join(self.dev, disk), "")
+            for part, number in parts.items():
+                write(os.path.join(base, part, "partition"), f"{number}\n")
+                write(os.path.join(self.dev, part), "")
+        os.makedirs(os.path.join(self.dev, "disk", "by-uuid"))
+        self.topology = BlockTopology(sysfs=self.sysfs, dev=self.dev)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def link_uuid(self, uuid, part):
+        os.symlink(f"../../{part}", os.path.join(self.dev, "disk", "by-uuid", uuid))
+
+    def test_list_disks_filters_virtual_and_empty(self):
+        disks = self.topology.list_disks()
+        self.assertEqual([d["name"] for d in disks], ["mmcblk0", "nvme0n1", "sda"])
+        sda = next(d for d in disks if d["name"] == "sda")
+        self.assertEqual(sda["size_bytes"], 500 * GIB)
+        self.assertEqual(sda["size"], "500.0G")
+        self.assertEqual(sda["model"], "Samsung SSD")
+        self.assertEqual(next(d for d in disks if d["name"] == "mmcblk0")["model"], "SD32G")
+
+    def test_partitions_numbered_from_partition_files(self):
+        parts = self.topology.partitions(os.path.join(self.dev, "nvme0n1"))
+        self.assertEqual(parts, {1: os.path.join(self.dev, "nvme0n1p1"),
+                                 2: os.path.join(self.dev, "nvme0n1p2")})
+        # "queue" e "device" não têm arquivo partition
+        self.assertEqual(sorted(self.topology.partitions(os.path.join(self.dev, "sda"))), [1, 2])
+
+    def test_partition_names(self):
+        for disk, number, expected in [("sda", 2, "sda2"), ("nvme0n1", 1, "nvme0n1p1"),
+                                       ("mmcblk0", 1, "mmcblk0p1"), ("loop0", 1, "loop0p1")]:
+            path = os.path.join(self.dev, disk)
+            self.assertEqual(self.topology.partition(path, number), os.path.join(self.dev, expected))
+
+    def test_partition_naming_rule_without_sysfs_entry(self):
+        # Partição que o kernel ainda não anunciou: vale a regra de nomes
+        self.assertEqual(self.topology.partition(os.path.join(self.dev, "sda"), 3),
+                         os.path.join(self.dev, "sda3"))
+        self.assertEqual(self.topology.partition(os.path.join(self.dev, "nvme0n1"), 3),
+                         os.path.join(self.dev, "nvme0n1p3"))
+        self.assertEqual(self.topology.partition(os.path.join(self.dev, "mmcblk0"), 2),
+                         os.path.join(self.dev, "mmcblk0p2"))
+
+    def test_uuid_cached_until_invalidate(self):
+        self.link_uuid("1111-AAAA", "sda1")
+        self.assertEqual(self.topology.uuid(os.path.join(self.dev, "sda1")), "1111-AAAA")
+        self.assertIsNone(self.topology.uuid(os.path.join(self.dev, "sda2")))
+
+        # Novo sistema de arquivos: o cache só o enxerga depois de invalidate()
+        self.link_uuid("2222-BBBB", "sda2")
+        self.assertIsNone(self.topology.uuid(os.path.join(self.dev, "sda2")))
+        self.topology.invalidate()
+        self.assertEqual(self.topology.uuid(os.path.join(self.dev, "sda2")), "2222-BBBB")
+
+    def test_stale_duplicate_link_is_ambiguous(self):
+        # Reinstalação: o udev ainda não removeu o link do sistema de arquivos antigo
+        self.link_uuid("old-uuid", "sda1")
+        self.link_uuid("new-uuid", "sda1")
+        self.link_uuid("3333-CCCC", "sda2")
+        self.assertIsNone(self.topology.uuid(os.path.join(self.dev, "sda1")))
+        self.assertEqual(self.topology.uuid(os.path.join(self.dev, "sda2")), "3333-CCCC")
+
+        os.remove(os.path.join(self.dev, "disk", "by-uuid", "old-uuid"))
+        self.topology.invalidate()
+        self.assertEqual(self.topology.uuid(os.path.join(self.dev, "sda1")), "new-uuid")
+
+    def test_queue_attribute(self):
+        self.assertEqual(self.topology.queue(os.path.join(self.dev, "sda"), "rotational"), "0")
+        self.assertEqual(self.topology.queue(os.path.join(self.dev, "sda"), "missing", "x"), "x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Plano do --dry-run gravado com --record comparado a um arquivo golden.
+
+Para atualizar o golden após uma mudança intencional no plano:
+    TOCA_UPDATE_GOLDEN=1 python3 -m pytest tests/test_dry_run.py
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INSTALLER = os.path.join(ROOT, "tocainstall.py")
+GOLDEN = os.path.join(ROOT, "tests", "golden", "dry_run_luks_swap.json")
+
+sys.path.insert(0, ROOT)
+from tocainstall import DryRunExecutor, LuksTuning, System, TocaInstaller  # noqa: E402
+
+ANSWERS = """\
+hostname = "toca-golden"
+suite = "bookworm"
+[luks]
+enabled = true
+password = "segredo"
+[user]
+name = "tocauser"
+password_hash = "$6$golden$hash"
+[partitions]
+swap_mib = 1024
+"""
+
+# Área descartável do ensaio: o nome muda a cada execução
+SCRATCH = re.compile(re.escape(tempfile.gettempdir()) + r"/tocainstall-dry-run-\w+")
+
+
+def record_plan(workdir, *extra):
+    answers = os.path.join(workdir, "answers.toml")
+    with open(answers, "w") as f:
+        f.write(ANSWERS)
+    record = os.path.join(workdir, "plan.json")
+    result = subprocess.run(
+        [sys.executable, INSTALLER, "--dry-run", "--answers", answers,
+         "--target", "/dev/toca-golden", "--record", record] + list(extra),
+        stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise AssertionError(f"o ensaio falhou ({result.returncode}):\n{result.stdout}\n{result.stderr}")
+    with open(record) as f:
+        return json.loads(SCRATCH.sub("<scratch>", f.read()))
+
+
+class DryRunPlanTest(unittest.TestCase):
+
+    def test_plan_matches_golden(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            plan = record_plan(workdir)
+        if os.environ.get("TOCA_UPDATE_GOLDEN"):
+            with open(GOLDEN, "w") as f:
+                json.dump(plan, f, indent=1, ensure_ascii=False)
+                f.write("\n")
+        with open(GOLDEN) as f:
+            golden = json.load(f)
+        self.assertEqual(plan, golden)
+
+    def test_plan_is_deterministic(self):
+        with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+            self.assertEqual(record_plan(a), record_plan(b))
+
+    def test_passwords_stay_out_of_the_plan(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            plan = record_plan(workdir)
+        self.assertNotIn("segredo", json.dumps(plan))
+        luks = [e for e in plan if "cmd" in e and e["cmd"][:2] == ["cryptsetup", "luksFormat"]]
+        self.assertEqual(len(luks), 1)
+        self.assertTrue(luks[0]["stdin"])
+
+
+class SwapCipherPlanTest(unittest.TestCase):
+    """Linha da swap no crypttab conforme a cifra escolhida no ensaio."""
+
+    def crypttab_line(self, aes_ni):
+        executor, System.executor = System.executor, DryRunExecutor(out=io.StringIO())
+        try:
+            with mock.patch.object(LuksTuning, "DRY_RUN_AES_NI", aes_ni), \
+                    mock.patch("sys.stdout", io.StringIO()):
+                installer = TocaInstaller()
+                installer.use_luks = True
+                installer.disk = "/dev/toca-golden"
+                installer.root_part = "/dev/toca-golden3"
+                installer.swap_part = "/dev/toca-golden2"
+                installer.setup_luks_if_enabled()
+                script = installer.machine_script()
+        finally:
+            System.executor = executor
+        lines = [line for line in script.splitlines() if "cryptswap" in line]
+        self.assertEqual(len(lines), 1)
+        return lines[0]
+
+    def test_adiantum_comma_is_escaped(self):
+        line = self.crypttab_line(aes_ni=False)
+        self.assertIn("swap,cipher=xchacha12\\,aes-adiantum-plain64,size=256\"", line)
+
+    def test_aes_xts_with_aes_ni(self):
+        line = self.crypttab_line(aes_ni=True)
+        self.assertIn("swap,cipher=aes-xts-plain64,size=512\"", line)
+
+
+class OfflineRepoPackagesTest(unittest.TestCase):
+    """O repositório offline leva todos os compressores de initramfs."""
+
+    def install_line(self, **fields):
+        installer = TocaInstaller()
+        for name, value in fields.items():
+            setattr(installer, name, value)
+        line = next(line for line in installer.base_script().splitlines() if "apt-get install -s" in line)
+        return line.split()
+
+    def test_offline_build_has_every_compressor(self):
+        words = self.install_line(offline_build_dir="/media/repo")
+        for package in TocaInstaller.INITRAMFS_COMPRESSORS.values():
+            self.assertEqual(words.count(package), 1, package)
+        self.assertIn("cryptsetup-initramfs", words)
+
+    def test_regular_install_has_only_the_chosen_compressor(self):
+        words = self.install_line(initramfs_compress="lz4")
+        self.assertIn("lz4", words)
+        for package in ("zstd", "xz-utils", "gzip"):
+            self.assertNotIn(package, words)
+
+
+class NetworkConnectionsTest(unittest.TestCase):
+
+    def test_copied_private_into_existing_dir(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            src, dest = os.path.join(workdir, "host"), os.path.join(workdir, "alvo")
+            os.makedirs(src)
+            os.makedirs(dest)
+            with open(os.path.join(src, "casa.nmconnection"), "w") as f:
+                f.write("psk=segredo\n")
+            os.chmod(os.path.join(src, "casa.nmconnection"), 0o644)
+            with mock.patch("sys.stdout", io.StringIO()):
+                TocaInstaller.copy_connections(src, dest)
+                TocaInstaller.copy_connections(os.path.join(workdir, "nada"), dest)
+            self.assertEqual(os.listdir(dest), ["casa.nmconnection"])
+            self.assertEqual(os.stat(os.path.join(dest, "casa.nmconnection")).st_mode & 0o777, 0o600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+"""Executor: tempo de CPU por comando com comandos concorrentes."""
+
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import System, TRACER  # noqa: E402
+
+BUSY = "import time\nend = time.process_time() + 1.0\nwhile time.process_time() < end: pass"
+
+
+class CommandCpuTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(System, "log")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def span(self, label):
+        return next(s for s in reversed(TRACER.spans) if s["name"] == label)["args"]
+
+    def test_cpu_is_billed_to_its_own_command(self):
+        busy = [sys.executable, "-c", BUSY]
+        worker = threading.Thread(target=System.execute, args=(busy,))
+        worker.start()
+        returncode, _, _ = System.execute(["sleep", "1.5"])
+        worker.join()
+        self.assertEqual(returncode, 0)
+        self.assertLess(self.span("sleep 1.5")["cpu_s"], 0.2)
+        self.assertGreater(self.span(" ".join(busy))["cpu_s"], 0.8)
+
+    def test_exit_status(self):
+        self.assertEqual(System.execute(["sh", "-c", "exit 3"])[0], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""MirrorProbe contra espelhos HTTP locais com atrasos controlados."""
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import MirrorProbe  # noqa: E402
+
+SUITE = "bookworm"
+
+
+def start_mirror(delay, suite=SUITE, sample=64 * 1024):
+    """Sobe um espelho falso que espera `delay` segundos antes de cada resposta."""
+    files = {
+        f"/debian/dists/{SUITE}/Release": f"Suite: stable\nCodename: {suite}\n".encode(),
+        f"/debian/dists/{SUITE}/main/binary-amd64/Packages.xz": os.urandom(sample),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            body = files.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/debian"
+
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/debian"
+
+
+class MirrorProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def mirror(self, delay, **kwargs):
+        server, url = start_mirror(delay, **kwargs)
+        self.servers.append(server)
+        return url
+
+    def test_fastest_mirror_first(self):
+        slow, medium, fast = self.mirror(0.6), self.mirror(0.3), self.mirror(0.0)
+        results = MirrorProbe([slow, medium, fast], SUITE, timeout=5.0).run()
+        self.assertEqual([r["mirror"] for r in results], [fast, medium, slow])
+        self.assertTrue(all(r["healthy"] for r in results))
+        self.assertTrue(all(r["throughput"] > 0 for r in results))
+
+    def test_probes_run_concurrently(self):
+        mirrors = [self.mirror(0.5) for _ in range(3)]
+        start = time.monotonic()
+        MirrorProbe(mirrors, SUITE, timeout=5.0).run()
+        # Duas requisições de 0,5 s por espelho: em série seriam 3 s
+        self.assertLess(time.monotonic() - start, 2.0)
+
+    def test_unhealthy_mirrors_go_last(self):
+        good = self.mirror(0.2)
+        wrong_suite = self.mirror(0.0, suite="bullseye")
+        down = closed_port_url()
+        results = MirrorProbe([down, wrong_suite, good], SUITE, timeout=5.0).run()
+        self.assertEqual(results[0]["mirror"], good)
+        self.assertTrue(results[0]["healthy"])
+        self.assertEqual({r["mirror"] for r in results[1:]}, {down, wrong_suite})
+        self.assertFalse(any(r["healthy"] for r in results[1:]))
+        self.assertTrue(all(r.get("error") for r in results[1:]))
+
+    def test_timeout(self):
+        stalled = self.mirror(2.0)
+        result, = MirrorProbe([stalled], SUITE, timeout=0.5).run()
+        self.assertFalse(result["healthy"])
+        self.assertIn("Timeout", result["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""PackageCache contra um diretório de cache temporário e índices Packages falsos."""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import PackageCache  # noqa: E402
+
+# chave: conteúdo do .deb falso
+DEBS = {
+    "bash_5.2.15-2+b2_amd64": b"bash" * 1000,
+    "libc6_2.36-9+deb12u4_amd64": b"libc" * 3000,
+    "tzdata_2024a-0+deb12u1_all": b"tzdata" * 500,
+    "dpkg_1:1.21.22_amd64": b"dpkg" * 2000,
+}
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb" if isinstance(content, bytes) else "w") as f:
+        f.write(content)
+
+
+def stanza(key, sha256):
+    package, version, arch = key.split("_")
+    return f"Package: {package}\nVersion: {version}\nArchitecture: {arch}\n" \
+           f"Description: teste\n continuação\nSHA256: {sha256}\n"
+
+
+class PackageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "cache")
+        self.lists = os.path.join(self.tmp.name, "lists")
+        self.archives = os.path.join(self.tmp.name, "archives")
+        # O último stanza fica sem linha em branco no fim, como em alguns índices
+        write(os.path.join(self.lists, "deb.debian.org_debian_dists_bookworm_main_binary-amd64_Packages"),
+              "\n".join(stanza(k, digest(v)) for k, v in DEBS.items()).rstrip("\n"))
+        write(os.path.join(self.lists, "deb.debian.org_debian_dists_bookworm_Release"),
+              stanza("bash_5.2.15-2+b2_amd64", "0" * 64))
+        for key, data in DEBS.items():
+            write(os.path.join(self.archives, PackageCache.deb_filename(key)), data)
+        write(os.path.join(self.archives, "lock"), "")
+        self.expected = PackageCache.read_packages_hashes(self.lists)
+        self.installed = set(DEBS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache(self, max_bytes=1 << 30):
+        return PackageCache(self.root, max_bytes)
+
+    def test_deb_key_and_filename(self):
+        self.assertEqual(PackageCache.deb_key("/x/dpkg_1%3a1.21.22_amd64.deb"), "dpkg_1:1.21.22_amd64")
+        self.assertEqual(PackageCache.deb_filename("dpkg_1:1.21.22_amd64"), "dpkg_1%3a1.21.22_amd64.deb")
+        self.assertIsNone(PackageCache.deb_key("lock"))
+        self.assertIsNone(PackageCache.deb_key("pacote-1.0.deb"))
+
+    def test_read_packages_hashes(self):
+        self.assertEqual(self.expected, {k: digest(v) for k, v in DEBS.items()})
+        self.assertEqual(PackageCache.read_packages_hashes(os.path.join(self.tmp.name, "nada")), {})
+
+    def test_read_installed(self):
+        status = os.path.join(self.tmp.name, "status")
+        write(status, "Package: bash\nStatus: install ok installed\nArchitecture: amd64\nVersion: 5.2.15-2+b2\n\n"
+                      "Package: vim\nStatus: deinstall ok config-files\nArchitecture: amd64\nVersion: 2:9.0\n")
+        self.assertEqual(PackageCache.read_installed(status), {"bash_5.2.15-2+b2_amd64"})
+
+    def test_first_run_misses_then_hits(self):
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, self.installed)
+        self.assertEqual((cache.hits, cache.misses, cache.rejected), (0, len(DEBS), 0))
+        for key, data in DEBS.items():
+            with open(cache.blob_path(cache.index[key]), "rb") as f:
+                self.assertEqual(f.read(), data)
+        cache.save()
+
+        again = self.cache()
+        self.assertEqual(again.index, cache.index)
+        again.absorb(self.archives, self.expected, self.installed)
+        self.assertEqual((again.hits, again.misses), (len(DEBS), 0))
+
+    def test_each_package_counted_once_per_run(self):
+        # O seed põe o mesmo pacote na área do debootstrap e na do apt
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, self.installed)
+        bootstrap = os.path.join(self.tmp.name, "debootstrap")
+        cache.seed(bootstrap)
+        cache.absorb(bootstrap, self.expected, self.installed)
+        cache.absorb(self.archives, self.expected, self.installed)
+        self.assertEqual((cache.hits, cache.misses), (0, len(DEBS)))
+
+    def test_unknown_or_mismatched_hash_rejected(self):
+        write(os.path.join(self.archives, "bash_5.2.15-2+b2_amd64.deb"), b"adulterado")
+        write(os.path.join(self.archives, "extra_1.0_all.deb"), b"fora do espelho")
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, self.installed | {"extra_1.0_all"})
+        self.assertEqual(cache.rejected, 2)
+        self.assertNotIn("bash_5.2.15-2+b2_amd64", cache.index)
+        self.assertNotIn("extra_1.0_all", cache.index)
+
+    def test_packages_not_installed_are_ignored(self):
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, {"bash_5.2.15-2+b2_amd64"})
+        self.assertEqual((cache.hits, cache.misses, cache.rejected), (0, 1, 0))
+        self.assertEqual(list(cache.index), ["bash_5.2.15-2+b2_amd64"])
+
+    def test_seed_links_cached_packages(self):
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, self.installed)
+        dest = os.path.join(self.tmp.name, "seeded")
+        write(os.path.join(dest, "bash_5.2.15-2+b2_amd64.deb"), b"local")
+        cache.seed(dest)
+        self.assertEqual(sorted(os.listdir(dest)), sorted(PackageCache.deb_filename(k) for k in DEBS))
+        # Arquivos que já estão no destino não são trocados
+        with open(os.path.join(dest, "bash_5.2.15-2+b2_amd64.deb"), "rb") as f:
+            self.assertEqual(f.read(), b"local")
+
+    def test_evict_least_recently_used(self):
+        cache = self.cache()
+        cache.absorb(self.archives, self.expected, self.installed)
+        for age, key in enumerate(["libc6_2.36-9+deb12u4_amd64", "dpkg_1:1.21.22_amd64",
+                                   "bash_5.2.15-2+b2_amd64", "tzdata_2024a-0+deb12u1_all"]):
+            os.utime(cache.blob_path(cache.index[key]), (1000 + age, 1000 + age))
+        cache.max_bytes = len(DEBS["bash_5.2.15-2+b2_amd64"]) + len(DEBS["tzdata_2024a-0+deb12u1_all"])
+        total = cache.evict()
+        self.assertEqual(total, cache.max_bytes)
+        self.assertEqual(sorted(cache.index), ["bash_5.2.15-2+b2_amd64", "tzdata_2024a-0+deb12u1_all"])
+
+    def test_evict_keeps_what_the_last_run_installed(self):
+        first = self.cache()
+        first.absorb(self.archives, self.expected, self.installed)
+        first.save()
+        time.sleep(0.05)
+
+        # Nova instalação: o seed oferece tudo, mas só bash e tzdata são instalados
+        cache = self.cache()
+        staging = os.path.join(self.tmp.name, "staging")
+        cache.seed(staging)
+        used = {"bash_5.2.15-2+b2_amd64", "tzdata_2024a-0+deb12u1_all"}
+        cache.absorb(staging, self.expected, used)
+        # A marca de uso é o mtime (vale também num volume noatime), só dos instalados
+        mtimes = {key: os.stat(cache.blob_path(digest)).st_mtime for key, digest in cache.index.items()}
+        self.assertGreater(min(mtimes[key] for key in used),
+                           max(mtime for key, mtime in mtimes.items() if key not in used))
+        cache.max_bytes = sum(len(DEBS[key]) for key in used)
+        self.assertEqual(cache.evict(), cache.max_bytes)
+        self.assertEqual(set(cache.index), used)
+
+    def test_corrupt_index_starts_empty(self):
+        write(os.path.join(self.root, "index.json"), "{")
+        self.assertEqual(self.cache().index, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
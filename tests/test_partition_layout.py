@@ -0,0 +1,72 @@
+"""PartitionLayout: script do sfdisk reproduzível e tabelas idênticas em imagens esparsas."""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import PartitionLayout, PackageCache  # noqa: E402
+
+SEEDED_SCRIPT = """\
+label: gpt
+grain: 1048576
+label-id: B449121B-F9ED-5CC3-A390-D00B3921252F
+size=512MiB, type=U, name="ESP", uuid=A3DEC243-3E22-53CA-B03C-343C6745391C
+size=1024MiB, type=S, name="swap", uuid=60F5C1D4-8ABF-59A0-9FB4-085D5EA8E7EB
+type=L, name="root", uuid=CE3A9341-5966-5437-A3D8-5EB93E12B468
+"""
+
+
+class PartitionLayoutTest(unittest.TestCase):
+
+    def test_seeded_script(self):
+        layout = PartitionLayout(esp_mib=512, swap_mib=1024, seed="lab-01")
+        self.assertEqual(layout.sfdisk_script(), SEEDED_SCRIPT)
+
+    def test_seed_changes_every_guid(self):
+        a = PartitionLayout(seed="lab-01").sfdisk_script()
+        b = PartitionLayout(seed="lab-02").sfdisk_script()
+        guid = r"[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}"
+        self.assertEqual(len(set(re.findall(guid, a))), 3)
+        self.assertFalse(set(re.findall(guid, a)) & set(re.findall(guid, b)))
+
+    def test_unseeded_script_leaves_guids_to_sfdisk(self):
+        script = PartitionLayout().sfdisk_script()
+        self.assertNotIn("uuid=", script)
+        self.assertNotIn("label-id", script)
+
+    def test_numbers_follow_disk_order(self):
+        layout = PartitionLayout(swap_mib=512, extra=[("data", 2048)])
+        self.assertEqual([layout.number(n) for n in ("ESP", "data", "swap", "root")], [1, 2, 3, 4])
+        self.assertIsNone(PartitionLayout().number("swap"))
+
+    def test_invalid_sizes_refused_before_wipe(self):
+        with tempfile.NamedTemporaryFile() as image:
+            image.write(b"\xff" * PartitionLayout.MIB)
+            image.flush()
+            for layout in (PartitionLayout(esp_mib=50), PartitionLayout(swap_mib=-5),
+                           PartitionLayout(extra=[("data", 0)])):
+                with self.assertRaises(RuntimeError):
+                    layout.apply(image.name)
+            image.seek(0)
+            self.assertEqual(image.read(), b"\xff" * PartitionLayout.MIB)
+
+    @unittest.skipUnless(shutil.which("sfdisk"), "sfdisk não instalado")
+    def test_seeded_apply_is_byte_identical(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            images = []
+            for name in ("a.img", "b.img"):
+                path = os.path.join(workdir, name)
+                with open(path, "wb") as f:
+                    f.truncate(1024 * PartitionLayout.MIB)
+                PartitionLayout(esp_mib=512, swap_mib=256, seed="lab-01").apply(path)
+                images.append(path)
+            # Inclui a GPT secundária no fim do disco
+            self.assertEqual(PackageCache.sha256(images[0]), PackageCache.sha256(images[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
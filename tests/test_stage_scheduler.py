@@ -0,0 +1,68 @@
+"""StageScheduler: ordem do DAG e encerramento das etapas em andamento ao abortar."""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tocainstall import Stage, StageScheduler, System  # noqa: E402
+
+
+class StageSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(System, "log")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dependencies_run_first(self):
+        order = []
+        stages = [
+            Stage("c", lambda: order.append("c"), ["b"], ["fim"]),
+            Stage("a", lambda: order.append("a"), provides=["a"]),
+            Stage("b", lambda: order.append("b"), ["a"], ["b"]),
+        ]
+        StageScheduler(stages).run()
+        self.assertEqual(order, ["a", "b", "c"])
+
+    def test_missing_dependency_is_reported(self):
+        with self.assertRaises(RuntimeError):
+            StageScheduler([Stage("a", lambda: None, ["nada"], ["a"])]).run()
+
+    def test_exit_stops_running_stages(self):
+        def confirm():
+            time.sleep(0.2)
+            sys.exit(0)
+
+        started = time.monotonic()
+        stages = [
+            Stage("lenta", lambda: System.run(["sleep", "4"], check=False), provides=["pacotes"]),
+            Stage("confirma", confirm, provides=["disco"], interactive=True),
+        ]
+        with self.assertRaises(SystemExit):
+            StageScheduler(stages).run()
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertFalse(System.executor.children)
+        # Depois de abortar, o finalize ainda precisa executar comandos
+        self.assertEqual(System.run(["true"]), "")
+
+    def test_failure_stops_running_stages(self):
+        def fail():
+            time.sleep(0.2)
+            raise RuntimeError("falhou")
+
+        started = time.monotonic()
+        stages = [
+            Stage("lenta", lambda: System.run(["sh", "-c", "sleep 4; sleep 4"], check=False),
+                  provides=["pacotes"]),
+            Stage("falha", fail, provides=["disco"]),
+        ]
+        with self.assertRaises(RuntimeError):
+            StageScheduler(stages).run()
+        self.assertLess(time.monotonic() - started, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
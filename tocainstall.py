@@ -6,11 +6,54 @@ import json
 import shutil
 import time
 import getpass
+import hashlib
+import tempfile
+import atexit
+import gzip
+import glob
+import argparse
+import copy
+import resource
+import threading
+import selectors
+import select
+import stat
+import ctypes
+import errno
+import uuid
+import asyncio
+import ssl
+import re
+import shlex
+import signal
+import secrets
+from urllib.parse import urlsplit
+from email.utils import formatdate
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # O ponto de montagem para a instalação.
 MOUNT_POINT = "/mnt/toca_install"
 # O nome para o dispositivo mapeado pelo LUKS.
 MAPPER_NAME = "cryptroot"
+# Ponto de montagem temporário do nível superior (subvolid=5) do BTRFS.
+TOPLEVEL_MOUNT = "/mnt/tmp_btrfs"
+# Cache persistente de pacotes .deb compartilhado entre instalações.
+CACHE_DIR = os.environ.get("TOCA_CACHE_DIR", "/var/cache/tocainstall")
+# Tamanho máximo do cache antes da remoção dos pacotes menos usados.
+CACHE_MAX_BYTES = int(os.environ.get("TOCA_CACHE_MAX_MB", "4096")) * 1024 * 1024
+# Espelhos Debian candidatos para a seleção automática.
+DEFAULT_MIRRORS = [
+    "http://deb.debian.org/debian",
+    "http://ftp.br.debian.org/debian",
+    "http://ftp.us.debian.org/debian",
+    "http://ftp.de.debian.org/debian",
+]
+# Diário das etapas concluídas, usado por --resume.
+JOURNAL_PATH = os.environ.get("TOCA_JOURNAL", "/var/lib/tocainstall/journal.json")
+# Log com a saída completa de todos os comandos executados.
+LOG_PATH = os.environ.get("TOCA_LOG", "/var/log/tocainstall.log")
 
 class Style:
     HEADER = '\033[95m'
@@ -21,77 +64,2111 @@ class Style:
     BOLD = '\033[1m'
     RESET = '\033[0m'
 
-class System:
+class Tracer:
+    """Coleta intervalos de tempo (etapas e comandos) no formato Chrome trace.
+
+    O tempo de CPU de um comando é o do próprio filho (os.wait4 em
+    Executor.spawn). Nos demais intervalos (etapas) vem de
+    getrusage(RUSAGE_CHILDREN), que é global ao processo e inclui os
+    filhos concorrentes.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.origin = time.time()
+        self.lock = threading.Lock()
+
     @staticmethod
-    def run(cmd, shell=False, input_text=None, check=True):
-        """Executa um comando de sistema e retorna a saída."""
+    def children_cpu():
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        """Mede o bloco; o dicionário retornado aceita atributos extras (inclusive cpu_s)."""
+        start, cpu = time.time(), self.children_cpu()
         try:
-            # Usamos subprocess.run para mais controle.
-            result = subprocess.run(
+            yield args
+        finally:
+            args.setdefault("cpu_s", round(self.children_cpu() - cpu, 6))
+            self.record(name, cat, start, time.time() - start, **args)
+
+    def record(self, name, cat, start, wall, **args):
+        """Registra um intervalo já medido (ex.: relatado por um script do chroot)."""
+        args["wall_s"] = round(wall, 6)
+        args.setdefault("cpu_s", 0.0)
+        with self.lock:
+            self.spans.append({
+                "name": name, "cat": cat, "ph": "X",
+                "ts": int((start - self.origin) * 1e6), "dur": int(wall * 1e6),
+                "pid": os.getpid(), "tid": threading.get_ident(), "args": args,
+            })
+
+    def write(self, path):
+        """Grava os intervalos em JSON (carregável em chrome://tracing ou Perfetto).
+
+        O arquivo é criado com modo 0600: as linhas de comando podem conter
+        dados do usuário (os segredos já chegam mascarados por System.execute).
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"traceEvents": self.spans, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, top=10):
+        """Tabela com os comandos mais demorados e os totais por categoria."""
+        lines = [f"  {'Comando':<52} {'status':>6} {'parede':>9} {'CPU':>9} {'saída':>10}"]
+        commands = [s for s in self.spans if s["cat"] == "comando"]
+        for s in sorted(commands, key=lambda s: s["dur"], reverse=True)[:top]:
+            a = s["args"]
+            lines.append(f"  {s['name'][:52]:<52} {str(a.get('returncode', '-')):>6} "
+                         f"{a['wall_s']:8.2f}s {a['cpu_s']:8.2f}s {a.get('bytes', 0):>9}B")
+        total = sum(s["args"]["wall_s"] for s in commands)
+        lines.append(f"  {len(commands)} comandos, {total:.1f}s somados")
+        for s in (s for s in self.spans if s["cat"] == "chroot"):
+            lines.append(f"  chroot: {s['name']:<44} {s['args']['wall_s']:8.2f}s")
+        for s in (s for s in self.spans if s["cat"] == "espera"):
+            lines.append(f"  espera: {s['name']:<44} {s['args']['wall_s']:8.2f}s")
+        return "\n".join(lines)
+
+# Registro de tempos de toda a execução.
+TRACER = Tracer()
+
+class ProgressParser:
+    """Extrai o progresso das linhas do debootstrap, do apt (Status-Fd) e do dpkg."""
+
+    # Fases do debootstrap e a faixa percentual que cada uma ocupa.
+    DEBOOTSTRAP_PHASES = {
+        "Retrieving": (0, 45), "Validating": (0, 45),
+        "Extracting": (45, 60), "Unpacking": (60, 80), "Configuring": (80, 100),
+    }
+    # Estimativa de pacotes do minbase até a contagem real ser conhecida.
+    DEBOOTSTRAP_EXPECTED = 100
+
+    def __init__(self):
+        self.percent = None
+        self.label = ""
+        self.counts = {}
+        self.total = 0
+
+    def feed(self, line):
+        """Atualiza o progresso; retorna True se a linha é só de status."""
+        if line.startswith("TOCA-TIMING "):
+            # Tempo de uma etapa do chroot: TOCA-TIMING nome início fim [chave=valor...]
+            parts = line.split()
+            if len(parts) >= 4:
+                try:
+                    start, end = float(parts[2]), float(parts[3])
+                    extra = dict(p.split("=", 1) for p in parts[4:] if "=" in p)
+                    TRACER.record(parts[1], "chroot", start, end - start, **extra)
+                except ValueError:
+                    pass
+            return True
+
+        if line.startswith(("dlstatus:", "pmstatus:")):
+            # Formato do APT::Status-Fd: tipo:pacote:porcentagem:descrição
+            parts = line.split(":", 3)
+            if len(parts) == 4:
+                try:
+                    pct = float(parts[2])
+                except ValueError:
+                    return True
+                self.percent = pct / 2 if parts[0] == "dlstatus" else 50 + pct / 2
+                self.label = parts[3]
+            return True
+
+        if line.startswith("I: "):
+            words = line[3:].split()
+            phase = words[0] if words else ""
+            if phase in self.DEBOOTSTRAP_PHASES and len(words) >= 2 and words[1][:1].islower():
+                self.counts[phase] = self.counts.get(phase, 0) + 1
+                fetched = max(self.counts.get("Retrieving", 0), self.counts.get("Validating", 0))
+                self.total = max(self.total, fetched)
+                expected = self.total if phase not in ("Retrieving", "Validating") else max(
+                    self.total, self.DEBOOTSTRAP_EXPECTED)
+                low, high = self.DEBOOTSTRAP_PHASES[phase]
+                self.percent = low + (high - low) * min(1.0, self.counts[phase] / max(expected, 1))
+            self.label = line[3:]
+            return False
+
+        if line.startswith(("Unpacking ", "Setting up ", "Preparing to unpack ")):
+            self.label = line
+        elif line.strip():
+            self.label = line.strip()
+        return False
+
+class ProgressBar:
+    """Barra de progresso de uma linha com ETA (só em terminais)."""
+
+    def __init__(self, title):
+        self.title = title
+        self.start = time.monotonic()
+        self.base = self.start
+        self.last_percent = 0.0
+        self.last_draw = 0.0
+        self.tty = sys.stderr.isatty()
+
+    def update(self, percent, label):
+        now = time.monotonic()
+        if percent is not None and percent < self.last_percent:
+            # Novo apt-get dentro do mesmo script: recomeça a estimativa
+            self.base = now
+        if percent is not None:
+            self.last_percent = percent
+        if not self.tty or now - self.last_draw < 0.1:
+            return
+        self.last_draw = now
+        elapsed = now - self.start
+        if percent:
+            eta = (now - self.base) * (100 - percent) / percent
+            filled = int(percent / 100 * 30)
+            bar = f"[{'#' * filled}{'.' * (30 - filled)}] {percent:5.1f}% ETA {int(eta) // 60}m{int(eta) % 60:02d}s"
+        else:
+            bar = f"[{int(elapsed) // 60}m{int(elapsed) % 60:02d}s]"
+        width = shutil.get_terminal_size().columns
+        text = f"{self.title} {bar} {label}"[:width - 1]
+        sys.stderr.write(f"\r{text}\033[K")
+        sys.stderr.flush()
+
+    def close(self):
+        if self.tty:
+            sys.stderr.write("\r\033[K")
+            sys.stderr.flush()
+
+class BlockTopology:
+    """Topologia de dispositivos de bloco lida diretamente do sysfs e do /dev.
+
+    Substitui lsblk/blkid: discos vêm de /sys/block, partições do arquivo
+    "partition" em /sys/class/block e UUIDs dos links de /dev/disk/by-uuid.
+    O resultado fica em cache até invalidate() (após particionar ou formatar).
+    As raízes são configuráveis para testes com uma árvore sysfs falsa.
+    """
+
+    # Dispositivos de /sys/block que o lsblk não classifica como "disk".
+    IGNORED = re.compile(r"^(loop|ram|zram|dm-|md|sr|fd|nbd)|(boot\d+|rpmb)$")
+
+    def __init__(self, sysfs="/sys", dev="/dev"):
+        self.sysfs = sysfs
+        self.dev = dev
+        self.lock = threading.Lock()
+        self._disks = None
+        self._uuids = None
+
+    def invalidate(self):
+        """Descarta o cache; chamar depois de eventos de partição ou mkfs."""
+        with self.lock:
+            self._disks = None
+            self._uuids = None
+
+    def read(self, path, default=""):
+        try:
+            with open(os.path.join(self.sysfs, path)) as f:
+                return f.read().strip()
+        except OSError:
+            return default
+
+    @staticmethod
+    def human_size(size):
+        for unit in ("B", "K", "M", "G", "T"):
+            if size < 1024 or unit == "T":
+                return f"{size:.1f}{unit}" if unit != "B" else f"{size}B"
+            size /= 1024
+
+    def size(self, name):
+        """Tamanho em bytes (o sysfs conta setores de 512 bytes)."""
+        return int(self.read(f"block/{name}/size", "0") or 0) * 512
+
+    def queue(self, disk, attr, default=""):
+        """Atributo de /sys/block/<disco>/queue (rotational, physical_block_size...)."""
+        name = os.path.basename(os.path.realpath(disk))
+        return self.read(f"block/{name}/queue/{attr}", default)
+
+    def list_disks(self):
+        """Discos físicos no mesmo formato do antigo lsblk (name, size, model, type)."""
+        with self.lock:
+            if self._disks is None:
+                disks = []
+                block = os.path.join(self.sysfs, "block")
+                for name in sorted(os.listdir(block)) if os.path.isdir(block) else []:
+                    size = self.size(name)
+                    if self.IGNORED.search(name) or size == 0:
+                        continue
+                    model = self.read(f"block/{name}/device/model") or self.read(f"block/{name}/device/name")
+                    disks.append({"name": name, "size": self.human_size(size), "size_bytes": size,
+                                  "model": model or None, "type": "disk"})
+                self._disks = disks
+            return list(self._disks)
+
+    def partitions(self, disk):
+        """{número: caminho} das partições do disco, como o kernel as vê."""
+        name = os.path.basename(os.path.realpath(disk))
+        base = os.path.join(self.sysfs, "block", name)
+        parts = {}
+        for child in os.listdir(base) if os.path.isdir(base) else []:
+            number = self.read(f"block/{name}/{child}/partition")
+            if number.isdigit():
+                parts[int(number)] = os.path.join(self.dev, child)
+        return parts
+
+    def partition(self, disk, number):
+        """Caminho da partição pelo kernel; sem ela, aplica a regra de nomes do kernel."""
+        path = self.partitions(disk).get(number)
+        if path:
+            return path
+        # O kernel usa o sufixo "p" quando o nome do disco termina em dígito.
+        return f"{disk}p{number}" if disk[-1].isdigit() else f"{disk}{number}"
+
+    def uuid(self, device):
+        """UUID do sistema de arquivos (ou LUKS) via /dev/disk/by-uuid.
+
+        Dois links para o mesmo dispositivo (o do sistema de arquivos antigo
+        ainda não removido pelo udev) deixam a resposta ambígua: retorna None.
+        """
+        with self.lock:
+            if self._uuids is None:
+                self._uuids = {}
+                by_uuid = os.path.join(self.dev, "disk", "by-uuid")
+                for uuid in sorted(os.listdir(by_uuid)) if os.path.isdir(by_uuid) else []:
+                    self._uuids.setdefault(os.path.realpath(os.path.join(by_uuid, uuid)), []).append(uuid)
+            uuids = self._uuids.get(os.path.realpath(device), [])
+            return uuids[0] if len(uuids) == 1 else None
+
+# Visão do kernel sobre os discos, compartilhada pelo instalador.
+BLOCK = BlockTopology()
+
+class Inotify:
+    """Observa um diretório via inotify (ctypes) para acordar esperas sem polling."""
+
+    IN_ATTRIB = 0x004
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, path, mask=IN_CREATE | IN_ATTRIB | IN_MOVED_TO):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch {path}")
+
+    def wait(self, timeout):
+        """Bloqueia até um evento ou o timeout; descarta os eventos lidos."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        os.close(self.fd)
+
+class Readiness:
+    """Espera condições reais (nós de dispositivo, estado da rede) com prazo.
+
+    Cada espera vira um intervalo "espera" no trace com o tempo gasto.
+    Com watch_dir, eventos inotify acordam a espera antes do próximo intervalo
+    do backoff exponencial.
+    """
+
+    @staticmethod
+    def wait_for(name, condition, timeout=30.0, watch_dir=None, interval=0.05, max_interval=1.0):
+        """Retorna os segundos gastos; TimeoutError se o prazo acabar."""
+        if not System.executor.live:
+            # Em ensaio nenhum dispositivo vai aparecer
+            return 0.0
+        start = time.monotonic()
+        watcher = None
+        if watch_dir:
+            try:
+                watcher = Inotify(watch_dir)
+            except OSError:
+                watcher = None
+        with TRACER.span(name, "espera", timeout=timeout) as span:
+            try:
+                while True:
+                    if condition():
+                        span["ok"] = True
+                        return time.monotonic() - start
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        span["ok"] = False
+                        raise TimeoutError(f"{name}: condição não satisfeita em {timeout:.1f}s")
+                    if watcher:
+                        watcher.wait(min(interval, remaining))
+                    else:
+                        time.sleep(min(interval, remaining))
+                    interval = min(interval * 2, max_interval)
+            finally:
+                if watcher:
+                    watcher.close()
+
+    @staticmethod
+    def is_block_device(path):
+        try:
+            return stat.S_ISBLK(os.stat(path).st_mode)
+        except OSError:
+            return False
+
+    @staticmethod
+    def wait_partitions(disk, numbers, timeout=30.0):
+        """Espera o kernel expor as partições e o udev criar os nós em /dev."""
+        def ready():
+            BLOCK.invalidate()
+            parts = BLOCK.partitions(disk)
+            return all(n in parts and Readiness.is_block_device(parts[n]) for n in numbers)
+
+        start = time.monotonic()
+        try:
+            # Normalmente a releitura feita pelo próprio particionador basta
+            return Readiness.wait_for(f"partições de {disk}", ready, min(2.0, timeout), watch_dir="/dev")
+        except TimeoutError:
+            # Ex.: loop sem partscan ou disco ocupado: pede a atualização ao kernel
+            System.run(["partx", "-u", disk], check=False)
+            Readiness.wait_for(f"partições de {disk} (partx)", ready, timeout - 2.0, watch_dir="/dev")
+            return time.monotonic() - start
+
+    @staticmethod
+    def udev_settle(timeout=30.0):
+        """Espera o udev processar os eventos pendentes (ex.: links by-uuid após um mkfs)."""
+        if not System.executor.live:
+            return 0.0
+        start = time.monotonic()
+        with TRACER.span("udev settle", "espera", timeout=timeout) as span:
+            try:
+                span["ok"] = System.run(["udevadm", "settle", f"--timeout={int(timeout)}"],
+                                        check=False) is not None
+            except OSError:
+                span["ok"] = False
+        return time.monotonic() - start
+
+    @staticmethod
+    def wait_device_connected(device, timeout=30.0):
+        """Espera o NetworkManager relatar o dispositivo como conectado (100)."""
+        def connected():
+            state = System.run(["nmcli", "-g", "GENERAL.STATE", "dev", "show", device], check=False)
+            return bool(state) and state.startswith("100")
+
+        return Readiness.wait_for(f"conexão de {device}", connected, timeout, interval=0.2)
+
+    @staticmethod
+    def wait_wifi_scan(timeout=15.0):
+        """Espera a varredura Wi-Fi trazer alguma rede; retorna a lista do nmcli."""
+        found = {}
+
+        def networks():
+            found["out"] = System.run(["nmcli", "-t", "-f", "SSID,SECURITY,BARS", "dev", "wifi", "list"],
+                                      check=False)
+            return bool(found["out"])
+
+        try:
+            Readiness.wait_for("varredura Wi-Fi", networks, timeout, interval=0.3)
+        except TimeoutError:
+            pass
+        return found.get("out")
+
+class Executor:
+    """Backend que executa de fato os comandos e efeitos do instalador.
+
+    As etapas passam por System.execute e System.effect, que delegam ao backend
+    em System.executor. DryRunExecutor só imprime o plano ordenado;
+    RecordingExecutor grava tudo em JSON para comparar com arquivos golden.
+    """
+
+    # False quando nada acontece de verdade (as esperas por dispositivos são puladas)
+    live = True
+
+    def __init__(self):
+        # Comandos em andamento, para encerrá-los se a instalação for abortada
+        self.children = set()
+        self.children_lock = threading.Lock()
+        self.cancelled = False
+
+    def spawn(self, cmd, shell, input_text, emit, shown=None):
+        """Executa cmd chamando emit(é_stdout, linha) a cada linha.
+
+        Retorna (código, bytes lidos, segundos de CPU do comando e dos filhos que ele esperou).
+
+        shown é o comando como pode ser exibido ou gravado (segredos mascarados).
+        Cada comando roda no seu próprio grupo de processos: cancel() encerra
+        também os filhos dele (ex.: o dpkg chamado pelo debootstrap).
+        """
+        with self.children_lock:
+            if self.cancelled:
+                emit(False, "cancelado: a instalação está sendo abortada")
+                return -signal.SIGTERM, 0
+            proc = subprocess.Popen(
                 cmd,
                 shell=shell,
-                check=check,
-                text=True,
-                input=input_text,
+                stdin=subprocess.PIPE if input_text is not None else subprocess.DEVNULL,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                stderr=subprocess.PIPE,
+                start_new_session=True
             )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
+            self.children.add(proc)
+        try:
+            if input_text is not None:
+                proc.stdin.write(input_text.encode())
+                proc.stdin.close()
+
+            total = 0
+            partial = {proc.stdout: b"", proc.stderr: b""}
+            sel = selectors.DefaultSelector()
+            sel.register(proc.stdout, selectors.EVENT_READ)
+            sel.register(proc.stderr, selectors.EVENT_READ)
+            while sel.get_map():
+                for key, _ in sel.select():
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        sel.unregister(key.fileobj)
+                        if partial[key.fileobj]:
+                            emit(key.fileobj is proc.stdout, partial[key.fileobj].decode(errors="replace"))
+                        continue
+                    total += len(chunk)
+                    # Ferramentas como mkfs e wget atualizam a linha com \r
+                    data = (partial[key.fileobj] + chunk).replace(b"\r", b"\n")
+                    *lines, partial[key.fileobj] = data.split(b"\n")
+                    for raw in lines:
+                        emit(key.fileobj is proc.stdout, raw.decode(errors="replace"))
+            sel.close()
+            # wait4 em vez de wait: o uso de CPU é só deste comando, não dos
+            # outros filhos que terminarem enquanto ele roda
+            try:
+                _, status, usage = os.wait4(proc.pid, 0)
+            except ChildProcessError:
+                # cancel() já o recolheu
+                return proc.wait(), total, 0.0
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return proc.returncode, total, usage.ru_utime + usage.ru_stime
+        except BaseException:
+            # Ctrl-C não chega a um grupo de processos separado: encerra o comando aqui
+            self.stop(proc)
+            raise
+        finally:
+            with self.children_lock:
+                self.children.discard(proc)
+
+    @staticmethod
+    def stop(proc, timeout=5.0):
+        """SIGTERM no grupo de processos do comando; SIGKILL se não sair a tempo."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                proc.wait(timeout=timeout)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+
+    def cancel(self):
+        """Encerra os comandos em andamento e recusa novos até resume()."""
+        with self.children_lock:
+            self.cancelled = True
+            children = list(self.children)
+        for proc in children:
+            self.stop(proc)
+
+    def resume(self):
+        with self.children_lock:
+            self.cancelled = False
+
+    def effect(self, description, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+class DryRunExecutor(Executor):
+    """Não executa nada: numera e imprime cada comando e efeito, na ordem."""
+
+    live = False
+
+    def __init__(self, out=None):
+        super().__init__()
+        self.out = out or sys.stdout
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def note(self, text):
+        with self.lock:
+            self.count += 1
+            print(f"{Style.BOLD}[plano {self.count:3d}]{Style.RESET} {text}", file=self.out)
+
+    def spawn(self, cmd, shell, input_text, emit, shown=None):
+        shown = cmd if shown is None else shown
+        label = shown if isinstance(shown, str) else shlex.join(shown)
+        # A entrada pode ter senhas: só o tamanho aparece no plano
+        stdin = f"  < ({len(input_text)} bytes)" if input_text is not None else ""
+        self.note(f"$ {label}{stdin}")
+        return 0, 0, 0.0
+
+    def effect(self, description, func, *args, **kwargs):
+        self.note(f"# {description}")
+        return None
+
+class RecordingExecutor(Executor):
+    """Repassa a outro backend e registra cada chamada (testes com arquivos golden)."""
+
+    def __init__(self, inner):
+        super().__init__()
+        self.inner = inner
+        self.live = inner.live
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def record(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def spawn(self, cmd, shell, input_text, emit, shown=None):
+        returncode, total, cpu = self.inner.spawn(cmd, shell, input_text, emit, shown)
+        shown = cmd if shown is None else shown
+        self.record({"cmd": shown if isinstance(shown, str) else list(shown), "shell": shell,
+                     "stdin": input_text is not None, "returncode": returncode})
+        return returncode, total, cpu
+
+    def effect(self, description, func, *args, **kwargs):
+        self.record({"effect": description})
+        return self.inner.effect(description, func, *args, **kwargs)
+
+    def cancel(self):
+        self.inner.cancel()
+
+    def resume(self):
+        self.inner.resume()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.entries, f, indent=1, ensure_ascii=False)
+
+class System:
+    # Backend dos comandos e efeitos (real, ensaio ou gravação)
+    executor = Executor()
+    # Sem barras de progresso (ex.: vários discos em paralelo); a saída vai só para o log.
+    quiet = False
+    # Arquivo de log compartilhado por todas as execuções (aberto sob demanda).
+    log_file = None
+    log_lock = threading.Lock()
+
+    @staticmethod
+    def log(text):
+        with System.log_lock:
+            if System.log_file is None:
+                try:
+                    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+                    # A saída dos comandos pode conter dados sensíveis: só root lê
+                    fd = os.open(LOG_PATH, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+                    System.log_file = os.fdopen(fd, "a", buffering=1)
+                except OSError:
+                    return
+            System.log_file.write(text + "\n")
+
+    @staticmethod
+    def redact(cmd, secrets=()):
+        """cmd com os segredos (senhas na linha de comando) trocados por ***."""
+        secrets = [secret for secret in secrets if secret]
+        if not secrets:
+            return cmd
+        if isinstance(cmd, str):
+            for secret in secrets:
+                cmd = cmd.replace(secret, "***")
+            return cmd
+        return ["***" if arg in secrets else arg for arg in cmd]
+
+    @staticmethod
+    def execute(cmd, shell=False, input_text=None, capture=True, on_line=None, secrets=()):
+        """Executa um comando lendo a saída linha a linha com memória limitada.
+
+        Toda linha vai para o log. stdout só é acumulado se capture=True;
+        do stderr guardamos apenas as últimas linhas para mensagens de erro.
+        Os argumentos em secrets não aparecem no log, no trace nem no plano.
+        Retorna (código de saída, stdout, cauda do stderr).
+        """
+        shown = System.redact(cmd, secrets)
+        label = shown if isinstance(shown, str) else ' '.join(shown)
+        System.log(f"$ {label}")
+        with TRACER.span(label, "comando", cmd=label) as span:
+            out, tail = [], deque(maxlen=50)
+
+            def emit(is_stdout, line):
+                System.log(line)
+                if is_stdout:
+                    if capture:
+                        out.append(line)
+                else:
+                    tail.append(line)
+                if on_line:
+                    on_line(line)
+
+            returncode, total, cpu = System.executor.spawn(cmd, shell, input_text, emit, shown)
+            span["returncode"] = returncode
+            span["bytes"] = total
+            span["cpu_s"] = round(cpu, 6)
+        return returncode, "\n".join(out), list(tail)
+
+    @staticmethod
+    def effect(description, func, *args, **kwargs):
+        """Efeito feito em Python (arquivo, diretório, dispositivo), passando pelo backend."""
+        return System.executor.effect(description, func, *args, **kwargs)
+
+    @staticmethod
+    def stream(cmd, title=None, shell=False, input_text=None, quiet=False):
+        """Executa um comando longo mostrando o progresso; retorna o código de saída."""
+        parser = ProgressParser()
+        bar = ProgressBar(title or (cmd if isinstance(cmd, str) else cmd[0]))
+        recent = deque(maxlen=20)
+        quiet = quiet or System.quiet or not System.executor.live
+
+        def on_line(line):
+            status_only = parser.feed(line)
+            if not status_only:
+                recent.append(line)
+            if quiet:
+                return
+            if bar.tty:
+                bar.update(parser.percent, parser.label)
+            elif not status_only:
+                print(line)
+
+        returncode, _, _ = System.execute(cmd, shell=shell, input_text=input_text,
+                                          capture=False, on_line=on_line)
+        if not quiet:
+            bar.close()
+        if returncode != 0 and not quiet:
+            print(f"{Style.FAIL}Erro executando comando: {bar.title}{Style.RESET}", file=sys.stderr)
+            print(f"{Style.FAIL}" + "\n".join(recent) + f"{Style.RESET}", file=sys.stderr)
+        return returncode
+
+    @staticmethod
+    def run(cmd, shell=False, input_text=None, check=True, secrets=()):
+        """Executa um comando de sistema e retorna a saída."""
+        returncode, stdout, tail = System.execute(cmd, shell=shell, input_text=input_text, secrets=secrets)
+        if returncode != 0 and check:
+            shown = System.redact(cmd, secrets)
+            label = shown if isinstance(shown, str) else ' '.join(shown)
             # Imprime o erro para facilitar o debug, mas retorna None.
-            print(f"{Style.FAIL}Erro executando comando: {' '.join(cmd)}{Style.RESET}", file=sys.stderr)
-            print(f"{Style.FAIL}Stderr: {e.stderr.strip()}{Style.RESET}", file=sys.stderr)
-            if check:
-                # Se 'check' for True, a exceção original interromperia o fluxo.
-                # Para manter a consistência do retorno, podemos relançar ou sair.
-                # Por ora, vamos retornar None como o bloco try original faria.
-                return None
+            print(f"{Style.FAIL}Erro executando comando: {label}{Style.RESET}", file=sys.stderr)
+            print(f"{Style.FAIL}Stderr: {chr(10).join(tail).strip()}{Style.RESET}", file=sys.stderr)
             return None
-
+        return stdout.strip()
 
     @staticmethod
     def list_disks():
-        """Lista os discos disponíveis usando lsblk em formato JSON."""
-        output = System.run(["lsblk", "-d", "-n", "-o", "NAME,SIZE,MODEL,TYPE", "-J"])
-        if output:
-            data = json.loads(output)
-            # Filtra para mostrar apenas dispositivos do tipo 'disk'.
-            return [d for d in data['blockdevices'] if d['type'] == 'disk']
-        return []
+        """Lista os discos disponíveis a partir do sysfs."""
+        return BLOCK.list_disks()
 
     @staticmethod
     def write_file(path, content, append=False):
         """Escreve conteúdo em um arquivo."""
-        mode = "a" if append else "w"
-        with open(path, mode) as f:
-            f.write(content)
+        def write():
+            with open(path, "a" if append else "w") as f:
+                f.write(content)
+        # O hash entra no plano: mudanças no conteúdo (ex.: scripts do chroot) aparecem nos golden
+        digest = hashlib.sha256(content.encode()).hexdigest()[:16]
+        System.effect(f"{'acrescenta' if append else 'grava'} {path} ({len(content)} bytes, sha256 {digest})", write)
+
+    @staticmethod
+    def copy_private(src, dest):
+        """Copia src para dest criando o destino já com modo 0600."""
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+            shutil.copyfileobj(f, out)
+
+    @staticmethod
+    def mount_toplevel(device, path=TOPLEVEL_MOUNT):
+        """Monta a raiz (subvolid=5) do BTRFS para manipular subvolumes."""
+        System.effect(f"mkdir {path}", os.makedirs, path, exist_ok=True)
+        if System.run(["mount", "-o", "subvolid=5", device, path]) is None:
+            raise RuntimeError(f"não foi possível montar a raiz do btrfs de {device} em {path}")
+        return path
+
+    @staticmethod
+    def umount_toplevel(path=TOPLEVEL_MOUNT):
+        # Se o umount falhar o diretório ainda contém @, @home...: nunca apagar recursivamente
+        if System.run(["umount", path]) is None:
+            raise RuntimeError(f"não foi possível desmontar {path}")
+        System.effect(f"rmdir {path}", os.rmdir, path)
 
     @staticmethod
     def get_uuid(device):
         """Obtém o UUID de um dispositivo."""
-        return System.run(f"blkid -s UUID -o value {device}", shell=True)
+        uuid = BLOCK.uuid(device)
+        if uuid is None:
+            # O link do udev pode ainda não existir (ou ser o antigo) logo após o mkfs
+            BLOCK.invalidate()
+            uuid = BLOCK.uuid(device)
+        # -p lê o superbloco, sem passar pelo cache do blkid nem pelo udev
+        return uuid or System.run(["blkid", "-p", "-s", "UUID", "-o", "value", device])
+
+class PackageCache:
+    """Cache de pacotes .deb endereçado por conteúdo (SHA256).
+
+    Os arquivos ficam em sha256/<xx>/<hash>.deb e o índice associa
+    "pacote_versão_arquitetura" ao hash. Só entram no cache pacotes cujo
+    hash confere com os índices Packages do repositório.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(root, "sha256")
+        self.index_path = os.path.join(root, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        # Chaves já contadas nesta execução: o seed põe o mesmo pacote na área
+        # do debootstrap e na do apt, e cada uso conta uma vez só
+        self.counted = set()
+        self.index = {}
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    @staticmethod
+    def deb_key(filename):
+        """Converte 'nome_versão_arq.deb' (com %3a para a época) em chave do índice."""
+        base = os.path.basename(filename)
+        if not base.endswith(".deb") or base.count("_") != 2:
+            return None
+        return base[:-4].replace("%3a", ":")
+
+    @staticmethod
+    def deb_filename(key):
+        """Nome de arquivo usado pelo apt e pelo debootstrap para uma chave."""
+        return key.replace(":", "%3a") + ".deb"
+
+    @staticmethod
+    def sha256(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def read_packages_hashes(lists_dir):
+        """Lê os índices *_Packages do apt e retorna {chave: sha256}."""
+        expected = {}
+        if not os.path.isdir(lists_dir):
+            return expected
+        for name in os.listdir(lists_dir):
+            if not name.endswith("_Packages"):
+                continue
+            with open(os.path.join(lists_dir, name), errors="replace") as f:
+                fields = {}
+                for line in f:
+                    line = line.rstrip("\n")
+                    if not line:
+                        if {"Package", "Version", "Architecture", "SHA256"} <= fields.keys():
+                            key = f"{fields['Package']}_{fields['Version']}_{fields['Architecture']}"
+                            expected[key] = fields["SHA256"]
+                        fields = {}
+                    elif not line[0].isspace() and ":" in line:
+                        k, v = line.split(":", 1)
+                        fields[k] = v.strip()
+                if {"Package", "Version", "Architecture", "SHA256"} <= fields.keys():
+                    key = f"{fields['Package']}_{fields['Version']}_{fields['Architecture']}"
+                    expected[key] = fields["SHA256"]
+        return expected
+
+    @staticmethod
+    def read_installed(status_path):
+        """Lê o status do dpkg e retorna as chaves dos pacotes instalados."""
+        installed = set()
+        if not os.path.exists(status_path):
+            return installed
+        with open(status_path, errors="replace") as f:
+            for stanza in f.read().split("\n\n"):
+                fields = dict(line.split(": ", 1) for line in stanza.splitlines()
+                              if ": " in line and not line[0].isspace())
+                if fields.get("Status", "").endswith(" installed") and "Version" in fields:
+                    installed.add(f"{fields.get('Package')}_{fields['Version']}_{fields.get('Architecture')}")
+        return installed
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.deb")
+
+    def seed(self, dest_dir):
+        """Disponibiliza os pacotes em cache em dest_dir (hardlink ou cópia)."""
+        os.makedirs(dest_dir, exist_ok=True)
+        for key, digest in self.index.items():
+            blob = self.blob_path(digest)
+            dest = os.path.join(dest_dir, self.deb_filename(key))
+            if not os.path.exists(blob) or os.path.exists(dest):
+                continue
+            try:
+                os.link(blob, dest)
+            except OSError:
+                shutil.copy2(blob, dest)
+
+    def absorb(self, src_dir, expected, installed):
+        """Importa os .deb instalados de src_dir para o cache, verificando os hashes."""
+        if not os.path.isdir(src_dir):
+            return
+        for name in os.listdir(src_dir):
+            key = self.deb_key(name)
+            if key is None or key not in installed or key in self.counted:
+                # Pacotes oferecidos pelo cache mas não usados não contam.
+                continue
+            self.counted.add(key)
+            path = os.path.join(src_dir, name)
+            digest = self.sha256(path)
+            if expected.get(key) != digest:
+                # Sem hash conhecido ou divergente: não confiamos no arquivo.
+                self.rejected += 1
+                continue
+            blob = self.blob_path(digest)
+            if self.index.get(key) == digest and os.path.exists(blob):
+                self.hits += 1
+            else:
+                self.misses += 1
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    os.link(path, blob)
+                except OSError:
+                    shutil.copy2(path, blob)
+                self.index[key] = digest
+            # Marca o uso para a política de remoção (LRU): só pacotes de fato
+            # instalados, e pelo mtime, que não depende de noatime/relatime
+            os.utime(blob)
+
+    def evict(self):
+        """Remove os pacotes menos usados até respeitar o limite de tamanho."""
+        blobs = []
+        if os.path.isdir(self.blob_dir):
+            for dirpath, _, files in os.walk(self.blob_dir):
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    blobs.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+        self.index = {k: d for k, d in self.index.items() if os.path.exists(self.blob_path(d))}
+        return total
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+    def report(self):
+        return (f"{self.hits} acertos, {self.misses} faltas, "
+                f"{self.rejected} rejeitados, {len(self.index)} pacotes em cache")
+
+class GoldenImage:
+    """Imagem dourada versionada do subvolume @ após a parte comum da instalação.
+
+    Formatos: "tar" (tarball zstd do rootfs) ou "btrfs" (stream do btrfs send
+    comprimido com zstd). Cada imagem tem um manifesto JSON ao lado.
+    """
+
+    EXTENSIONS = {"tar": ".tar.zst", "btrfs": ".btrfs.zst"}
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = {}
+        try:
+            with open(f"{path}.json") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.format = self.manifest.get("format") or ("btrfs" if path.endswith(".btrfs.zst") else "tar")
+
+    @staticmethod
+    def build(mount_point, root_device, out_dir, fmt, info, toplevel=TOPLEVEL_MOUNT):
+        """Captura o subvolume @ em out_dir e grava o manifesto."""
+        version = time.strftime("%Y%m%d-%H%M%S")
+        name = f"toca-{info['suite']}-{version}"
+        path = os.path.join(out_dir, name + GoldenImage.EXTENSIONS[fmt])
+        System.effect(f"mkdir {out_dir}", os.makedirs, out_dir, exist_ok=True)
+
+        if fmt == "btrfs":
+            # O btrfs send exige um snapshot somente leitura
+            top = System.mount_toplevel(root_device, toplevel)
+            try:
+                snap = f"{top}/{name}"
+                System.run(["btrfs", "subvolume", "snapshot", "-r", f"{top}/@", snap])
+                # pipefail: uma falha do send não pode virar uma imagem "válida"
+                ok = System.run(["bash", "-o", "pipefail", "-c",
+                                 f"btrfs send -q {shlex.quote(snap)} | zstd -T0 -q -f -o {shlex.quote(path)}"]) is not None
+                System.run(["btrfs", "subvolume", "delete", snap])
+            finally:
+                System.umount_toplevel(top)
+        else:
+            # --one-file-system deixa de fora /home, /boot/efi e os binds do chroot
+            ok = System.run(["tar", "--zstd", "--one-file-system", "--xattrs", "--acls", "--numeric-owner",
+                             "-cpf", path, "-C", mount_point, "."]) is not None
+        if not ok:
+            if os.path.exists(path):
+                System.effect(f"rm {path}", os.remove, path)
+            raise RuntimeError(f"falha ao gerar a imagem dourada {path}")
+
+        digest, size = None, 0
+        if System.executor.live:
+            # Num ensaio a imagem não foi gerada: o manifesto fica sem hash
+            digest, size = PackageCache.sha256(path), os.path.getsize(path)
+        manifest = dict(info, version=version, format=fmt, created=time.time(), sha256=digest, size=size)
+        System.write_file(f"{path}.json", json.dumps(manifest, indent=2))
+        return path
+
+    def verify(self):
+        """Confere tamanho e sha256 do manifesto antes de apagar o disco de destino."""
+        digest = self.manifest.get("sha256")
+        if not digest:
+            raise RuntimeError(f"o manifesto de {self.path} não tem sha256 (imagem gerada num ensaio?)")
+        try:
+            size = os.path.getsize(self.path)
+        except OSError as e:
+            raise RuntimeError(f"imagem dourada inacessível: {e}")
+        if size != self.manifest.get("size", size):
+            raise RuntimeError(f"{self.path} tem {size} bytes, o manifesto diz {self.manifest['size']}")
+        if PackageCache.sha256(self.path) != digest:
+            raise RuntimeError(f"o sha256 de {self.path} não confere com o manifesto")
+
+    def receive(self, root_device, toplevel=TOPLEVEL_MOUNT):
+        """Substitui o subvolume @ recém-criado pelo conteúdo do stream btrfs."""
+        top = System.mount_toplevel(root_device, toplevel)
+        live = System.executor.live
+        before = set(os.listdir(top)) if live else set()
+        System.run(["btrfs", "subvolume", "delete", f"{top}/@"])
+        ok = System.run(["bash", "-o", "pipefail", "-c",
+                         f"zstd -dcq {shlex.quote(self.path)} | btrfs receive -q {shlex.quote(top)}"]) is not None
+        if live:
+            received = [d for d in os.listdir(top) if d not in before]
+        else:
+            # Ensaio: nada foi recebido; o build grava o snapshot com o nome do arquivo
+            received = [os.path.basename(self.path)[:-len(self.EXTENSIONS["btrfs"])]]
+        if not ok or not received:
+            System.umount_toplevel(top)
+            raise RuntimeError(f"btrfs receive falhou a partir de {self.path}")
+        # O subvolume recebido é somente leitura; @ passa a ser um snapshot gravável dele.
+        try:
+            if System.run(["btrfs", "subvolume", "snapshot", f"{top}/{received[0]}", f"{top}/@"]) is None:
+                raise RuntimeError(f"não foi possível criar @ a partir de {received[0]}")
+            if System.run(["btrfs", "subvolume", "delete", f"{top}/{received[0]}"]) is None:
+                raise RuntimeError(f"não foi possível remover o subvolume recebido {received[0]}")
+        finally:
+            System.umount_toplevel(top)
+
+    def unpack(self, mount_point):
+        """Descompacta o tarball do rootfs no sistema montado."""
+        # Tarball truncado ou disco cheio deixam um rootfs parcial: não seguir com ele
+        if System.run(["tar", "--zstd", "--xattrs", "--acls", "--numeric-owner",
+                       "-xpf", self.path, "-C", mount_point]) is None:
+            raise RuntimeError(f"falha ao descompactar a imagem dourada {self.path} em {mount_point}")
+
+class OfflineRepo:
+    """Repositório APT local e assinado para instalar sem rede.
+
+    Estrutura: pool/main com os .deb, dists/<suíte>/main/binary-amd64/Packages
+    (e .gz), Release assinado (InRelease e Release.gpg) e a chave pública em
+    toca-archive-keyring.gpg. A chave privada é descartada após a assinatura.
+    O manifesto toca-repo.json guarda a suíte e os pacotes extras (fora do
+    Debian) que o instalador pede pelo nome.
+    """
+
+    KEYRING = "toca-archive-keyring.gpg"
+    MANIFEST = "toca-repo.json"
+    # Onde o repositório aparece dentro do chroot
+    CHROOT_PATH = "/media/toca-repo"
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.manifest = {}
+        try:
+            with open(os.path.join(self.path, self.MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.suite = self.manifest.get("suite")
+        self.extras = self.manifest.get("extras", [])
+
+    @property
+    def url(self):
+        return f"file://{self.path}"
+
+    @property
+    def keyring(self):
+        return os.path.join(self.path, self.KEYRING)
+
+    def valid(self):
+        return bool(self.suite) and os.path.exists(self.keyring) and \
+            os.path.exists(os.path.join(self.path, "dists", self.suite, "InRelease"))
+
+    @staticmethod
+    def control(deb):
+        """Campos de controle do pacote (dpkg-deb -f), como no índice Packages."""
+        return System.run(["dpkg-deb", "-f", deb])
+
+    @staticmethod
+    def index_entry(path, name):
+        """Linha "hash tamanho nome" para as seções MD5Sum/SHA256 do Release."""
+        with open(path, "rb") as f:
+            data = f.read()
+        return (hashlib.md5(data).hexdigest(), hashlib.sha256(data).hexdigest(), len(data), name)
+
+    @classmethod
+    def build(cls, out_dir, suite, debs, extras):
+        """Monta o repositório em out_dir; os extras também são instalados pelo nome nas máquinas."""
+        repo = cls(out_dir)
+        pool = os.path.join(repo.path, "pool", "main")
+        binary = os.path.join(repo.path, "dists", suite, "main", "binary-amd64")
+        shutil.rmtree(os.path.join(repo.path, "dists"), ignore_errors=True)
+        os.makedirs(pool, exist_ok=True)
+        os.makedirs(binary)
+
+        stanzas, extra_names = [], []
+        for deb in list(debs) + list(extras):
+            control = cls.control(deb)
+            if not control:
+                raise RuntimeError(f"pacote inválido: {deb}")
+            fields = dict(line.split(": ", 1) for line in control.splitlines()
+                          if ": " in line and not line[0].isspace())
+            key = f"{fields['Package']}_{fields['Version']}_{fields['Architecture']}"
+            name = PackageCache.deb_filename(key)
+            dest = os.path.join(pool, name)
+            if not os.path.exists(dest):
+                try:
+                    os.link(deb, dest)
+                except OSError:
+                    shutil.copy2(deb, dest)
+            md5, sha256, size, _ = cls.index_entry(dest, name)
+            stanzas.append(f"{control}\nFilename: pool/main/{name}\nSize: {size}\n"
+                           f"MD5sum: {md5}\nSHA256: {sha256}\n")
+            if deb in extras:
+                extra_names.append(fields["Package"])
+
+        packages = os.path.join(binary, "Packages")
+        System.write_file(packages, "\n".join(stanzas))
+        with open(packages, "rb") as src, gzip.open(f"{packages}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+        entries = [cls.index_entry(os.path.join(binary, n), f"main/binary-amd64/{n}")
+                   for n in ("Packages", "Packages.gz")]
+        release = os.path.join(repo.path, "dists", suite, "Release")
+        System.write_file(release, (
+            f"Origin: Toca\nLabel: Toca Offline\nSuite: {suite}\nCodename: {suite}\n"
+            f"Date: {formatdate(usegmt=True)}\nArchitectures: amd64 all\nComponents: main\n"
+            "MD5Sum:\n" + "".join(f" {md5} {size} {name}\n" for md5, _, size, name in entries) +
+            "SHA256:\n" + "".join(f" {sha} {size} {name}\n" for _, sha, size, name in entries)))
+        cls.sign(release, repo.keyring)
+
+        System.write_file(os.path.join(repo.path, cls.MANIFEST),
+                          json.dumps({"suite": suite, "extras": extra_names, "packages": len(stanzas),
+                                      "created": time.time()}, indent=2))
+        return cls(out_dir)
+
+    @staticmethod
+    def sign(release, keyring):
+        """Assina o Release com uma chave descartável e exporta só a parte pública."""
+        home = os.path.join(CACHE_DIR, f"gnupg-{os.getpid()}")
+        shutil.rmtree(home, ignore_errors=True)
+        os.makedirs(home, mode=0o700)
+        gpg = ["gpg", "--homedir", home, "--batch", "--yes", "--pinentry-mode", "loopback", "--passphrase", ""]
+        try:
+            for cmd in (
+                ["--quick-gen-key", "Toca Offline Repository <toca@localhost>", "ed25519", "sign", "never"],
+                ["--clearsign", "-o", os.path.join(os.path.dirname(release), "InRelease"), release],
+                ["--armor", "--detach-sign", "-o", f"{release}.gpg", release],
+                ["--export", "-o", keyring],
+            ):
+                if System.run(gpg + cmd) is None:
+                    raise RuntimeError(f"gpg falhou ao assinar {release}")
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+
+class Answers:
+    """Arquivo de respostas (TOML ou JSON) para instalações sem interação.
+
+    Exemplo:
+        hostname = "toca-{serial}"
+        suite = "bookworm"
+        mirrors = ["http://deb.debian.org/debian"]
+        locale = "pt_BR.UTF-8"
+        [disk]
+        model = "Samsung.*"
+        min_size_gb = 100
+        prefer = "smallest"
+        [luks]
+        enabled = true
+        password = "segredo"
+        [user]
+        name = "tocauser"
+        password_hash = "$6$..."
+        [initramfs]
+        modules = "dep"
+        compress = "lz4"
+        [subvolumes]
+        "@" = "/"
+        "@home" = "/home"
+    """
+
+    SECTIONS = {
+        "": {"hostname", "suite", "mirror", "mirrors", "locale", "disk", "luks", "user", "initramfs",
+             "partitions", "subvolumes", "trim"},
+        "disk": {"path", "model", "min_size_gb", "max_size_gb", "prefer"},
+        "luks": {"enabled", "password", "unlock_ms"},
+        "user": {"name", "password_hash"},
+        "initramfs": {"modules", "compress", "level"},
+        "partitions": {"esp_mib", "swap_mib", "seed"},
+    }
+    # Tipo de cada valor escalar; um valor de outro tipo chegaria cru à linha de comando
+    TYPES = {
+        "": {"hostname": str, "suite": str, "mirror": str, "locale": str, "trim": str},
+        "disk": {"path": str, "model": str, "min_size_gb": (int, float), "max_size_gb": (int, float),
+                 "prefer": str},
+        "luks": {"enabled": bool, "password": str, "unlock_ms": int},
+        "user": {"name": str, "password_hash": str},
+        "initramfs": {"modules": str, "compress": str, "level": int},
+        "partitions": {"esp_mib": int, "swap_mib": int, "seed": (str, int)},
+    }
+    TYPE_NAMES = {str: "um texto", int: "um inteiro", bool: "true ou false", (int, float): "um número",
+                  (str, int): "um texto ou inteiro"}
+
+    def __init__(self, data):
+        self.data = data
+        self.disk = None
+        self.hostname = None
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        if path.endswith(".toml"):
+            try:
+                import tomllib
+            except ImportError:
+                raise ValueError("arquivos TOML exigem Python 3.11+; use JSON")
+            return Answers(tomllib.loads(raw.decode()))
+        return Answers(json.loads(raw))
+
+    @staticmethod
+    def hostname_vars():
+        """Valores disponíveis no modelo de hostname: {serial}, {mac} e {rand}."""
+        def read(path):
+            try:
+                with open(path) as f:
+                    return f.read().strip()
+            except OSError:
+                return ""
+        serial = re.sub(r"[^a-z0-9]", "", read("/sys/class/dmi/id/product_serial").lower())
+        mac = ""
+        if os.path.isdir("/sys/class/net"):
+            for iface in sorted(os.listdir("/sys/class/net")):
+                addr = read(f"/sys/class/net/{iface}/address")
+                if iface != "lo" and addr and addr != "00:00:00:00:00:00":
+                    mac = addr.replace(":", "")
+                    break
+        return {"serial": serial or "semserial", "mac": mac or "semmac", "rand": secrets.token_hex(2)}
+
+    def match_disk(self, rules, disks):
+        """Aplica as regras de seleção de disco; retorna (disco, erro)."""
+        if "path" in rules:
+            path = os.path.realpath(rules["path"])
+            if not os.path.exists(path):
+                return None, f"disk.path {rules['path']} não existe"
+            return path, None
+        candidates = []
+        for d in disks:
+            size_gb = d["size_bytes"] / 1e9
+            if "model" in rules and not re.search(rules["model"], d.get("model") or ""):
+                continue
+            if size_gb < rules.get("min_size_gb", 0) or size_gb > rules.get("max_size_gb", float("inf")):
+                continue
+            candidates.append((size_gb, f"/dev/{d['name']}"))
+        if not candidates:
+            return None, "nenhum disco atende às regras de [disk]"
+        prefer = rules.get("prefer")
+        if len(candidates) > 1 and prefer not in ("smallest", "largest"):
+            names = ", ".join(path for _, path in candidates)
+            return None, f"mais de um disco atende às regras ({names}); defina disk.prefer"
+        candidates.sort(reverse=(prefer == "largest"))
+        return candidates[0][1], None
+
+    @staticmethod
+    def has_type(value, expected):
+        # bool é subclasse de int no Python: true não vale como número
+        if isinstance(value, bool):
+            return expected is bool
+        return expected is not bool and isinstance(value, expected)
+
+    def typed(self, errors):
+        """Cópia das respostas sem os valores de tipo errado, cada um relatado em errors."""
+        d = self.data
+        for section, types in self.TYPES.items():
+            values = d.get(section, {}) if section else d
+            if not isinstance(values, dict):
+                continue
+            values = dict(values)
+            for key, expected in types.items():
+                if key in values and not self.has_type(values[key], expected):
+                    errors.append(f"{section + '.' if section else ''}{key} deve ser {self.TYPE_NAMES[expected]}")
+                    del values[key]
+            if section:
+                d[section] = values
+            else:
+                d = values
+        return d
+
+    def validate(self, disks, require_disk=True):
+        """Valida todas as respostas de uma vez; retorna a lista de erros."""
+        errors = []
+        if not isinstance(self.data, dict):
+            return ["o arquivo de respostas deve ser uma tabela (objeto JSON)"]
+        for section, keys in self.SECTIONS.items():
+            values = self.data.get(section, {}) if section else self.data
+            if not isinstance(values, dict):
+                errors.append(f"[{section}] deve ser uma tabela")
+                continue
+            for key in set(values) - keys:
+                errors.append(f"chave desconhecida: {section + '.' if section else ''}{key}")
+        # As verificações de valor abaixo só veem valores do tipo certo
+        d = self.typed(errors)
+
+        if "suite" in d and not re.fullmatch(r"[a-z0-9-]+", d["suite"]):
+            errors.append(f"suite inválida: {d['suite']}")
+        mirrors = d.get("mirrors", [d["mirror"]] if "mirror" in d else [])
+        if not isinstance(mirrors, list) or not all(
+                isinstance(m, str) and urlsplit(m).scheme in ("http", "https", "file") for m in mirrors):
+            errors.append("mirror/mirrors devem ser URLs http://, https:// ou file://")
+        if "locale" in d and not re.fullmatch(r"[A-Za-z_]+(\.[A-Za-z0-9-]+)?(@\w+)?", d["locale"]):
+            errors.append(f"locale inválido: {d['locale']}")
+
+        try:
+            self.hostname = d.get("hostname", "toca-machine").format(**self.hostname_vars()).lower()
+            if not re.fullmatch(r"[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?", self.hostname):
+                errors.append(f"hostname inválido: {self.hostname}")
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
+            errors.append(f"modelo de hostname inválido: {e}")
+
+        rules = d.get("disk", {})
+        if not isinstance(rules, dict) or not rules.keys() & {"path", "model", "min_size_gb", "max_size_gb"}:
+            # Com --target os discos vêm da linha de comando e [disk] é opcional
+            if require_disk or rules:
+                errors.append("[disk] precisa de path, model, min_size_gb ou max_size_gb")
+        else:
+            try:
+                self.disk, error = self.match_disk(rules, disks)
+            except (re.error, TypeError) as e:
+                self.disk, error = None, f"regra de disco inválida: {e}"
+            if error:
+                errors.append(error)
+
+        initramfs = d.get("initramfs", {})
+        if isinstance(initramfs, dict):
+            if initramfs.get("modules", "most") not in ("most", "dep"):
+                errors.append("initramfs.modules deve ser most ou dep")
+            compress = initramfs.get("compress", "zstd")
+            if compress not in TocaInstaller.INITRAMFS_COMPRESSORS:
+                errors.append(f"initramfs.compress inválido: {compress}")
+
+        partitions = d.get("partitions", {})
+        if isinstance(partitions, dict):
+            for key in ("esp_mib", "swap_mib"):
+                if partitions.get(key, 0) < 0:
+                    errors.append(f"partitions.{key} deve ser um inteiro não negativo")
+            if partitions.get("esp_mib", 512) < 100:
+                errors.append("partitions.esp_mib deve ter pelo menos 100")
+
+        if "subvolumes" in d:
+            errors += TocaInstaller.subvolume_errors(d["subvolumes"])
+        if d.get("trim", "mkfs") not in TocaInstaller.TRIM_MODES:
+            errors.append(f"trim deve ser um de: {', '.join(TocaInstaller.TRIM_MODES)}")
+
+        luks = d.get("luks", {})
+        if isinstance(luks, dict) and luks.get("enabled") is True and not luks.get("password"):
+            errors.append("luks.enabled exige luks.password")
+
+        user = d.get("user", {})
+        if isinstance(user, dict):
+            if "name" in user and not re.fullmatch(r"[a-z_][a-z0-9_-]{0,31}", user["name"]):
+                errors.append(f"nome de usuário inválido: {user['name']}")
+            if not re.fullmatch(r"\$[0-9a-z]+\$\S+", user.get("password_hash", "")):
+                errors.append("user.password_hash deve ser um hash crypt(3), ex.: saída de 'openssl passwd -6'")
+        return errors
+
+    def apply(self, installer):
+        """Copia as respostas validadas para o instalador."""
+        d = self.data
+        installer.unattended = True
+        installer.hostname = self.hostname
+        installer.suite = d.get("suite", installer.suite)
+        installer.selected_locale = d.get("locale", installer.selected_locale)
+        mirrors = d.get("mirrors", [d["mirror"]] if "mirror" in d else None)
+        if mirrors:
+            installer.mirrors = mirrors
+            installer.mirror = mirrors[0]
+        installer.disk = self.disk
+        luks = d.get("luks", {})
+        installer.use_luks = bool(luks.get("enabled"))
+        installer.luks_password = luks.get("password", "")
+        installer.luks_unlock_ms = luks.get("unlock_ms", installer.luks_unlock_ms)
+        user = d.get("user", {})
+        installer.username = user.get("name", installer.username)
+        installer.password_hash = user["password_hash"]
+        initramfs = d.get("initramfs", {})
+        installer.initramfs_modules = initramfs.get("modules", installer.initramfs_modules)
+        installer.initramfs_compress = initramfs.get("compress", installer.initramfs_compress)
+        installer.initramfs_level = initramfs.get("level", installer.initramfs_level)
+        installer.subvolumes = d.get("subvolumes", installer.subvolumes)
+        installer.trim = d.get("trim", installer.trim)
+        partitions = d.get("partitions", {})
+        layout = installer.layout
+        installer.layout = PartitionLayout(esp_mib=partitions.get("esp_mib", layout.esp_mib),
+                                           swap_mib=partitions.get("swap_mib", layout.swap_mib),
+                                           seed=partitions.get("seed", layout.seed))
+
+class PartitionLayout:
+    """Layout GPT declarativo aplicado numa única chamada ao sfdisk.
+
+    A ordem no disco é ESP, partições extras, swap e por fim a raiz com o
+    restante do espaço. Com seed, o GUID do disco e das partições são
+    derivados dela (uuid5), então o resultado é reproduzível byte a byte em
+    arquivos de imagem.
+    """
+
+    MIB = 1024 * 1024
+
+    def __init__(self, esp_mib=512, swap_mib=0, extra=(), align_mib=1, seed=None):
+        self.esp_mib = esp_mib
+        self.swap_mib = swap_mib
+        # extra: [(nome, tamanho em MiB)] de partições Linux sem formatação
+        self.extra = list(extra)
+        self.align_mib = align_mib
+        self.seed = seed
+
+    def partitions(self):
+        """Lista (nome, tamanho em MiB ou None = restante, tipo sfdisk) na ordem do disco."""
+        parts = [("ESP", self.esp_mib, "U")]
+        parts += [(name, size, "L") for name, size in self.extra]
+        if self.swap_mib:
+            parts.append(("swap", self.swap_mib, "S"))
+        parts.append(("root", None, "L"))
+        return parts
+
+    def number(self, name):
+        """Número da partição com esse nome (1 = primeira)."""
+        for i, (part, _, _) in enumerate(self.partitions(), 1):
+            if part == name:
+                return i
+        return None
+
+    def guid(self, name):
+        if self.seed is None:
+            return None
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"tocainstall:{self.seed}:{name}")).upper()
+
+    def sfdisk_script(self):
+        lines = ["label: gpt", f"grain: {self.align_mib * self.MIB}"]
+        if self.seed is not None:
+            lines.append(f"label-id: {self.guid('disk')}")
+        for name, size, ptype in self.partitions():
+            fields = [f"type={ptype}", f'name="{name}"']
+            if size is not None:
+                fields.insert(0, f"size={size}MiB")
+            if self.seed is not None:
+                fields.append(f"uuid={self.guid(name)}")
+            lines.append(", ".join(fields))
+        return "\n".join(lines) + "\n"
+
+    def wipe(self, path):
+        """Zera só o primeiro e o último MiB (GPT primária, secundária e assinaturas)."""
+        with open(path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            zeros = bytes(min(self.MIB, size))
+            f.seek(0)
+            f.write(zeros)
+            if size > self.MIB:
+                f.seek(size - self.MIB)
+                f.write(zeros)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def errors(self):
+        """Problemas dos tamanhos do layout (as mesmas regras de [partitions])."""
+        errors = []
+        if not isinstance(self.esp_mib, int) or self.esp_mib < 100:
+            errors.append("a ESP deve ter pelo menos 100 MiB")
+        if not isinstance(self.swap_mib, int) or self.swap_mib < 0:
+            errors.append("o tamanho da swap não pode ser negativo")
+        errors += [f"tamanho inválido para {name}: {size}" for name, size in self.extra
+                   if not isinstance(size, int) or size <= 0]
+        return errors
+
+    def apply(self, path):
+        """Grava a tabela inteira de uma vez; o sfdisk relê a tabela uma única vez."""
+        errors = self.errors()
+        if errors:
+            # Antes do wipe: um layout inválido não pode apagar o disco
+            raise RuntimeError(f"layout de partições inválido: {'; '.join(errors)}")
+        System.effect(f"zera o primeiro e o último MiB de {path}", self.wipe, path)
+        returncode, _, tail = System.execute(["sfdisk", "--quiet", "--wipe", "never", path],
+                                             input_text=self.sfdisk_script())
+        if returncode != 0:
+            raise RuntimeError(f"sfdisk falhou em {path}: {' '.join(tail[-3:])}")
+
+class LuksTuning:
+    """Escolhe os parâmetros do LUKS a partir do hardware.
+
+    Usa "cryptsetup benchmark" quando disponível e, sem ele, a flag aes da
+    CPU e um microbenchmark de PBKDF2 em Python. O PBKDF fica em pbkdf2 porque
+    o /boot mora dentro da raiz criptografada e o GRUB só sabe abrir LUKS2
+    com pbkdf2; o custo é calibrado pelo número de iterações. Pelo mesmo
+    motivo a raiz fica em aes-xts (o GRUB não tem Adiantum/ChaCha): a cifra
+    mais rápida nesta CPU vale só para a swap, que o GRUB nunca abre.
+    """
+
+    CIPHERS = {
+        "aes-xts": ("aes-xts-plain64", 512),
+        "adiantum": ("xchacha12,aes-adiantum-plain64", 256),
+    }
+    # Valores usados num ensaio (--dry-run), em que nada é medido nem lido do host
+    DRY_RUN_PBKDF2_RATE = 1000000
+    DRY_RUN_AES_NI = True
+
+    def __init__(self, cpuinfo="/proc/cpuinfo"):
+        self.cpuinfo = cpuinfo
+
+    def aes_ni(self):
+        """Instruções AES na CPU (flag "aes" no x86, Features no ARM64)."""
+        try:
+            with open(self.cpuinfo) as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key.strip() in ("flags", "Features") and "aes" in value.split():
+                        return True
+        except OSError:
+            pass
+        return False
+
+    @staticmethod
+    def parse_benchmark(text):
+        """Extrai iterações/s do PBKDF2-sha256 e MiB/s de decriptação por cifra."""
+        result = {"pbkdf2": None, "ciphers": {}}
+        for line in text.splitlines():
+            match = re.match(r"\s*PBKDF2-sha256\s+(\d+) iterations per second", line)
+            if match:
+                result["pbkdf2"] = int(match.group(1))
+                continue
+            match = re.match(r"\s*(\S+)\s+(\d+)b\s+([\d.]+) MiB/s\s+([\d.]+) MiB/s", line)
+            if match:
+                name = "adiantum" if "adiantum" in match.group(1) else match.group(1)
+                result["ciphers"][(name, int(match.group(2)))] = float(match.group(4))
+        return result
+
+    @staticmethod
+    def pbkdf2_rate(seconds=0.2):
+        """Iterações/s do PBKDF2-SHA256 medidas em Python (hashlib usa o OpenSSL)."""
+        iterations, elapsed = 10000, 0.0
+        while elapsed < seconds:
+            iterations *= 2
+            start = time.perf_counter()
+            hashlib.pbkdf2_hmac("sha256", b"toca", b"salt" * 8, iterations, 64)
+            elapsed = time.perf_counter() - start
+        return int(iterations / elapsed)
+
+    def benchmark(self):
+        try:
+            returncode, out, _ = System.execute(["cryptsetup", "benchmark"])
+        except OSError:
+            return None
+        return self.parse_benchmark(out) if returncode == 0 else None
+
+    def measure_cpu(self):
+        """AES-NI, vazão das cifras e iterações/s do PBKDF2 desta CPU (não dependem do disco)."""
+        aes_ni = self.aes_ni() if System.executor.live else self.DRY_RUN_AES_NI
+        bench = self.benchmark() or {"pbkdf2": None, "ciphers": {}}
+        if bench["pbkdf2"]:
+            rate, source = bench["pbkdf2"], "cryptsetup"
+        elif System.executor.live:
+            rate, source = self.pbkdf2_rate(), "python"
+        else:
+            # Ensaio: um valor fixo mantém o plano reproduzível
+            rate, source = self.DRY_RUN_PBKDF2_RATE, "ensaio"
+        return {"aes_ni": aes_ni, "ciphers": bench["ciphers"], "pbkdf2_rate": rate, "rate_source": source}
+
+    def decide(self, disk, unlock_ms, grub_unlocks=True, cpu=None):
+        """Dicionário com os parâmetros escolhidos e o motivo de cada um.
+
+        grub_unlocks: o /boot está dentro do container (o GRUB precisa abri-lo).
+        cpu: resultado de measure_cpu() já obtido (vários discos usam a mesma medição).
+        """
+        cpu = cpu or self.measure_cpu()
+        aes_ni = cpu["aes_ni"]
+        xts = cpu["ciphers"].get(("aes-xts", 512))
+        adiantum = cpu["ciphers"].get(("adiantum", 256))
+
+        if xts and adiantum:
+            fastest = "aes-xts" if xts >= adiantum else "adiantum"
+            reason = f"benchmark: aes-xts {xts:.0f} MiB/s, adiantum {adiantum:.0f} MiB/s"
+        else:
+            fastest = "aes-xts" if aes_ni else "adiantum"
+            reason = "CPU com AES-NI" if aes_ni else "CPU sem AES-NI"
+        cipher = fastest
+        if grub_unlocks and fastest != "aes-xts":
+            cipher = "aes-xts"
+            reason += "; o GRUB não abre Adiantum, que fica só para a swap"
+
+        rate, source = cpu["pbkdf2_rate"], cpu["rate_source"]
+        physical = int(BLOCK.queue(disk, "physical_block_size", "512") or 512)
+        logical = int(BLOCK.queue(disk, "logical_block_size", "512") or 512)
+        nvme = os.path.basename(disk).startswith("nvme")
+        rotational = BLOCK.queue(disk, "rotational", "1") == "1"
+
+        name, key_size = self.CIPHERS[cipher]
+        return {
+            "cipher": name, "key_size": key_size, "cipher_reason": reason, "aes_ni": aes_ni,
+            "swap_cipher": list(self.CIPHERS[fastest]),
+            "sector_size": 4096 if physical >= 4096 or logical >= 4096 or nvme else 512,
+            "pbkdf": "pbkdf2", "iterations": max(1000, int(rate * unlock_ms / 1000)),
+            "pbkdf2_rate": rate, "rate_source": source,
+            "no_workqueue": not rotational,
+        }
+
+    @staticmethod
+    def format_args(decision):
+        return ["--type", "luks2", "--cipher", decision["cipher"],
+                "--key-size", str(decision["key_size"]),
+                "--sector-size", str(decision["sector_size"]),
+                "--pbkdf", decision["pbkdf"],
+                "--pbkdf-force-iterations", str(decision["iterations"])]
+
+    @staticmethod
+    def open_args(decision):
+        # --persistent grava as flags no cabeçalho; o initramfs as herda no boot
+        if decision["no_workqueue"]:
+            return ["--perf-no_read_workqueue", "--perf-no_write_workqueue", "--persistent"]
+        return []
+
+class StorageProfile:
+    """Opções de montagem do btrfs escolhidas por medição.
+
+    Mede a escrita sequencial no dispositivo raiz (antes do mkfs) e a
+    velocidade do zstd/lzo nesta CPU sobre uma amostra de binários do sistema
+    vivo. A vazão estimada de cada opção é min(compressão × CPUs, disco ×
+    razão); vence a mais rápida e, entre as empatadas, a que comprime mais.
+    O mesmo perfil vale para as montagens da instalação e para o fstab.
+    """
+
+    BASE = "defaults,noatime,space_cache=v2"
+    DEFAULT_COMPRESS = "zstd:1"
+    SAMPLE_BYTES = 32 * 1024 * 1024
+    # Opções com vazão até 5% abaixo da melhor contam como empate
+    TOLERANCE = 0.95
+
+    def __init__(self, compress=DEFAULT_COMPRESS, ssd=False, discard=False):
+        self.compress = compress
+        self.ssd = ssd
+        self.discard = discard
+        # Desliga também o discard=async que o kernel ativa sozinho em SSDs
+        self.nodiscard = False
+
+    @property
+    def options(self):
+        opts = [self.BASE]
+        if self.compress != "none":
+            opts.append(f"compress={self.compress}")
+        if self.ssd:
+            opts.append("ssd")
+        if self.nodiscard:
+            opts.append("nodiscard")
+        elif self.discard:
+            opts.append("discard=async")
+        return ",".join(opts)
+
+    @staticmethod
+    def disk_write_mibs(device, size_mib=64):
+        """MiB/s de escrita sequencial com fsync; sobrescreve o início do dispositivo."""
+        chunk = os.urandom(1024 * 1024) * 4
+        fd = os.open(device, os.O_WRONLY)
+        try:
+            start = time.perf_counter()
+            for _ in range(size_mib // 4):
+                os.write(fd, chunk)
+            os.fsync(fd)
+            return size_mib / (time.perf_counter() - start)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def sample(cls, path, roots=("/usr/lib", "/usr/bin")):
+        """Grava em path uma amostra de arquivos do sistema vivo (parecidos com o que será instalado)."""
+        written = 0
+        with open(path, "wb") as out:
+            for root in roots:
+                for dirpath, _, files in os.walk(root):
+                    for name in sorted(files):
+                        try:
+                            with open(os.path.join(dirpath, name), "rb") as f:
+                                data = f.read(cls.SAMPLE_BYTES - written)
+                        except OSError:
+                            continue
+                        out.write(data)
+                        written += len(data)
+                        if written >= cls.SAMPLE_BYTES:
+                            return written
+        return written
+
+    @staticmethod
+    def parse_zstd(text):
+        """{nível: (razão, MB/s de compressão)} da saída de "zstd -b"."""
+        results = {}
+        for line in text.replace("\r", "\n").splitlines():
+            # Formato do -q ("-1  3618275 (4.422) 273.33 MB/s") e o detalhado ("1#arq : ... (x4.422), 273.3 MB/s")
+            match = (re.match(r"\s*-(\d+)\s+\d+\s+\(([\d.]+)\)\s+([\d.]+) MB/s", line)
+                     or re.match(r"\s*(\d+)#.*\(x([\d.]+)\),\s+([\d.]+) MB/s", line))
+            if match:
+                results[int(match.group(1))] = (float(match.group(2)), float(match.group(3)))
+        return results
+
+    @classmethod
+    def compressors(cls, sample, max_level=3):
+        """{opção de montagem: (razão, MB/s)} para os compressores disponíveis."""
+        results = {}
+        if shutil.which("zstd"):
+            # Versões antigas do zstd escrevem o resultado do -b no stderr
+            returncode, out, _ = System.execute(f"zstd -q -b1 -e{max_level} -i1 {shlex.quote(sample)} 2>&1",
+                                                shell=True)
+            if returncode == 0:
+                for level, value in cls.parse_zstd(out).items():
+                    results[f"zstd:{level}"] = value
+        if shutil.which("lzop"):
+            size = os.path.getsize(sample)
+            start = time.perf_counter()
+            returncode, _, _ = System.execute(["lzop", "-1", "-f", "-o", f"{sample}.lzo", sample])
+            elapsed = time.perf_counter() - start
+            if returncode == 0:
+                results["lzo"] = (size / os.path.getsize(f"{sample}.lzo"), size / elapsed / 1e6)
+                os.remove(f"{sample}.lzo")
+        return results
+
+    @classmethod
+    def choose(cls, disk_mibs, compressors, cpus):
+        """Escolhe a compressão pela vazão estimada; retorna (opção, {opção: MiB/s})."""
+        estimates = {"none": (1.0, disk_mibs)}
+        for name, (ratio, speed) in compressors.items():
+            estimates[name] = (ratio, min(speed * 1e6 / 2**20 * cpus, disk_mibs * ratio))
+        best = max(rate for _, rate in estimates.values())
+        choice = max((name for name, (_, rate) in estimates.items() if rate >= best * cls.TOLERANCE),
+                     key=lambda name: estimates[name][0])
+        return choice, {name: round(rate, 1) for name, (_, rate) in estimates.items()}
+
+    @classmethod
+    def measure_compressors(cls):
+        """{opção: (razão, MB/s)} medidos nesta CPU sobre uma amostra do sistema vivo."""
+        # Um arquivo por thread: as medições podem rodar em paralelo
+        sample = os.path.join(CACHE_DIR, f"compress-sample-{threading.get_ident()}")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cls.sample(sample)
+        try:
+            return cls.compressors(sample)
+        finally:
+            os.remove(sample)
+
+    @classmethod
+    def measure(cls, device, disk, compressors=None):
+        """Mede o hardware e devolve (perfil, detalhes para o trace).
+
+        compressors: resultado de measure_compressors() já obtido; com vários
+        discos a CPU é medida uma vez e só o teste de escrita roda por disco.
+        """
+        rotational = BLOCK.queue(disk, "rotational", "1") == "1"
+        discard = int(BLOCK.queue(disk, "discard_max_bytes", "0") or 0) > 0
+        info = {"rotational": rotational, "discard": discard}
+        if not System.executor.live:
+            # O teste de escrita apagaria o dispositivo: em ensaio fica o padrão
+            return cls(cls.DEFAULT_COMPRESS, not rotational, discard), info
+        try:
+            info["disk_mibs"] = round(cls.disk_write_mibs(device), 1)
+            found = cls.measure_compressors() if compressors is None else compressors
+        except OSError as e:
+            info["error"] = str(e)
+            found = {}
+        if not any(name.startswith("zstd:") for name in found):
+            # zstd ausente ou saída não reconhecida: o trace mostra que o padrão não foi medido
+            info["zstd"] = "sem medição"
+        if not found:
+            # Sem medição confiável, fica o padrão histórico
+            return cls(cls.DEFAULT_COMPRESS, not rotational, discard), info
+        compress, info["estimates"] = cls.choose(info["disk_mibs"], found, os.cpu_count() or 1)
+        return cls(compress, not rotational, discard), info
+
+class MirrorProbe:
+    """Mede em paralelo (asyncio) a latência e a vazão de espelhos Debian.
+
+    Para cada espelho: tempo de conexão TCP, download do Release da suíte e
+    de uma amostra (Range) do Packages.xz. Só usa a biblioteca padrão, então
+    funciona contra servidores HTTP locais em testes.
+    """
+
+    def __init__(self, mirrors, suite, sample_bytes=256 * 1024, timeout=10.0):
+        self.mirrors = mirrors
+        self.suite = suite
+        self.sample_bytes = sample_bytes
+        self.timeout = timeout
+
+    async def fetch(self, url, byte_range=None):
+        """GET HTTP/1.0 simples; retorna (status, corpo, latência de conexão)."""
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        port = parts.port or (443 if https else 80)
+        start = time.monotonic()
+        reader, writer = await asyncio.open_connection(
+            parts.hostname, port, ssl=ssl.create_default_context() if https else None)
+        connect = time.monotonic() - start
+        try:
+            headers = f"GET {parts.path or '/'} HTTP/1.0\r\nHost: {parts.netloc}\r\nUser-Agent: tocainstall\r\n"
+            if byte_range:
+                headers += f"Range: bytes=0-{byte_range - 1}\r\n"
+            writer.write((headers + "\r\n").encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1]) if len(status_line.split()) > 1 else 0
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = b""
+            limit = byte_range or 4 * 1024 * 1024
+            while len(body) < limit:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                body += chunk
+            return status, body[:limit], connect
+        finally:
+            writer.close()
+
+    async def probe(self, mirror):
+        base = mirror.rstrip("/")
+        result = {"mirror": mirror, "healthy": False}
+        try:
+            start = time.monotonic()
+            status, release, connect = await asyncio.wait_for(
+                self.fetch(f"{base}/dists/{self.suite}/Release"), self.timeout)
+            result["latency"] = connect
+            text = release.decode(errors="replace")
+            if status != 200 or (f"Suite: {self.suite}" not in text and f"Codename: {self.suite}" not in text):
+                result["error"] = f"Release inválido (HTTP {status})"
+                return result
+            sample_start = time.monotonic()
+            status, sample, _ = await asyncio.wait_for(
+                self.fetch(f"{base}/dists/{self.suite}/main/binary-amd64/Packages.xz", self.sample_bytes),
+                self.timeout)
+            if status not in (200, 206) or not sample:
+                result["error"] = f"Packages indisponível (HTTP {status})"
+                return result
+            elapsed = time.monotonic() - sample_start
+            result["throughput"] = len(sample) / max(elapsed, 1e-6)
+            result["total"] = time.monotonic() - start
+            result["healthy"] = True
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError) as e:
+            result["error"] = str(e) or type(e).__name__
+        return result
+
+    async def probe_all(self):
+        return await asyncio.gather(*(self.probe(m) for m in self.mirrors))
+
+    def run(self):
+        """Testa todos os espelhos; retorna os resultados, o mais rápido primeiro."""
+        results = asyncio.run(self.probe_all())
+        healthy = sorted((r for r in results if r["healthy"]), key=lambda r: r["total"])
+        return healthy + [r for r in results if not r["healthy"]]
+
+class Journal:
+    """Diário persistente das etapas concluídas e dos seus resultados.
+
+    Guarda discos, partições e UUIDs para que --resume possa conferir o estado
+    do disco e continuar da primeira etapa incompleta. Senhas em claro nunca
+    entram; o hash crypt(3) do arquivo de respostas entra, por isso o diário,
+    como o shadow, só é legível pelo root.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        self.completed = []
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.state = data.get("state", {})
+        self.completed = data.get("completed", [])
+        return True
+
+    def done(self, stage):
+        return stage in self.completed
+
+    def record(self, stage, state):
+        if stage not in self.completed:
+            self.completed.append(stage)
+        self.state.update(state)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # Um .tmp antigo pode ter ficado com outro modo
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"state": self.state, "completed": self.completed, "updated": time.time()}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.state, self.completed = {}, []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class Stage:
+    """Etapa da instalação com as entradas que exige e as saídas que produz."""
+
+    def __init__(self, name, func, requires=(), provides=(), interactive=False):
+        self.name = name
+        self.func = func
+        self.requires = set(requires)
+        self.provides = set(provides)
+        # Etapas interativas rodam na thread principal (input/getpass e Ctrl-C)
+        self.interactive = interactive
+        self.skipped = False
+        self.start = None
+        self.end = None
+
+    def execute(self):
+        with TRACER.span(self.name, "etapa"):
+            self.func()
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+class StageScheduler:
+    """Executa um DAG de etapas, rodando em paralelo as que já têm suas entradas."""
+
+    def __init__(self, stages, max_workers=4, skip=None, on_complete=None, serial=False):
+        self.stages = stages
+        self.max_workers = max_workers
+        # serial: todas as etapas na thread principal, na ordem declarada (plano determinístico)
+        self.serial = serial
+        # skip(stage) -> True marca a etapa como concluída sem executá-la (retomada)
+        self.skip = skip
+        # on_complete(stage) é chamado na thread principal após cada etapa
+        self.on_complete = on_complete
+        self.provided = set()
+        self.start = None
+        self.end = None
+
+    def run(self):
+        self.start = time.monotonic()
+        pending = list(self.stages)
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while pending or running:
+                ready = [s for s in pending if s.requires <= self.provided]
+                skipped = [s for s in ready if self.skip and self.skip(s)]
+                for stage in skipped:
+                    pending.remove(stage)
+                    stage.skipped = True
+                    stage.start = time.monotonic()
+                    self._complete(stage)
+                if skipped:
+                    continue
+                for stage in [s for s in ready if not (s.interactive or self.serial)]:
+                    pending.remove(stage)
+                    stage.start = time.monotonic()
+                    running[pool.submit(stage.execute)] = stage
+
+                interactive = [s for s in ready if s.interactive or self.serial]
+                if interactive:
+                    stage = interactive[0]
+                    pending.remove(stage)
+                    stage.start = time.monotonic()
+                    stage.execute()
+                    self._complete(stage)
+                    continue
+
+                if not running:
+                    missing = sorted(set().union(*(s.requires for s in pending)) - self.provided)
+                    raise RuntimeError(f"Etapas sem dependências satisfeitas: {', '.join(missing)}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    future.result()
+                    self._complete(stage)
+        except BaseException:
+            # Uma etapa falhou ou saiu (ex.: confirmação recusada): as que ainda
+            # rodam no pool são encerradas antes de o finalize desmontar o disco
+            System.executor.cancel()
+            pool.shutdown(wait=True, cancel_futures=True)
+            System.executor.resume()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            self.end = time.monotonic()
+
+    def _complete(self, stage):
+        stage.end = time.monotonic()
+        self.provided |= stage.provides
+        if self.on_complete and not stage.skipped:
+            self.on_complete(stage)
+
+    def critical_path(self):
+        """Retorna a cadeia de etapas que determinou o tempo total."""
+        finished = [s for s in self.stages if s.end is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda s: s.end)]
+        while True:
+            preds = [s for s in finished if s.provides & path[-1].requires]
+            if not preds:
+                break
+            path.append(max(preds, key=lambda s: s.end))
+        return list(reversed(path))
+
+    def report(self):
+        """Texto com a duração de cada etapa e o caminho crítico."""
+        lines = []
+        for s in self.stages:
+            if s.end is not None:
+                offset = s.start - self.start
+                note = "  (já concluída)" if s.skipped else ""
+                lines.append(f"  {s.name:<24} início +{offset:7.1f}s  duração {s.duration:7.1f}s{note}")
+        path = self.critical_path()
+        total = (self.end or time.monotonic()) - self.start
+        busy = sum(s.duration for s in self.stages)
+        lines.append(f"  Caminho crítico: {' -> '.join(s.name for s in path)}")
+        lines.append(f"  Tempo total: {total:.1f}s (soma das etapas: {busy:.1f}s)")
+        return "\n".join(lines)
 
 class TocaInstaller:
+    # Etapas registradas no diário; as de disco são puladas numa retomada.
+    JOURNALED_STAGES = ("partition_disk", "setup_luks_if_enabled", "format_btrfs",
+                        "receive_golden_image", "bootstrap_system", "configure_system")
+    # Campos do instalador salvos no diário (senhas em claro ficam de fora; o hash vai, em modo 0600).
+    JOURNAL_FIELDS = ("disk", "efi_part", "root_part", "swap_part", "use_luks", "mount_options",
+                      "subvolumes", "trim", "swap_cipher", "suite", "mirror", "username", "hostname",
+                      "selected_locale", "password_hash")
+    # Snapshots intermediários de @ (do mais antigo ao mais novo) e o que fica no fim.
+    SNAPSHOTS = ("bootstrap", "packages")
+    FACTORY_SNAPSHOT = "factory"
+    # Layout padrão dos subvolumes: nome -> ponto de montagem ("" = não montado).
+    SUBVOLUMES = {"@": "/", "@home": "/home", "@snapshots": "/.snapshots", "@var_log": "/var/log"}
+    # Quando fazer o TRIM: no mkfs, depois via fstrim.timer ou nunca.
+    TRIM_MODES = ("mkfs", "deferred", "none")
+    # Compressores do initramfs e o pacote que fornece cada um.
+    INITRAMFS_COMPRESSORS = {"zstd": "zstd", "lz4": "lz4", "xz": "xz-utils", "gzip": "gzip"}
+    # Pacote customizado instalado em todas as máquinas
+    CUSTOM_DEB_URL = "https://raw.githubusercontent.com/NextFerretDUR/repo1/main/nfdurh.deb"
+    # Marcador (dentro do alvo) de debootstrap concluído.
+    BOOTSTRAP_MARKER = "var/lib/tocainstall/steps/bootstrap"
+
     def __init__(self):
         # Configurações do disco e sistema
         self.disk = ""
         self.efi_part = ""
         self.root_part = ""
+        self.swap_part = ""
         self.luks_password = ""
         self.root_device_final = ""
         self.use_luks = False
+        # Tempo alvo para derivar a chave no desbloqueio
+        self.luks_unlock_ms = 1000
+        # Cifra e tamanho da chave da swap criptografada (setup_luks_if_enabled os ajusta)
+        self.swap_cipher = list(LuksTuning.CIPHERS["aes-xts"])
+        self.layout = PartitionLayout()
+        # Opções de montagem do btrfs; format_btrfs as ajusta ao hardware
+        self.mount_options = StorageProfile().options
+        # Medições de CPU compartilhadas pelos alvos (None: cada alvo mede a sua)
+        self.luks_cpu = None
+        self.compressors = None
+        self.subvolumes = dict(self.SUBVOLUMES)
+        self.trim = "mkfs"
+        # Novas tentativas de uma etapa do chroot a partir do último snapshot
+        self.retries = 1
+        self.factory_boot_entry = False
+
+        # Pontos de montagem e nome do mapeamento LUKS deste disco
+        self.mount_point = MOUNT_POINT
+        self.mapper_name = MAPPER_NAME
+        self.toplevel_mount = TOPLEVEL_MOUNT
+
+        # Modo de vários discos: o primeiro é este instalador, os demais são cópias
+        self.target_disks = []
+        self.targets = []
+        self.replica = None
+        self.removable_boot = False
 
         # Informações do sistema a ser instalado
         self.suite = "bookworm"  # Suíte Debian (ex: bookworm, bullseye)
         self.mirror = "http://deb.debian.org/debian" # Repositório para o debootstrap
+        self.mirrors = list(DEFAULT_MIRRORS) # Candidatos para a seleção automática
         
         self.selected_locale = "en_US.UTF-8"
         self.username = "tocauser"
         self.password = "toca"
         self.hostname = "toca-machine"
+        self.password_hash = None # Hash crypt(3) vindo do arquivo de respostas
+
+        # Pacotes do sistema: o primeiro grupo com recomendações, o segundo sem
+        self.packages = ["linux-image-amd64", "sudo", "network-manager", "firmware-linux",
+                         "wget", "ca-certificates"]
+        self.minimal_packages = ["xserver-xorg-core", "xserver-xorg-video-all", "xserver-xorg-input-all",
+                                 "xinit", "xterm", "x11-xserver-utils", "grub-efi-amd64-signed", "shim-signed"]
+        self.luks_packages = ["cryptsetup-initramfs"]
+
+        # Perfil do initramfs: módulos (most = genérico, dep = só desta máquina) e compressão
+        self.initramfs_modules = "most"
+        self.initramfs_compress = "zstd"
+        self.initramfs_level = None
+
+        # Modo sem interação (arquivo de respostas)
+        self.unattended = False
+
+        # Diário de etapas para retomar instalações interrompidas
+        self.journal = Journal(JOURNAL_PATH)
+        self.resuming = False
+        self.chroot_failed = False
+
+        # Cache de pacotes entre instalações
+        self.cache = PackageCache(CACHE_DIR, CACHE_MAX_BYTES)
+        self.debootstrap_cache = os.path.join(CACHE_DIR, "debootstrap")
+
+        # Imagem dourada: construção (diretório de saída) ou implantação
+        self.golden_build_dir = None
+        # Repositório local: de onde instalar (offline) ou onde gerar (com rede)
+        self.offline_repo = None
+        self.offline_build_dir = None
+        # Cópia extra do trace fora do alvo (ex.: para o benchmark)
+        self.trace_copy = None
+        self.golden_format = "tar"
+        self.golden_image = None
+
+        # Agendador de etapas (preenchido em run)
+        self.scheduler = None
+        self.prefetch_root = os.path.join(CACHE_DIR, "prefetch-root")
 
     def header(self):
-        os.system('clear')
+        print("\033[H\033[2J", end="")
         print(f"{Style.HEADER}{Style.BOLD}")
         print("  ┌──────────────────────────────────────────────────┐")
         print("  │             TOCA LINUX INSTALLER               │")
@@ -100,12 +2177,19 @@ class TocaInstaller:
 
     def check_environment(self):
         """Verifica se o ambiente de execução tem os pré-requisitos."""
+        if not System.executor.live:
+            # Ensaio: só o plano de comandos, sem exigir root nem as ferramentas
+            return
         if os.geteuid() != 0:
             print(f"{Style.FAIL}Este script precisa ser executado como root.{Style.RESET}")
             sys.exit(1)
         
         # Ferramentas necessárias para a instalação, incluindo debootstrap.
-        required_tools = ["debootstrap", "mkfs.btrfs", "parted", "nmcli", "wget", "cryptsetup"]
+        required_tools = ["debootstrap", "mkfs.btrfs", "sfdisk", "cryptsetup"]
+        if not self.offline_repo:
+            required_tools += ["nmcli", "wget"]
+        if self.offline_build_dir:
+            required_tools += ["gpg", "dpkg-deb"]
         missing_tools = [tool for tool in required_tools if shutil.which(tool) is None]
 
         if missing_tools:
@@ -115,8 +2199,17 @@ class TocaInstaller:
 
     def setup_network(self):
         """Menu interativo para configurar a rede."""
+        if self.offline_repo:
+            print(f"{Style.GREEN}Instalação offline a partir de {self.offline_repo.path}; rede dispensada.{Style.RESET}")
+            return
+        if self.unattended:
+            # Sem menu: a rede deve ter sido configurada pelo ambiente (DHCP)
+            if not self.online():
+                print(f"{Style.FAIL}Conexão com a internet é necessária para continuar.{Style.RESET}")
+                sys.exit(1)
+            return
         while True:
-            os.system('clear')
+            print("\033[H\033[2J", end="")
             print(f"{Style.BLUE}=== Configuração de Rede ==={Style.RESET}")
             print(f"Hostname: {Style.GREEN}{self.hostname}{Style.RESET}")
             
@@ -139,7 +2232,7 @@ class TocaInstaller:
             
             elif choice == '3':
                 print("Pingando google.com...")
-                if os.system("ping -c 3 google.com > /dev/null 2>&1") == 0:
+                if self.online(count=3):
                     print(f"{Style.GREEN}Conexão com a internet bem-sucedida.{Style.RESET}")
                 else:
                     print(f"{Style.FAIL}Sem conexão com a internet.{Style.RESET}")
@@ -147,12 +2240,17 @@ class TocaInstaller:
                 
             elif choice == '4':
                 # Testa a conectividade antes de sair
-                if os.system("ping -c 1 google.com > /dev/null 2>&1") != 0:
+                if not self.online():
                     print(f"{Style.FAIL}Conexão com a internet é necessária para continuar.{Style.RESET}")
                     input("Pressione Enter para tentar novamente...")
                 else:
                     break
 
+    @staticmethod
+    def online(count=1):
+        """Testa a conexão com a internet."""
+        return System.execute(["ping", "-c", str(count), "google.com"], capture=False)[0] == 0
+
     def configure_interface(self):
         """Configura uma interface de rede específica usando nmcli."""
         devs_raw = System.run(["nmcli", "-t", "-f", "DEVICE,TYPE,STATE", "dev"])
@@ -176,15 +2274,22 @@ class TocaInstaller:
         else:
             print(f"Tentando conectar automaticamente em {device}...")
             System.run(["nmcli", "dev", "connect", device])
-            time.sleep(2)
+            self.wait_link(device)
+
+    def wait_link(self, device):
+        """Espera o dispositivo conectar e informa quanto tempo levou."""
+        try:
+            elapsed = Readiness.wait_device_connected(device, timeout=20)
+            print(f"{Style.GREEN}{device} conectado em {elapsed:.1f}s.{Style.RESET}")
+        except TimeoutError:
+            print(f"{Style.WARN}{device} ainda não está conectado.{Style.RESET}")
 
     def configure_wifi(self, device):
         """Configura uma conexão Wi-Fi."""
         print(f"Escaneando redes em {device}...")
         System.run(["nmcli", "dev", "wifi", "rescan"])
-        time.sleep(3)
         
-        out = System.run(["nmcli", "-t", "-f", "SSID,SECURITY,BARS", "dev", "wifi", "list"])
+        out = Readiness.wait_wifi_scan()
         if not out:
             print("Nenhuma rede encontrada.")
             return
@@ -204,28 +2309,42 @@ class TocaInstaller:
             ssid = networks[sel].split(':')[0]
             pwd = getpass.getpass(f"Senha para {ssid}: ")
             if pwd:
-                System.run(["nmcli", "dev", "wifi", "connect", ssid, "password", pwd])
+                System.run(["nmcli", "dev", "wifi", "connect", ssid, "password", pwd], secrets=[pwd])
             else: # Rede aberta
                 System.run(["nmcli", "dev", "wifi", "connect", ssid])
+            self.wait_link(device)
         except (ValueError, IndexError):
             print("Seleção inválida.")
         except Exception as e:
             print(f"Falha ao conectar: {e}")
-        time.sleep(2)
 
     def collect_info(self):
         """Coleta informações do usuário: disco, LUKS e credenciais."""
-        print(f"\n{Style.BLUE}=== Seleção de Disco ==={Style.RESET}")
-        disks = System.list_disks()
-        for i, d in enumerate(disks):
-            print(f" [{i}] /dev/{d['name']} ({d['size']}) - {d.get('model', 'N/A')}")
-        
-        try:
-            sel = int(input(f"{Style.WARN}Selecione o disco para a instalação: {Style.RESET}"))
-            self.disk = f"/dev/{disks[sel]['name']}"
-        except (ValueError, IndexError):
-            print(f"{Style.FAIL}Seleção inválida. Saindo.{Style.RESET}")
-            sys.exit(1)
+        if self.resuming:
+            # Disco, LUKS e usuário já vieram do diário (resume_from_journal)
+            return
+        if self.unattended:
+            # Tudo já veio validado do arquivo de respostas
+            if self.target_disks:
+                self.disk = self.target_disks[0]
+            print(f"\n{Style.BLUE}Instalação automática em {', '.join(self.target_disks or [self.disk])} "
+                  f"(hostname {self.hostname}){Style.RESET}")
+            return
+        if self.target_disks:
+            # Discos já definidos na linha de comando (--target)
+            self.disk = self.target_disks[0]
+        else:
+            print(f"\n{Style.BLUE}=== Seleção de Disco ==={Style.RESET}")
+            disks = System.list_disks()
+            for i, d in enumerate(disks):
+                print(f" [{i}] /dev/{d['name']} ({d['size']}) - {d.get('model', 'N/A')}")
+            
+            try:
+                sel = int(input(f"{Style.WARN}Selecione o disco para a instalação: {Style.RESET}"))
+                self.disk = f"/dev/{disks[sel]['name']}"
+            except (ValueError, IndexError):
+                print(f"{Style.FAIL}Seleção inválida. Saindo.{Style.RESET}")
+                sys.exit(1)
 
         print(f"\n{Style.BLUE}=== Criptografia de Disco (LUKS) ==={Style.RESET}")
         use_luks_input = input("Habilitar criptografia de disco completo (LUKS)? (s/n): ").lower()
@@ -251,254 +2370,1259 @@ class TocaInstaller:
                 break
             print(f"{Style.FAIL}Senhas não conferem ou estão vazias. Tente novamente.{Style.RESET}")
 
-        print(f"\n{Style.FAIL}{Style.BOLD}AVISO: TODOS OS DADOS EM {self.disk} SERÃO PERMANENTEMENTE APAGADOS!{Style.RESET}")
+        print(f"\n{Style.FAIL}{Style.BOLD}AVISO: TODOS OS DADOS EM {', '.join(self.target_disks or [self.disk])} "
+              f"SERÃO PERMANENTEMENTE APAGADOS!{Style.RESET}")
         if input("Digite 'sim' para confirmar e iniciar a instalação: ") != 'sim':
             print("Instalação cancelada.")
             sys.exit(0)
 
+    def resume_from_journal(self):
+        """Restaura o estado do diário, confere o disco e reabre o LUKS."""
+        state = self.journal.state
+        for field in self.JOURNAL_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        if state.get("golden_image"):
+            self.golden_image = GoldenImage(state["golden_image"])
+            if System.executor.live:
+                self.golden_image.verify()
+        print(f"\n{Style.BLUE}Retomando a instalação em {self.disk} "
+              f"(concluído: {', '.join(self.journal.completed) or 'nada'}){Style.RESET}")
+
+        # Senhas nunca vão para o diário: pergunta de novo o que ainda for usado
+        if not self.unattended:
+            if self.use_luks and self.journal.done("setup_luks_if_enabled"):
+                self.luks_password = getpass.getpass("Senha de criptografia: ")
+            if not self.password_hash and not self.journal.done("configure_system"):
+                while True:
+                    p1 = getpass.getpass("Senha do usuário: ")
+                    p2 = getpass.getpass("Confirme a senha: ")
+                    if p1 and p1 == p2:
+                        self.password = p1
+                        break
+                    print(f"{Style.FAIL}Senhas não conferem ou estão vazias. Tente novamente.{Style.RESET}")
+        self.verify_resume()
+
+    def verify_resume(self):
+        """Garante que o disco ainda corresponde ao diário antes de pular etapas."""
+        problems = []
+        if not os.path.exists(self.disk):
+            problems.append(f"disco {self.disk} não encontrado")
+        if self.journal.done("partition_disk"):
+            problems += [f"partição {p} não encontrada" for p in (self.efi_part, self.root_part)
+                         if not os.path.exists(p)]
+        if not problems and self.journal.done("format_btrfs"):
+            state = self.journal.state
+            if System.get_uuid(self.root_part) != state.get("root_part_uuid"):
+                problems.append(f"UUID de {self.root_part} mudou desde a última tentativa")
+            if System.get_uuid(self.efi_part) != state.get("efi_uuid"):
+                problems.append(f"UUID de {self.efi_part} mudou desde a última tentativa")
+        if problems:
+            raise RuntimeError("o disco não corresponde ao diário: " + "; ".join(problems))
+
+        if self.use_luks and self.journal.done("setup_luks_if_enabled"):
+            self.root_device_final = f"/dev/mapper/{self.mapper_name}"
+            if not os.path.exists(self.root_device_final):
+                System.run(["cryptsetup", "open", self.root_part, self.mapper_name, "-"],
+                           input_text=self.luks_password)
+            if not os.path.exists(self.root_device_final):
+                raise RuntimeError("não foi possível reabrir o container LUKS")
+        elif self.journal.done("partition_disk"):
+            self.root_device_final = self.root_part
+
+    def journal_state(self, stage):
+        """Campos do instalador a registrar após a etapa."""
+        state = {field: getattr(self, field) for field in self.JOURNAL_FIELDS}
+        state["golden_image"] = self.golden_image.path if self.golden_image else None
+        if stage == "format_btrfs":
+            state["root_part_uuid"] = System.get_uuid(self.root_part)
+            state["efi_uuid"] = System.get_uuid(self.efi_part)
+        return state
+
+    def on_stage_complete(self, stage):
+        # O modo de vários discos não é retomável; só o disco único usa o diário
+        if len(self.target_disks) > 1 or stage.name not in self.JOURNALED_STAGES:
+            return
+        if stage.name == "configure_system" and self.chroot_failed:
+            return
+        self.journal.record(stage.name, self.journal_state(stage.name))
+
+    def skip_stage(self, stage):
+        """Numa retomada, pula as etapas já registradas no diário."""
+        if not self.resuming:
+            return False
+        if stage.name == "prefetch_packages":
+            return self.journal.done("bootstrap_system")
+        if stage.name == "bootstrap_system":
+            # Além do diário, o marcador precisa existir no alvo já montado
+            return (self.journal.done(stage.name)
+                    and os.path.exists(os.path.join(self.mount_point, self.BOOTSTRAP_MARKER)))
+        return stage.name in self.JOURNALED_STAGES and self.journal.done(stage.name)
+
     def partition_disk(self):
         """Particiona o disco selecionado (GPT com partição EFI e Raiz)."""
         print(f"\n{Style.BLUE}Particionando {self.disk}...{Style.RESET}")
-        System.run(f"wipefs -a {self.disk}", shell=True)
-        System.run(f"parted -s {self.disk} mklabel gpt", shell=True)
-        System.run(f"parted -s {self.disk} mkpart ESP fat32 1MiB 513MiB", shell=True)
-        System.run(f"parted -s {self.disk} set 1 esp on", shell=True)
-        System.run(f"parted -s {self.disk} mkpart primary 513MiB 100%", shell=True)
-
-        # Aguarda o kernel reconhecer as novas partições
-        time.sleep(2)
+        self.layout.apply(self.disk)
+
+        # Aguarda o kernel reconhecer as novas partições e o udev criar os nós
+        numbers = list(range(1, len(self.layout.partitions()) + 1))
+        elapsed = Readiness.wait_partitions(self.disk, numbers)
+        print(f"Partições disponíveis em {elapsed:.2f}s.")
         
-        # Determina o nome das partições (ex: sda1 vs nvme0n1p1)
-        if "nvme" in self.disk:
-            self.efi_part = f"{self.disk}p1"
-            self.root_part = f"{self.disk}p2"
-        else:
-            self.efi_part = f"{self.disk}1"
-            self.root_part = f"{self.disk}2"
+        # Pergunta ao kernel o nome das partições (sda1, nvme0n1p1, mmcblk0p1, loop0p1...)
+        self.efi_part = BLOCK.partition(self.disk, self.layout.number("ESP"))
+        self.root_part = BLOCK.partition(self.disk, self.layout.number("root"))
+        if self.layout.swap_mib:
+            self.swap_part = BLOCK.partition(self.disk, self.layout.number("swap"))
 
     def setup_luks_if_enabled(self):
         """Configura a criptografia LUKS na partição raiz, se habilitado."""
         if self.use_luks:
             print(f"\n{Style.BLUE}Criptografando partição raiz com LUKS2...{Style.RESET}")
+            with TRACER.span("luks-tuning", "luks") as info:
+                decision = LuksTuning().decide(self.disk, self.luks_unlock_ms, cpu=self.luks_cpu)
+                info.update(decision)
+            self.swap_cipher = decision["swap_cipher"]
+            print(f"Cifra {decision['cipher']} ({decision['key_size']} bits, {decision['cipher_reason']}), "
+                  f"setor {decision['sector_size']}, pbkdf2 com {decision['iterations']} iterações "
+                  f"(~{self.luks_unlock_ms} ms)")
+
             # Formata a partição com LUKS
-            cmd_format = f"cryptsetup luksFormat --type luks2 --pbkdf pbkdf2 {self.root_part} -"
-            System.run(cmd_format, shell=True, input_text=self.luks_password)
+            cmd_format = ["cryptsetup", "luksFormat", "--batch-mode"] + LuksTuning.format_args(decision)
+            System.stream(cmd_format + [self.root_part, "-"], title="cryptsetup luksFormat",
+                          input_text=self.luks_password)
+            BLOCK.invalidate()
             
             # Abre o container LUKS para formatação
-            cmd_open = f"cryptsetup open {self.root_part} {MAPPER_NAME} -"
-            System.run(cmd_open, shell=True, input_text=self.luks_password)
-            self.root_device_final = f"/dev/mapper/{MAPPER_NAME}"
+            cmd_open = ["cryptsetup", "open"] + LuksTuning.open_args(decision)
+            System.run(cmd_open + [self.root_part, self.mapper_name, "-"], input_text=self.luks_password)
+            self.root_device_final = f"/dev/mapper/{self.mapper_name}"
         else:
             self.root_device_final = self.root_part
 
     def format_btrfs(self):
-        """Formata as partições e cria os subvolumes BTRFS."""
+        """Formata ESP, swap e raiz ao mesmo tempo e cria os subvolumes BTRFS."""
         print(f"\n{Style.BLUE}Formatando partições e criando subvolumes BTRFS...{Style.RESET}")
-        System.run(["mkfs.vfat", "-F32", self.efi_part])
-        System.run(["mkfs.btrfs", "-f", "-L", "TocaRoot", self.root_device_final])
+        # A medição escreve no dispositivo raiz: tem que vir antes do mkfs.btrfs
+        self.measure_storage()
 
-        # Montagem temporária para criar os subvolumes
-        tmp_mount = "/mnt/tmp_btrfs"
-        os.makedirs(tmp_mount, exist_ok=True)
-        System.run(["mount", self.root_device_final, tmp_mount])
-        
-        subvols = ["@", "@home", "@snapshots", "@var_log"]
-        for sv in subvols:
-            System.run(["btrfs", "subvolume", "create", f"{tmp_mount}/{sv}"])
-        
-        System.run(["umount", tmp_mount])
-        shutil.rmtree(tmp_mount)
+        # -K: sem TRIM do dispositivo inteiro (lento em SSDs SATA grandes e discos thin)
+        btrfs_cmd = ["mkfs.btrfs", "-f", "-L", "TocaRoot"] + (["-K"] if self.trim != "mkfs" else [])
+        rootdir = None
+        if self.mkfs_creates_subvolumes():
+            # btrfs-progs recente cria os subvolumes no próprio mkfs, sem montar nada
+            rootdir = os.path.join(CACHE_DIR, f"mkfs-root-{os.path.basename(self.mount_point)}")
+            shutil.rmtree(rootdir, ignore_errors=True)
+            btrfs_cmd += ["--rootdir", rootdir]
+            for name in self.subvolumes:
+                os.makedirs(os.path.join(rootdir, name))
+                btrfs_cmd += ["--subvol", name]
+
+        def mkfs_root():
+            if System.stream(btrfs_cmd + [self.root_device_final], title="mkfs.btrfs") != 0:
+                raise RuntimeError(f"mkfs.btrfs falhou em {self.root_device_final}")
+
+        def mkfs_esp():
+            if System.run(["mkfs.vfat", "-F32", self.efi_part]) is None:
+                raise RuntimeError(f"mkfs.vfat falhou em {self.efi_part}")
+
+        jobs = {"mkfs.btrfs": mkfs_root, "mkfs.vfat": mkfs_esp}
+        if self.swap_part and not self.use_luks:
+            # Com LUKS a swap é recriada a cada boot com chave aleatória (crypttab)
+            jobs["mkswap"] = lambda: System.run(["mkswap", "-L", "TocaSwap", self.swap_part])
+        try:
+            timings = self.timed_jobs(jobs)
+        finally:
+            if rootdir:
+                shutil.rmtree(rootdir, ignore_errors=True)
+        # Novos sistemas de arquivos: os UUIDs em cache não valem mais, e os links
+        # by-uuid dos sistemas antigos (reinstalação) só somem quando o udev processar o mkfs
+        Readiness.udev_settle()
+        BLOCK.invalidate()
+
+        if rootdir is None:
+            # Uma única chamada cria todos os subvolumes
+            def create_subvolumes():
+                top = System.mount_toplevel(self.root_device_final, self.toplevel_mount)
+                System.run(["btrfs", "subvolume", "create"] + [f"{top}/{name}" for name in self.subvolumes])
+                System.umount_toplevel(top)
+            timings.update(self.timed_jobs({"subvolumes": create_subvolumes}))
+        print("Tempos: " + ", ".join(f"{name} {wall:.1f}s" for name, wall in timings.items()))
+
+    @staticmethod
+    def mkfs_creates_subvolumes():
+        """O mkfs.btrfs aceita --subvol (btrfs-progs 6.x)?"""
+        _, out, _ = System.execute(["mkfs.btrfs", "--help"])
+        return "--subvol" in out
+
+    def timed_jobs(self, jobs):
+        """Executa {nome: função} em paralelo; retorna {nome: segundos} e propaga falhas."""
+        def timed(name, job):
+            start = time.monotonic()
+            with TRACER.span(name, "disco"):
+                job()
+            return time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=self.workers(jobs)) as pool:
+            futures = {name: pool.submit(timed, name, job) for name, job in jobs.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def measure_storage(self):
+        """Escolhe o perfil de montagem medindo disco e CPU (antes do mkfs, que apaga o teste)."""
+        with TRACER.span("storage-profile", "disco") as info:
+            profile, details = StorageProfile.measure(self.root_device_final, self.disk, self.compressors)
+            # Sem TRIM online: "deferred" deixa o trabalho para o fstrim.timer
+            profile.nodiscard = self.trim != "mkfs"
+            info.update(details, trim=self.trim)
+            info["options"] = profile.options
+        self.mount_options = profile.options
+        if "estimates" in details:
+            print(f"Disco: {details['disk_mibs']} MiB/s; vazão estimada (MiB/s): {details['estimates']}")
+        print(f"Opções de montagem: {self.mount_options}")
+
+    def receive_golden_image(self):
+        """Implanta a imagem dourada em formato btrfs antes da montagem final."""
+        if self.golden_image and self.golden_image.format == "btrfs":
+            print(f"\n{Style.BLUE}Recebendo imagem dourada {self.golden_image.path}...{Style.RESET}")
+            self.golden_image.receive(self.root_device_final, self.toplevel_mount)
+
+    def capture_golden_image(self):
+        """Salva o sistema com a parte comum já instalada como imagem dourada."""
+        print(f"\n{Style.BLUE}Gerando imagem dourada ({self.golden_format}) em {self.golden_build_dir}...{Style.RESET}")
+        info = {"suite": self.suite, "mirror": self.mirror}
+        path = GoldenImage.build(self.mount_point, self.root_device_final,
+                                 self.golden_build_dir, self.golden_format, info, self.toplevel_mount)
+        print(f"{Style.GREEN}Imagem dourada criada: {path}{Style.RESET}")
 
     def mount_targets(self):
         """Monta os subvolumes BTRFS e a partição EFI no ponto de montagem final."""
         print(f"\n{Style.BLUE}Montando o sistema de arquivos final...{Style.RESET}")
-        if os.path.exists(MOUNT_POINT):
-            # Tenta desmontar recursivamente caso esteja montado de uma execução anterior
-            subprocess.run(["umount", "-R", MOUNT_POINT], stderr=subprocess.DEVNULL)
+        # Desmonta recursivamente caso esteja montado de uma execução anterior
+        # (o diretório em si é criado abaixo, com o subvolume de "/")
+        System.run(["umount", "-R", self.mount_point], check=False)
+
+        opts = self.mount_options
+        # Pais antes dos filhos: "/" primeiro, depois /home, /var, /var/log...
+        for name, target in self.subvolume_mounts():
+            path = os.path.normpath(os.path.join(self.mount_point, target.lstrip("/")))
+            System.effect(f"mkdir {path}", os.makedirs, path, exist_ok=True)
+            if System.run(["mount", "-o", f"{opts},subvol={name}", self.root_device_final, path]) is None:
+                raise RuntimeError(f"não foi possível montar {name} de {self.root_device_final} em {path}")
+
+        System.effect(f"mkdir {self.mount_point}/boot/efi", os.makedirs,
+                      f"{self.mount_point}/boot/efi", exist_ok=True)
+        if System.run(["mount", self.efi_part, f"{self.mount_point}/boot/efi"]) is None:
+            raise RuntimeError(f"não foi possível montar {self.efi_part} em {self.mount_point}/boot/efi")
+
+    @staticmethod
+    def subvolume_errors(subvolumes):
+        """Problemas de um layout {subvolume: ponto de montagem}."""
+        if not isinstance(subvolumes, dict) or not all(isinstance(v, str) for v in subvolumes.values()):
+            return ["subvolumes deve mapear nomes a pontos de montagem"]
+        errors = []
+        if subvolumes.get("@") != "/":
+            errors.append('o subvolume "@" precisa ser montado em "/"')
+        for name, target in subvolumes.items():
+            if not re.fullmatch(r"@[\w.-]*", name):
+                errors.append(f"nome de subvolume inválido: {name}")
+            if target and not target.startswith("/"):
+                errors.append(f"ponto de montagem de {name} deve ser absoluto: {target}")
+        targets = [t for t in subvolumes.values() if t]
+        if len(targets) != len(set(targets)):
+            errors.append("dois subvolumes no mesmo ponto de montagem")
+        return errors
+
+    def subvolume_mounts(self):
+        """(subvolume, ponto de montagem) dos subvolumes montados, do mais raso ao mais fundo."""
+        mounts = [(name, target) for name, target in self.subvolumes.items() if target]
+        return sorted(mounts, key=lambda item: len(item[1].rstrip("/").split("/")))
+
+    def select_mirror(self):
+        """Escolhe o espelho mais rápido entre os candidatos configurados."""
+        if self.golden_image or not self.mirrors:
+            return
+        probe = MirrorProbe(self.mirrors, self.suite)
+        with TRACER.span("mirror_probe", "rede") as span:
+            results = System.effect(f"sonda os espelhos {' '.join(self.mirrors)}", probe.run)
+            span["results"] = results
+        if results is None:
+            # Ensaio: nenhuma conexão é aberta; fica o espelho configurado
+            return
+        for r in results:
+            if r["healthy"]:
+                print(f"  {r['mirror']:<40} conexão {r['latency'] * 1000:6.0f}ms  "
+                      f"{r['throughput'] / 1024:8.0f} KiB/s")
+            else:
+                print(f"  {r['mirror']:<40} {Style.FAIL}indisponível: {r.get('error')}{Style.RESET}")
+        if results and results[0]["healthy"]:
+            self.mirror = results[0]["mirror"]
+            print(f"{Style.GREEN}Espelho escolhido: {self.mirror}{Style.RESET}")
         else:
-            os.makedirs(MOUNT_POINT)
+            print(f"{Style.WARN}Nenhum espelho respondeu; usando {self.mirror}.{Style.RESET}")
 
-        opts = "defaults,compress=zstd:1,noatime,space_cache=v2,discard=async"
-        System.run(["mount", "-o", f"{opts},subvol=@", self.root_device_final, MOUNT_POINT])
-        
-        # Cria os diretórios para os pontos de montagem aninhados
-        os.makedirs(f"{MOUNT_POINT}/home", exist_ok=True)
-        os.makedirs(f"{MOUNT_POINT}/boot/efi", exist_ok=True)
-        
-        System.run(["mount", "-o", f"{opts},subvol=@home", self.root_device_final, f"{MOUNT_POINT}/home"])
-        System.run(["mount", self.efi_part, f"{MOUNT_POINT}/boot/efi"])
+    def prefetch_packages(self):
+        """Baixa os pacotes do debootstrap enquanto o disco é preparado."""
+        if self.golden_image or self.offline_repo:
+            return
+        self.cache.seed(self.debootstrap_cache)
+        shutil.rmtree(self.prefetch_root, ignore_errors=True)
+        os.makedirs(self.prefetch_root)
+        cmd = [
+            "debootstrap",
+            "--download-only",
+            "--arch=amd64",
+            "--variant=minbase",
+            f"--cache-dir={self.debootstrap_cache}",
+            self.suite,
+            self.prefetch_root,
+            self.mirror
+        ]
+        # Roda em segundo plano sem ocupar o terminal; em caso de falha o
+        # debootstrap principal simplesmente baixa o que faltar.
+        if System.stream(cmd, quiet=True) != 0:
+            print(f"{Style.WARN}Pré-download dos pacotes falhou; o debootstrap fará o download.{Style.RESET}")
+        archives = f"{self.prefetch_root}/var/cache/apt/archives"
+        if os.path.isdir(archives):
+            for name in os.listdir(archives):
+                if name.endswith(".deb"):
+                    os.replace(os.path.join(archives, name), os.path.join(self.debootstrap_cache, name))
+        shutil.rmtree(self.prefetch_root, ignore_errors=True)
 
     def bootstrap_system(self):
         """Usa debootstrap para baixar e instalar um sistema Debian base."""
+        if self.golden_image:
+            # A imagem já contém o sistema base e os pacotes comuns
+            if self.golden_image.format == "tar":
+                print(f"\n{Style.BLUE}Descompactando imagem dourada {self.golden_image.path}...{Style.RESET}")
+                self.golden_image.unpack(self.mount_point)
+            return
         print(f"\n{Style.BLUE}Instalando sistema base Debian ({self.suite}) via debootstrap...{Style.RESET}")
         print(f"Isso pode levar vários minutos, dependendo da sua conexão com a internet.")
+        # Reaproveita os pacotes já baixados em instalações anteriores;
+        # o debootstrap valida cada .deb contra o índice Packages do espelho.
+        self.cache.seed(self.debootstrap_cache)
         cmd = [
             "debootstrap",
             "--arch=amd64",
             "--variant=minbase",
+            f"--cache-dir={self.debootstrap_cache}",
+        ]
+        if self.offline_repo:
+            cmd.append(f"--keyring={self.offline_repo.keyring}")
+        cmd += [
             self.suite,
-            MOUNT_POINT,
+            self.mount_point,
             self.mirror
         ]
-        try:
-            # Usamos subprocess.run diretamente para mostrar a saída em tempo real
-            subprocess.run(cmd, check=True)
-        except subprocess.CalledProcessError:
+        # A saída vai para o log; na tela fica a barra de progresso
+        if System.stream(cmd, title="debootstrap") != 0:
             print(f"{Style.FAIL}Falha no debootstrap. Verifique a conexão com a internet e o espelho do repositório.{Style.RESET}")
             sys.exit(1)
+        marker = os.path.join(self.mount_point, self.BOOTSTRAP_MARKER)
+        System.effect(f"mkdir {os.path.dirname(marker)}", os.makedirs, os.path.dirname(marker), exist_ok=True)
+        System.write_file(marker, "")
+        self.snapshot("bootstrap")
 
     def configure_system(self):
         """Configura o sistema base instalado (fstab, chroot, pacotes, etc.)."""
         print(f"\n{Style.BLUE}Configurando o sistema instalado...{Style.RESET}")
-        
+        self.prepare_chroot()
+        # Uma falha volta @ ao último snapshot bom e tenta de novo. Esgotadas as
+        # tentativas, não interrompe (o usuário pode inspecionar), mas mantém o
+        # diário para que --resume continue dali.
+        ok = self.with_rollback(self.install_base, "bootstrap")
+        if ok:
+            self.snapshot("packages")
+            ok = self.with_rollback(self.configure_machine, "packages")
+        self.chroot_failed = not ok
+        if ok:
+            self.keep_factory_snapshot()
+
+    @contextmanager
+    def toplevel(self):
+        """Raiz do btrfs montada durante o bloco."""
+        top = System.mount_toplevel(self.root_device_final, self.toplevel_mount)
+        try:
+            yield top
+        finally:
+            System.umount_toplevel(top)
+
+    def snapshots_enabled(self):
+        return "@snapshots" in self.subvolumes
+
+    def snapshot_exists(self, name):
+        if not self.snapshots_enabled():
+            return False
+        with self.toplevel() as top:
+            return os.path.isdir(f"{top}/@snapshots/{name}")
+
+    def snapshot(self, name):
+        """Cria (ou refaz) o snapshot somente leitura @snapshots/<name> de @."""
+        if not self.snapshots_enabled():
+            return
+        with TRACER.span(f"snapshot {name}", "disco"), self.toplevel() as top:
+            path = f"{top}/@snapshots/{name}"
+            if os.path.exists(path):
+                System.run(["btrfs", "subvolume", "delete", path])
+            System.run(["btrfs", "subvolume", "snapshot", "-r", f"{top}/@", path])
+
+    @staticmethod
+    def subvolume_field(path, field):
+        """Campo de "btrfs subvolume show" (ex.: UUID, Parent UUID) ou None."""
+        out = System.run(["btrfs", "subvolume", "show", path], check=False) or ""
+        for line in out.splitlines():
+            key, _, value = line.strip().partition(":")
+            if key == field:
+                return value.strip()
+        return None
+
+    def rollback(self, name):
+        """Troca @ por uma cópia gravável do snapshot e remonta o alvo.
+
+        Cada passo é conferido: se algo falhar (ex.: um processo do chroot
+        segurando a montagem) levanta RuntimeError em vez de remontar o @ sujo.
+        """
+        print(f"{Style.WARN}Voltando o sistema ao snapshot {name}...{Style.RESET}")
+        with TRACER.span(f"rollback {name}", "disco"):
+            System.run(["umount", "-R", self.mount_point], check=False)
+            if os.path.ismount(self.mount_point):
+                raise RuntimeError(f"não foi possível desmontar {self.mount_point} (processo do chroot ativo?)")
+            with self.toplevel() as top:
+                snap = f"{top}/@snapshots/{name}"
+                if System.run(["btrfs", "subvolume", "delete", f"{top}/@"]) is None:
+                    raise RuntimeError(f"não foi possível apagar o subvolume @ para voltar a {name}")
+                if System.run(["btrfs", "subvolume", "snapshot", snap, f"{top}/@"]) is None:
+                    raise RuntimeError(f"não foi possível recriar @ a partir de {name}")
+                # O novo @ precisa ser filho do snapshot, não o @ antigo que sobrou
+                if self.subvolume_field(f"{top}/@", "Parent UUID") != self.subvolume_field(snap, "UUID"):
+                    raise RuntimeError(f"@ não corresponde ao snapshot {name} após a troca")
+            self.mount_targets()
+            self.prepare_chroot()
+
+    def with_rollback(self, func, snapshot):
+        """Executa func; se falhar, volta ao snapshot e tenta de novo até self.retries vezes."""
+        for attempt in range(self.retries + 1):
+            if func():
+                return True
+            if attempt == self.retries or not self.snapshot_exists(snapshot):
+                return False
+            print(f"{Style.WARN}Etapa falhou; nova tentativa a partir do snapshot {snapshot} "
+                  f"({attempt + 1}/{self.retries}).{Style.RESET}")
+            try:
+                self.rollback(snapshot)
+            except RuntimeError as e:
+                # Sem troca confirmada não há nova tentativa; o diário permite --resume
+                print(f"{Style.FAIL}Falha ao voltar ao snapshot {snapshot}: {e}{Style.RESET}")
+                return False
+        return False
+
+    def keep_factory_snapshot(self):
+        """Guarda o sistema recém-instalado em @snapshots/factory e descarta os intermediários."""
+        if not self.snapshots_enabled():
+            return
+        reset_tool = f"{self.mount_point}/usr/local/sbin/toca-factory-reset"
+        System.write_file(reset_tool, self.factory_reset_script())
+        System.effect(f"chmod 755 {reset_tool}", os.chmod, reset_tool, 0o755)
+        # A entrada do GRUB lê o kernel do snapshot pelo ponto de montagem do @snapshots
+        boot_entry = self.factory_boot_entry and self.subvolumes["@snapshots"]
+        if boot_entry:
+            entry = f"{self.mount_point}/etc/grub.d/41_toca_factory"
+            System.write_file(entry, self.factory_grub_script(self.subvolumes["@snapshots"]))
+            System.effect(f"chmod 755 {entry}", os.chmod, entry, 0o755)
+
+        self.snapshot(self.FACTORY_SNAPSHOT)
+        if boot_entry:
+            # O snapshot já existe: agora o update-grub encontra o kernel dele
+            System.run(["chroot", self.mount_point, "update-grub"], check=False)
+        with self.toplevel() as top:
+            for name in self.SNAPSHOTS:
+                if os.path.isdir(f"{top}/@snapshots/{name}"):
+                    System.run(["btrfs", "subvolume", "delete", f"{top}/@snapshots/{name}"])
+        print(f"{Style.GREEN}Ponto de restauração salvo em @snapshots/{self.FACTORY_SNAPSHOT}; "
+              f"use toca-factory-reset para voltar a ele.{Style.RESET}")
+
+    def factory_reset_script(self):
+        """Comando do sistema instalado que volta @ ao snapshot de fábrica."""
+        return f"""#!/bin/sh
+# Restaura o sistema ao estado de fábrica gravado pelo tocainstall.
+# O @ atual é preservado em @snapshots/pre-reset-<data>; vale após reiniciar.
+set -e
+[ "$(id -u)" = 0 ] || {{ echo "Execute como root." >&2; exit 1; }}
+DEV=$(findmnt -no SOURCE / | sed 's/\\[.*\\]$//')
+TOP=$(mktemp -d)
+mount -o subvolid=5 "$DEV" "$TOP"
+trap 'umount "$TOP"; rmdir "$TOP"' EXIT
+[ -d "$TOP/@snapshots/{self.FACTORY_SNAPSHOT}" ] || {{ echo "Snapshot de fábrica não encontrado." >&2; exit 1; }}
+mv "$TOP/@" "$TOP/@snapshots/pre-reset-$(date +%Y%m%d-%H%M%S)"
+btrfs subvolume snapshot "$TOP/@snapshots/{self.FACTORY_SNAPSHOT}" "$TOP/@"
+echo "Sistema restaurado. Reinicie para usá-lo."
+"""
+
+    def factory_grub_script(self, snapshots_dir):
+        """/etc/grub.d/41_toca_factory: entrada de resgate que inicia o snapshot de fábrica.
+
+        O snapshot é somente leitura e não há overlay: o fstab dele ainda monta
+        subvol=@ e nada pode ser gravado em /. Por isso a entrada inicia direto
+        no rescue.target, para inspecionar ou rodar toca-factory-reset, e não
+        serve como sistema de uso normal.
+        """
+        snap = f"@snapshots/{self.FACTORY_SNAPSHOT}"
+        return f"""#!/bin/sh
+set -e
+. /usr/share/grub/grub-mkconfig_lib
+KERNEL=$(ls -1 "{snapshots_dir.rstrip('/')}/{self.FACTORY_SNAPSHOT}"/boot/vmlinuz-* 2>/dev/null | sort -V | tail -n 1)
+[ -n "$KERNEL" ] || exit 0
+VERSION=${{KERNEL##*/vmlinuz-}}
+echo "Adicionando entrada de fábrica: $VERSION" >&2
+echo "menuentry 'Toca Linux (fábrica, resgate somente leitura)' --class gnu-linux {{"
+prepare_grub_to_access_device "$GRUB_DEVICE" | sed 's/^/\t/'
+echo "\tlinux /{snap}/boot/vmlinuz-$VERSION root=UUID=$GRUB_DEVICE_UUID ro rootflags=subvol={snap} systemd.unit=rescue.target $GRUB_CMDLINE_LINUX"
+echo "\tinitrd /{snap}/boot/initrd.img-$VERSION"
+echo "}}"
+"""
+
+    def prepare_chroot(self):
+        """Monta os sistemas virtuais, copia o DNS e gera o fstab do alvo."""
         # Monta sistemas de arquivos virtuais para o chroot funcionar corretamente
         for mp in ["/dev", "/dev/pts", "/proc", "/sys"]:
-            System.run(["mount", "--bind", mp, f"{MOUNT_POINT}{mp}"])
+            System.run(["mount", "--bind", mp, f"{self.mount_point}{mp}"])
         
         # Copia a configuração de DNS para dentro do chroot para que a rede funcione
-        shutil.copy("/etc/resolv.conf", f"{MOUNT_POINT}/etc/resolv.conf")
+        System.effect(f"copia /etc/resolv.conf para {self.mount_point}/etc", shutil.copy,
+                      "/etc/resolv.conf", f"{self.mount_point}/etc/resolv.conf")
+
+        if self.offline_repo:
+            # O apt do chroot lê o repositório local (somente leitura)
+            repo = f"{self.mount_point}{OfflineRepo.CHROOT_PATH}"
+            System.effect(f"mkdir {repo}", os.makedirs, repo, exist_ok=True)
+            System.run(["mount", "--bind", self.offline_repo.path, repo])
+            System.run(["mount", "-o", "remount,bind,ro", repo])
 
         # Gera o /etc/fstab
         root_uuid = System.get_uuid(self.root_device_final)
         efi_uuid = System.get_uuid(self.efi_part)
-        fstab_opts = "defaults,compress=zstd:1,noatime,space_cache=v2,discard=async"
-        fstab_content = (
-            f"UUID={root_uuid} / btrfs {fstab_opts},subvol=@ 0 0\n"
-            f"UUID={root_uuid} /home btrfs {fstab_opts},subvol=@home 0 0\n"
-            f"UUID={efi_uuid} /boot/efi vfat defaults 0 2\n"
-        )
-        System.write_file(f"{MOUNT_POINT}/etc/fstab", fstab_content)
-
-        # URL do pacote .deb customizado
-        repo_deb_url = "https://raw.githubusercontent.com/NextFerretDUR/repo1/main/nfdurh.deb"
-        
+        fstab_opts = self.mount_options
+        fstab_content = "".join(f"UUID={root_uuid} {target} btrfs {fstab_opts},subvol={name} 0 0\n"
+                                for name, target in self.subvolume_mounts())
+        fstab_content += f"UUID={efi_uuid} /boot/efi vfat defaults 0 2\n"
+        if self.swap_part:
+            swap_dev = "/dev/mapper/cryptswap" if self.use_luks else f"UUID={System.get_uuid(self.swap_part)}"
+            fstab_content += f"{swap_dev} none swap sw 0 0\n"
+        System.write_file(f"{self.mount_point}/etc/fstab", fstab_content)
+        # Imagens douradas e réplicas não levam o conteúdo de subvolumes como o
+        # @var_log; o apt precisa do diretório dele para registrar o histórico
+        System.effect(f"mkdir {self.mount_point}/var/log/apt", os.makedirs,
+                      f"{self.mount_point}/var/log/apt", exist_ok=True)
+
+    def install_base(self):
+        """Instala os pacotes comuns; retorna False se o script do chroot falhar."""
+        # Parte independente da máquina: já vem pronta quando há imagem dourada
+        if self.golden_image is not None:
+            return True
+        # Entrega ao apt do chroot os pacotes que já estão no cache: a área fica no
+        # mesmo sistema de arquivos do cache (hardlinks) e entra no alvo por bind
+        # mount, sem copiar gigabytes para o btrfs do alvo.
+        staging = os.path.join(CACHE_DIR, f"archives-{os.path.basename(self.mount_point)}")
+        os.makedirs(os.path.join(staging, "partial"), exist_ok=True)
+        self.cache.seed(staging)
+        archives = f"{self.mount_point}/var/cache/apt/archives"
+        System.effect(f"mkdir {archives}", os.makedirs, archives, exist_ok=True)
+        if System.run(["mount", "--bind", staging, archives]) is None:
+            raise RuntimeError(f"não foi possível montar o cache de pacotes em {archives}")
+        try:
+            ok = self.run_chroot_script("setup_base.sh", self.base_script())
+        finally:
+            System.run(["umount", archives], check=False)
+        self.update_cache(staging)
+        if ok and self.golden_build_dir:
+            self.capture_golden_image()
+        if ok and self.offline_build_dir:
+            self.build_offline_repo()
+        return ok
+
+    def build_offline_repo(self):
+        """Gera o repositório local com exatamente os pacotes instalados neste alvo."""
+        print(f"\n{Style.BLUE}Gerando repositório offline em {self.offline_build_dir}...{Style.RESET}")
+        installed = PackageCache.read_installed(f"{self.mount_point}/var/lib/dpkg/status")
+        debs, missing = [], []
+        for key in sorted(installed):
+            digest = self.cache.index.get(key)
+            if digest and os.path.exists(self.cache.blob_path(digest)):
+                debs.append(self.cache.blob_path(digest))
+            else:
+                missing.append(key)
+
+        # O próprio instalador vai junto na mídia, mas não é instalado no alvo
+        own = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tocainstall_1.0_all.deb")
+        if os.path.exists(own):
+            debs.append(own)
+
+        # Pacote customizado fora do Debian: instalado pelo nome nas máquinas
+        extras_dir = os.path.join(CACHE_DIR, "extras")
+        os.makedirs(extras_dir, exist_ok=True)
+        custom = os.path.join(extras_dir, "nfdurh.deb")
+        if System.run(["wget", "-q", self.CUSTOM_DEB_URL, "-O", custom]) is None:
+            raise RuntimeError(f"não foi possível baixar {self.CUSTOM_DEB_URL}; o repositório offline ficaria sem ele")
+        extras = [custom]
+        extra_names = {OfflineRepo.control(deb).split("\n", 1)[0].partition(": ")[2] for deb in extras}
+        # O customizado aparece em "installed" mas não está no cache (não tem hash do espelho)
+        missing = [key for key in missing if key.split("_", 1)[0] not in extra_names]
+        if missing:
+            # Uma instalação offline a partir dele falharia no meio do apt
+            raise RuntimeError("pacotes instalados fora do cache, o repositório offline não seria "
+                               f"autocontido: {', '.join(missing)}")
+
+        with TRACER.span("offline_repo", "pacotes", packages=len(debs) + len(extras)):
+            # Ensaio: nada é lido nem gravado (o build apaga e recria dists/)
+            repo = System.effect(f"gera o repositório offline em {self.offline_build_dir} "
+                                 f"({len(debs) + len(extras)} pacotes)",
+                                 OfflineRepo.build, self.offline_build_dir, self.suite, debs, extras)
+        if repo is None:
+            return
+        print(f"{Style.GREEN}Repositório offline pronto: {repo.path} "
+              f"({repo.manifest['packages']} pacotes).{Style.RESET}")
+
+    def configure_machine(self):
+        """Executa a parte específica da máquina (usuário, crypttab, GRUB...)."""
+        return self.run_chroot_script("setup_internal.sh", self.machine_script())
+
+    def script_prelude(self):
+        """Cabeçalho comum dos scripts do chroot com a função de etapas retomáveis."""
+        return """#!/bin/bash
+set -e
+# Uma falha em qualquer ponto de um pipeline (ex.: apt-get ... | awk) interrompe o script
+set -o pipefail
+export DEBIAN_FRONTEND=noninteractive
+
+# Cada etapa concluída deixa um marcador; numa retomada ela é pulada.
+STEPS=/var/lib/tocainstall/steps
+mkdir -p "$STEPS"
+step() {
+    local name="$1"; shift
+    if [ -e "$STEPS/$name" ]; then
+        echo "Etapa $name já concluída, pulando."
+        return 0
+    fi
+    "$@"
+    touch "$STEPS/$name"
+}
+
+# Mede uma etapa e relata o tempo ao instalador (vai para o trace)
+timed() {
+    local name="$1"; shift
+    local start=$(date +%s.%N)
+    "$@"
+    echo "TOCA-TIMING $name $start $(date +%s.%N) $TIMING_EXTRA"
+}
+
+# O initramfs é gerado uma única vez no fim; até lá update-initramfs vira um stub
+defer_initramfs() {
+    dpkg-divert --local --rename --divert /usr/sbin/update-initramfs.toca --add /usr/sbin/update-initramfs
+    printf '#!/bin/sh\\necho "update-initramfs adiado pelo instalador"\\n' > /usr/sbin/update-initramfs
+    chmod +x /usr/sbin/update-initramfs
+}
+restore_initramfs() {
+    if [ "$(dpkg-divert --truename /usr/sbin/update-initramfs)" = /usr/sbin/update-initramfs.toca ]; then
+        rm -f /usr/sbin/update-initramfs
+        dpkg-divert --local --rename --divert /usr/sbin/update-initramfs.toca --remove /usr/sbin/update-initramfs
+    fi
+}
+
+# Mesmo se o script falhar, o alvo não fica com o stub nem sem fsync no dpkg
+cleanup() {
+    rm -f /etc/dpkg/dpkg.cfg.d/toca-unsafe-io
+    restore_initramfs
+}
+trap cleanup EXIT
+"""
+
+    def base_script(self):
+        """Script de chroot com a parte comum a todas as máquinas (pacotes)."""
+
+        # Pacotes instalados com recomendações (como um apt-get install comum)
+        packages = list(self.packages) + [self.INITRAMFS_COMPRESSORS[self.initramfs_compress]]
+        # A imagem dourada e o repositório local precisam servir para máquinas com e sem LUKS
+        if self.use_luks or self.golden_build_dir or self.offline_build_dir:
+            packages += self.luks_packages
+        # ... e para qualquer --initramfs-compress escolhido na hora de instalar
+        if self.golden_build_dir or self.offline_build_dir:
+            packages += sorted(set(self.INITRAMFS_COMPRESSORS.values()) - set(packages))
+
+        if self.offline_repo:
+            # Tudo vem do repositório local, inclusive os pacotes customizados (pelo nome)
+            repo = OfflineRepo.CHROOT_PATH
+            source = f"deb [signed-by={repo}/{OfflineRepo.KEYRING}] file://{repo} {self.suite} main"
+            fetch_custom = ""
+            custom = " ".join(self.offline_repo.extras)
+            # O sistema instalado fica apontando para o espelho oficial
+            final_sources = (f'    echo "deb {DEFAULT_MIRRORS[0]} {self.suite} main contrib non-free '
+                             f'non-free-firmware" > /etc/apt/sources.list\n')
+        else:
+            source = f"deb {self.mirror} {self.suite} main contrib non-free non-free-firmware"
+            fetch_custom = (f'    echo "Baixando pacote customizado..."\n'
+                            f'    wget -q "{self.CUSTOM_DEB_URL}" -O /tmp/nfdurh.deb\n\n')
+            custom = "/tmp/nfdurh.deb"
+            final_sources = ""
+
+        return self.script_prelude() + f"""
+# Configura o sources.list para o sistema base
+sources() {{
+    echo "{source}" > /etc/apt/sources.list
+    apt-get update
+}}
+step base-sources sources
+
+# Instala todos os pacotes (incluindo o .deb customizado) numa única transação
+install_packages() {{
+{fetch_custom}    # As recomendações valem só para o primeiro grupo: resolve esse grupo
+    # em simulação e instala tudo junto com --no-install-recommends.
+    RESOLVED=$(apt-get install -s -y {' '.join(packages)} | awk '/^Inst /{{print $2}}')
+
+    # Sem fsync por arquivo durante a instalação; um único sync no final.
+    echo "force-unsafe-io" > /etc/dpkg/dpkg.cfg.d/toca-unsafe-io
+    defer_initramfs
+    echo "Instalando pacotes em uma única transação..."
+    # NoTriggers adia os gatilhos para uma única passada (dpkg --configure --pending)
+    apt-get install -y --no-install-recommends -o DPkg::NoTriggers=true \\
+        $RESOLVED {' '.join(self.minimal_packages)} {custom}
+    restore_initramfs
+    rm -f /etc/dpkg/dpkg.cfg.d/toca-unsafe-io
+{final_sources}    sync
+}}
+step base-packages timed packages install_packages
+
+# Habilita o NetworkManager
+systemctl enable NetworkManager
+
+# Limpeza
+rm -f /tmp/nfdurh.deb /setup_base.sh
+"""
+
+    def machine_script(self):
+        """Script de chroot com a configuração específica desta máquina."""
         # Bloco de configuração para LUKS, se habilitado
         luks_setup = ""
         if self.use_luks:
+            swap_crypttab = ""
+            if self.swap_part:
+                # Swap criptografada com chave aleatória a cada boot. O crypttab separa as
+                # opções por vírgula: a do Adiantum (xchacha12,aes-...) precisa ser escapada
+                cipher = self.swap_cipher[0].replace(",", "\\,")
+                swap_crypttab = (f'\n    SWAP_PARTUUID=$(blkid -s PARTUUID -o value {self.swap_part})'
+                                 f'\n    echo "cryptswap PARTUUID=$SWAP_PARTUUID /dev/urandom '
+                                 f'swap,cipher={cipher},size={self.swap_cipher[1]}" >> /etc/crypttab')
             luks_setup = f"""
 # Configurando LUKS para o boot
-echo "Instalando cryptsetup-initramfs..."
-apt-get install -y cryptsetup-initramfs
-RAW_UUID=$(blkid -s UUID -o value {self.root_part})
-echo "Criando /etc/crypttab..."
-echo "{MAPPER_NAME} UUID=$RAW_UUID none luks,discard,initramfs" > /etc/crypttab
+luks_setup() {{
+    if ! dpkg -s cryptsetup-initramfs > /dev/null 2>&1; then
+        echo "Instalando cryptsetup-initramfs..."
+        defer_initramfs
+        apt-get install -y cryptsetup-initramfs
+        restore_initramfs
+    fi
+    RAW_UUID=$(blkid -s UUID -o value {self.root_part})
+    echo "Criando /etc/crypttab..."
+    echo "{MAPPER_NAME} UUID=$RAW_UUID none luks,discard,initramfs" > /etc/crypttab{swap_crypttab}
+}}
+step machine-luks luks_setup
 """
 
-        # Script que será executado dentro do chroot
-        setup_script = f"""#!/bin/bash
-set -e
-export DEBIAN_FRONTEND=noninteractive
-
-# Configura o sources.list para o sistema base
-echo "deb {self.mirror} {self.suite} main contrib non-free non-free-firmware" > /etc/apt/sources.list
-apt-get update
-
-# Instala pacotes essenciais e de hardware
-echo "Instalando kernel, sudo e ferramentas de rede..."
-apt-get install -y linux-image-amd64 sudo network-manager firmware-linux wget ca-certificates
+        # Discos duplicados vão para outras máquinas: caminho EFI padrão e sem NVRAM local
+        grub_flags = " --removable --no-nvram" if self.removable_boot else ""
 
-# Instala o ambiente gráfico mínimo e o bootloader
-echo "Instalando X.Org mínimo e GRUB..."
-apt-get install -y --no-install-recommends xserver-xorg-core xserver-xorg-video-all xserver-xorg-input-all xinit xterm x11-xserver-utils grub-efi-amd64-signed shim-signed
+        # Imagem só com os módulos desta máquina não serve para discos duplicados
+        modules = self.initramfs_modules
+        if modules == "dep" and self.removable_boot:
+            print(f"{Style.WARN}MODULES=dep ignorado: discos duplicados usam o initramfs genérico.{Style.RESET}")
+            modules = "most"
+        compressor = self.INITRAMFS_COMPRESSORS[self.initramfs_compress]
+        # O mkfs pulou o TRIM: ele roda depois, semanalmente, pelo util-linux
+        trim_setup = "\nstep machine-trim systemctl enable fstrim.timer\n" if self.trim == "deferred" else ""
+        level = f"COMPRESSLEVEL={self.initramfs_level}\\n" if self.initramfs_level is not None else ""
 
-# Baixa e instala o pacote .deb customizado
-echo "Baixando e instalando pacote customizado..."
-wget -q "{repo_deb_url}" -O /tmp/nfdurh.deb
-dpkg -i /tmp/nfdurh.deb || apt-get install -f -y
+        return self.script_prelude() + f"""
+# Identidade própria da máquina: imagens douradas e réplicas trazem o
+# machine-id (DHCP client-id, journald) e a semente aleatória do disco de origem
+machine_identity() {{
+    rm -f /etc/machine-id /var/lib/dbus/machine-id /var/lib/systemd/random-seed
+    systemd-machine-id-setup
+    if [ -d /var/lib/dbus ]; then
+        ln -s /etc/machine-id /var/lib/dbus/machine-id
+    fi
+}}
+step machine-identity machine_identity
 
 # Cria o usuário e define senhas
-echo "Criando usuário {self.username}..."
-useradd -m -s /bin/bash -G sudo {self.username}
-echo "{self.username}:{self.password}" | chpasswd
-echo "root:{self.password}" | chpasswd
+create_user() {{
+    echo "Criando usuário {self.username}..."
+    id {self.username} > /dev/null 2>&1 || useradd -m -s /bin/bash -G sudo {self.username}
+{self.password_commands()}
 
-# Configura um .xinitrc básico para o usuário
-echo "exec xterm" > /home/{self.username}/.xinitrc
-chown {self.username}:{self.username} /home/{self.username}/.xinitrc
+    # Configura um .xinitrc básico para o usuário
+    echo "exec xterm" > /home/{self.username}/.xinitrc
+    chown {self.username}:{self.username} /home/{self.username}/.xinitrc
+}}
+step machine-user create_user
 
 # Executa a configuração do LUKS se necessário
 {luks_setup}
 
-# Atualiza initramfs e instala o GRUB
-echo "Finalizando configuração do bootloader..."
-update-initramfs -u -k all
-grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=TocaLinux --recheck
-update-grub
+# Gera o initramfs uma única vez, com o perfil escolhido
+build_initramfs() {{
+    restore_initramfs
+    if ! command -v {self.initramfs_compress} > /dev/null 2>&1; then
+        apt-get install -y {compressor}
+    fi
+    printf 'MODULES={modules}\\nCOMPRESS={self.initramfs_compress}\\n{level}' > /etc/initramfs-tools/conf.d/toca.conf
+    echo "Gerando initramfs (MODULES={modules}, {self.initramfs_compress})..."
+    for version in $(ls /lib/modules); do
+        if [ -e /boot/initrd.img-$version ]; then
+            update-initramfs -u -k $version
+        else
+            update-initramfs -c -k $version
+        fi
+    done
+    SIZE=$(cat /boot/initrd.img-* | wc -c)
+    echo "Initramfs: $((SIZE / 1024)) KiB"
+    TIMING_EXTRA="bytes=$SIZE modules={modules} compress={self.initramfs_compress}"
+}}
+step machine-initramfs timed initramfs build_initramfs
+
+# Instala o GRUB
+bootloader() {{
+    echo "Finalizando configuração do bootloader..."
+    grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=TocaLinux --recheck{grub_flags}
+    update-grub
+}}
+step machine-bootloader bootloader
 
 # Configura locale e hostname
-echo "Configurando locale e hostname..."
-echo "{self.selected_locale} UTF-8" > /etc/locale.gen
-locale-gen
-echo "LANG={self.selected_locale}" > /etc/default/locale
-echo "{self.hostname}" > /etc/hostname
+locale_hostname() {{
+    echo "Configurando locale e hostname..."
+    echo "{self.selected_locale} UTF-8" > /etc/locale.gen
+    locale-gen
+    echo "LANG={self.selected_locale}" > /etc/default/locale
+    echo "{self.hostname}" > /etc/hostname
+}}
+step machine-locale locale_hostname
+{trim_setup}
+# Limpeza: a instalação terminou, os marcadores não são mais necessários
+rm -rf "$STEPS" /setup_internal.sh
+"""
 
-# Habilita o NetworkManager
-systemctl enable NetworkManager
+    def password_commands(self):
+        """Comandos do chroot que definem a senha do usuário e do root."""
+        if self.password_hash:
+            # Hash já pronto (arquivo de respostas): a senha em texto nunca é usada
+            user = shlex.quote(f"{self.username}:{self.password_hash}")
+            root = shlex.quote(f"root:{self.password_hash}")
+            return f"echo {user} | chpasswd -e\necho {root} | chpasswd -e"
+        return (f'echo "{self.username}:{self.password}" | chpasswd\n'
+                f'echo "root:{self.password}" | chpasswd')
 
-# Limpeza
-rm -f /tmp/nfdurh.deb /setup_internal.sh
-"""
-        System.write_file(f"{MOUNT_POINT}/setup_internal.sh", setup_script)
-        System.run(["chmod", "+x", f"{MOUNT_POINT}/setup_internal.sh"])
+    def run_chroot_script(self, name, content):
+        """Grava um script no sistema instalado e o executa via chroot."""
+        System.write_file(f"{self.mount_point}/{name}", content)
+        System.run(["chmod", "+x", f"{self.mount_point}/{name}"])
 
-        print(f"{Style.WARN}Entrando no chroot para finalizar a configuração...{Style.RESET}")
+        print(f"{Style.WARN}Entrando no chroot para finalizar a configuração ({name})...{Style.RESET}")
+        # O apt relata o progresso em stdout (APT::Status-Fd) para a barra
+        progress_conf = f"{self.mount_point}/etc/apt/apt.conf.d/00toca-progress"
+        System.write_file(progress_conf, 'APT::Status-Fd "1";\n')
         try:
-            subprocess.run(["chroot", MOUNT_POINT, "/setup_internal.sh"], check=True)
-        except subprocess.CalledProcessError:
+            returncode = System.stream(["chroot", self.mount_point, f"/{name}"], title=name)
+        finally:
+            System.effect(f"rm {progress_conf}", os.remove, progress_conf)
+        if returncode != 0:
             print(f"{Style.FAIL}A configuração via chroot falhou. O sistema pode estar inconsistente.{Style.RESET}")
             # Não saia imediatamente, permita a finalização para que o usuário possa inspecionar.
+            return False
+        return True
+
+    def update_cache(self, archives):
+        """Guarda no cache os pacotes baixados nesta instalação e aplica o limite de tamanho."""
+        expected = PackageCache.read_packages_hashes(f"{self.mount_point}/var/lib/apt/lists")
+        installed = PackageCache.read_installed(f"{self.mount_point}/var/lib/dpkg/status")
+        try:
+            self.cache.absorb(self.debootstrap_cache, expected, installed)
+            self.cache.absorb(archives, expected, installed)
+            # A área de trabalho do debootstrap guarda hardlinks; sem limpá-la
+            # a remoção de pacotes antigos não liberaria espaço.
+            shutil.rmtree(self.debootstrap_cache, ignore_errors=True)
+            self.cache.evict()
+            self.cache.save()
+        except OSError as e:
+            print(f"{Style.WARN}Não foi possível atualizar o cache de pacotes: {e}{Style.RESET}")
+        # Os pacotes já estão no cache; a área de trabalho do apt pode ser esvaziada.
+        def clear():
+            for deb in glob.glob(os.path.join(glob.escape(archives), "*.deb")):
+                try:
+                    os.remove(deb)
+                except OSError:
+                    pass
+        System.effect(f"rm {archives}/*.deb", clear)
     
     def finalize(self):
         """Finaliza a instalação, copia configurações de rede e desmonta tudo."""
         print(f"\n{Style.BLUE}Finalizando e limpando...{Style.RESET}")
-        
-        # Copia as conexões de rede ativas para o novo sistema
-        nm_connections_path = "/etc/NetworkManager/system-connections/"
-        target_nm_path = f"{MOUNT_POINT}/etc/NetworkManager/system-connections/"
-        if os.path.exists(nm_connections_path):
-            print("Copiando configurações de rede para o novo sistema...")
-            os.makedirs(target_nm_path, exist_ok=True)
-            System.run(f"cp -r {nm_connections_path}* {target_nm_path}", shell=True, check=False)
-            System.run(f"chmod 600 {target_nm_path}*", shell=True, check=False)
+        trace_path = self.release_target()
+        for target in self.targets:
+            target.release_target()
+        if self.replica:
+            for path in (self.replica.path, f"{self.replica.path}.json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        print(f"Cache de pacotes: {self.cache.report()}")
+        if self.scheduler:
+            print(f"\n{Style.BOLD}Etapas:{Style.RESET}\n{self.scheduler.report()}")
+        print(f"\n{Style.BOLD}Comandos mais demorados:{Style.RESET}\n{TRACER.summary()}")
+        print(f"Trace completo: {trace_path}")
+        if self.trace_copy:
+            TRACER.write(self.trace_copy)
+
+        print(f"\n{Style.GREEN}{Style.BOLD}INSTALAÇÃO COMPLETA!{Style.RESET}")
+        print("Você agora pode reiniciar o sistema.")
+
+    @staticmethod
+    def copy_connections(src, dest):
+        """Copia os perfis do NetworkManager (com senhas de Wi-Fi) deixando-os só para o root."""
+        if not os.path.isdir(src):
+            return
+        print("Copiando configurações de rede para o novo sistema...")
+        shutil.copytree(src, dest, dirs_exist_ok=True)
+        for dirpath, _, files in os.walk(dest):
+            for name in files:
+                os.chmod(os.path.join(dirpath, name), 0o600)
+
+    def release_target(self):
+        """Grava trace e log no alvo, desmonta e fecha o LUKS; retorna o caminho do trace."""
+        # Copia as conexões de rede ativas para o novo sistema. Um único efeito:
+        # o plano do ensaio não depende de o host ter conexões salvas
+        nm_connections_path = "/etc/NetworkManager/system-connections"
+        target_nm_path = f"{self.mount_point}/etc/NetworkManager/system-connections"
+        try:
+            System.effect(f"copia as conexões de {nm_connections_path} para {target_nm_path} (0600)",
+                          self.copy_connections, nm_connections_path, target_nm_path)
+        except OSError as e:
+            print(f"{Style.WARN}Não foi possível copiar as conexões de rede: {e}{Style.RESET}")
+
+        # Grava o trace de tempos no sistema instalado (ou em /tmp se ele não estiver montado)
+        trace_path = "/tmp/tocainstall-trace.json"
+        if os.path.isdir(f"{self.mount_point}/var/log"):
+            trace_path = f"{self.mount_point}/var/log/tocainstall-trace.json"
+        try:
+            System.effect(f"grava o trace em {trace_path}", TRACER.write, trace_path)
+            if os.path.isdir(f"{self.mount_point}/var/log") and os.path.exists(LOG_PATH):
+                # Como no host, só root lê o log no sistema instalado
+                target_log = f"{self.mount_point}/var/log/tocainstall.log"
+                System.effect(f"copia o log para {target_log} (0600)", System.copy_private, LOG_PATH, target_log)
+        except OSError as e:
+            print(f"{Style.WARN}Não foi possível gravar o trace: {e}{Style.RESET}")
 
         # Desmonta todos os sistemas de arquivos
         print("Desmontando sistemas de arquivos...")
-        subprocess.run(["umount", "-R", MOUNT_POINT], stderr=subprocess.DEVNULL)
+        System.run(["umount", "-R", self.mount_point], check=False)
         
         # Fecha o container LUKS se foi usado
         if self.use_luks:
             print("Fechando container LUKS...")
-            subprocess.run(["cryptsetup", "close", MAPPER_NAME], stderr=subprocess.DEVNULL)
+            System.run(["cryptsetup", "close", self.mapper_name], check=False)
+        return trace_path
 
-        print(f"\n{Style.GREEN}{Style.BOLD}INSTALAÇÃO COMPLETA!{Style.RESET}")
-        print("Você agora pode reiniciar o sistema.")
+    def prepare_storage(self):
+        """Particiona, criptografa, formata e monta o disco deste alvo."""
+        self.partition_disk()
+        self.setup_luks_if_enabled()
+        self.format_btrfs()
+        self.receive_golden_image()
+        self.mount_targets()
+
+    def measure_cpu(self):
+        """Mede a CPU uma vez para todos os alvos (LUKS e compressão).
+
+        Em paralelo, os benchmarks de cada disco disputariam os mesmos núcleos:
+        menos iterações de PBKDF2 que o alvo e compressão subestimada.
+        """
+        with TRACER.span("cpu-benchmark", "disco") as info:
+            if self.use_luks:
+                self.luks_cpu = LuksTuning().measure_cpu()
+                info["pbkdf2_rate"] = self.luks_cpu["pbkdf2_rate"]
+            if System.executor.live:
+                try:
+                    self.compressors = StorageProfile.measure_compressors()
+                except OSError as e:
+                    # Sem medição: cada alvo fica com a compressão padrão
+                    info["error"] = str(e)
+                    self.compressors = {}
+                info["compressors"] = self.compressors
+
+    def prepare_targets(self):
+        """Cria um alvo por disco extra e prepara todos os discos em paralelo."""
+        self.measure_cpu()
+        self.targets = []
+        for i, disk in enumerate(self.target_disks[1:], 1):
+            target = copy.copy(self)
+            target.disk = disk
+            target.mount_point = f"{MOUNT_POINT}{i}"
+            target.mapper_name = f"{MAPPER_NAME}{i}"
+            target.toplevel_mount = f"{TOPLEVEL_MOUNT}{i}"
+            if self.layout.seed is not None:
+                # GUIDs repetidos entre discos confundiriam PARTUUID/by-partuuid
+                target.layout = copy.copy(self.layout)
+                target.layout.seed = f"{self.layout.seed}:{i}"
+            target.targets = []
+            self.targets.append(target)
+        self.parallel([t.prepare_storage for t in [self] + self.targets])
+
+    def install_primary_base(self):
+        """Instala a parte comum no primeiro disco e a captura para replicação."""
+        self.prepare_chroot()
+        if not self.install_base():
+            raise RuntimeError("a instalação dos pacotes comuns falhou")
+        if self.golden_image is None:
+            info = {"suite": self.suite, "mirror": self.mirror}
+            path = GoldenImage.build(self.mount_point, self.root_device_final,
+                                     os.path.join(CACHE_DIR, "replica"), "tar", info, self.toplevel_mount)
+            self.replica = GoldenImage(path)
+
+    def replicate(self, source):
+        """Copia o sistema comum para este alvo e executa a parte da máquina."""
+        if source is None:
+            self.bootstrap_system()
+        else:
+            source.unpack(self.mount_point)
+        self.prepare_chroot()
+        if not self.configure_machine():
+            raise RuntimeError(f"a configuração de {self.disk} falhou")
+        self.keep_factory_snapshot()
+
+    def replicate_targets(self):
+        """Replica o rootfs para os demais discos e configura todos em paralelo."""
+        def configure_primary():
+            if not self.configure_machine():
+                raise RuntimeError(f"a configuração de {self.disk} falhou")
+            self.keep_factory_snapshot()
+        jobs = [configure_primary]
+        jobs += [lambda t=t: t.replicate(self.replica) for t in self.targets]
+        self.parallel(jobs)
+
+    def parallel(self, jobs):
+        """Executa as funções em paralelo e propaga a primeira falha."""
+        with ThreadPoolExecutor(max_workers=self.workers(jobs)) as pool:
+            for future in [pool.submit(job) for job in jobs]:
+                future.result()
+
+    def workers(self, jobs):
+        """Threads para jobs paralelos; uma só (ordem fixa) num ensaio."""
+        return len(jobs) if System.executor.live else 1
+
+    def resume_hint(self):
+        if self.journal.completed:
+            print(f"{Style.WARN}Etapas concluídas foram salvas; use --resume para continuar.{Style.RESET}")
+
+    def stages(self):
+        """Declara as etapas da instalação como um DAG de entradas e saídas."""
+        if len(self.target_disks) > 1:
+            return self.multi_target_stages()
+        return [
+            Stage("check_environment", self.check_environment, provides=["ambiente"], interactive=True),
+            Stage("setup_network", self.setup_network, ["ambiente"], ["rede"], interactive=True),
+            Stage("select_mirror", self.select_mirror, ["rede"], ["espelho"]),
+            Stage("prefetch_packages", self.prefetch_packages, ["espelho"], ["pacotes_baixados"]),
+            Stage("collect_info", self.collect_info, ["rede"], ["disco"], interactive=True),
+            Stage("partition_disk", self.partition_disk, ["disco"], ["particoes"]),
+            Stage("setup_luks_if_enabled", self.setup_luks_if_enabled, ["particoes"], ["dispositivo_raiz"]),
+            Stage("format_btrfs", self.format_btrfs, ["dispositivo_raiz"], ["sistemas_de_arquivos"]),
+            Stage("receive_golden_image", self.receive_golden_image, ["sistemas_de_arquivos"], ["subvolumes"]),
+            Stage("mount_targets", self.mount_targets, ["subvolumes"], ["montagens"]),
+            Stage("bootstrap_system", self.bootstrap_system, ["montagens", "pacotes_baixados"], ["sistema_base"]),
+            Stage("configure_system", self.configure_system, ["sistema_base"], ["sistema_configurado"]),
+        ]
+
+    def multi_target_stages(self):
+        """DAG do modo de vários discos: base instalada uma vez e replicada."""
+        return [
+            Stage("check_environment", self.check_environment, provides=["ambiente"], interactive=True),
+            Stage("setup_network", self.setup_network, ["ambiente"], ["rede"], interactive=True),
+            Stage("select_mirror", self.select_mirror, ["rede"], ["espelho"]),
+            Stage("prefetch_packages", self.prefetch_packages, ["espelho"], ["pacotes_baixados"]),
+            Stage("collect_info", self.collect_info, ["rede"], ["disco"], interactive=True),
+            Stage("prepare_targets", self.prepare_targets, ["disco"], ["montagens"]),
+            Stage("bootstrap_system", self.bootstrap_system, ["montagens", "pacotes_baixados"], ["sistema_base"]),
+            Stage("install_primary_base", self.install_primary_base, ["sistema_base"], ["base_instalada"]),
+            Stage("replicate_targets", self.replicate_targets, ["base_instalada"], ["sistema_configurado"]),
+        ]
 
     def run(self):
-        """Executa todas as etapas do instalador em ordem."""
+        """Executa as etapas do instalador, paralelizando as independentes."""
         try:
             self.header()
-            self.check_environment()
-            self.setup_network()
-            self.collect_info()
-            self.partition_disk()
-            self.setup_luks_if_enabled()
-            self.format_btrfs()
-            self.mount_targets()
-            self.bootstrap_system() # Mudança aqui
-            self.configure_system()
+            if self.resuming:
+                # Restaura disco e partições antes de qualquer etapa usá-los
+                self.resume_from_journal()
+            else:
+                self.journal.clear()
+            # O plano de um ensaio precisa ser estável: sem paralelismo
+            self.scheduler = StageScheduler(self.stages(), skip=self.skip_stage,
+                                            on_complete=self.on_stage_complete,
+                                            serial=not System.executor.live)
+            self.scheduler.run()
+            if not self.chroot_failed:
+                self.journal.clear()
+            else:
+                print(f"{Style.WARN}Corrija o problema e rode novamente com --resume.{Style.RESET}")
             self.finalize()
         except KeyboardInterrupt:
             print(f"\n{Style.WARN}Instalação interrompida pelo usuário.{Style.RESET}")
+            self.resume_hint()
             # Tenta limpar antes de sair
             self.finalize()
             sys.exit(1)
         except Exception as e:
             print(f"\n{Style.FAIL}Um erro inesperado ocorreu: {e}{Style.RESET}")
+            self.resume_hint()
             # Tenta limpar
             self.finalize()
             sys.exit(1)
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Instalador do Toca Linux")
+    parser.add_argument("--build-golden", metavar="DIR",
+                        help="instala normalmente e salva a parte comum como imagem dourada em DIR")
+    parser.add_argument("--golden-format", choices=sorted(GoldenImage.EXTENSIONS), default="tar",
+                        help="formato da imagem dourada gerada (padrão: tar)")
+    parser.add_argument("--golden-image", metavar="ARQUIVO",
+                        help="implanta a imagem dourada em vez de rodar o debootstrap e o apt")
+    parser.add_argument("--answers", metavar="ARQUIVO",
+                        help="arquivo de respostas TOML/JSON para instalação sem interação")
+    parser.add_argument("--target", action="append", metavar="DISCO",
+                        help="disco de destino (pode repetir para instalar em vários discos em paralelo; "
+                             "dispositivos loop precisam de 'losetup -P')")
+    parser.add_argument("--resume", action="store_true",
+                        help="retoma a última instalação interrompida a partir do diário de etapas")
+    parser.add_argument("--initramfs-modules", choices=["most", "dep"], default="most",
+                        help="initramfs genérico (most) ou só com os módulos desta máquina (dep)")
+    parser.add_argument("--initramfs-compress", choices=sorted(TocaInstaller.INITRAMFS_COMPRESSORS),
+                        default="zstd", help="compressor do initramfs (padrão: zstd)")
+    parser.add_argument("--initramfs-level", type=int, metavar="N",
+                        help="nível de compressão do initramfs (COMPRESSLEVEL)")
+    parser.add_argument("--esp-size", type=int, default=512, metavar="MIB",
+                        help="tamanho da partição EFI em MiB (padrão: 512)")
+    parser.add_argument("--swap-size", type=int, default=0, metavar="MIB",
+                        help="cria uma partição de swap com esse tamanho em MiB")
+    parser.add_argument("--luks-unlock-ms", type=int, default=1000, metavar="MS",
+                        help="tempo alvo do PBKDF2 ao desbloquear o LUKS (padrão: 1000)")
+    parser.add_argument("--subvolume", action="append", metavar="NOME=DESTINO",
+                        help="layout de subvolumes (repetível; substitui o padrão, "
+                             "ex.: --subvolume @=/ --subvolume @home=/home)")
+    parser.add_argument("--trim", choices=TocaInstaller.TRIM_MODES, default="mkfs",
+                        help="TRIM no mkfs (padrão), adiado para o fstrim.timer ou nenhum")
+    parser.add_argument("--retries", type=int, default=1, metavar="N",
+                        help="novas tentativas de uma etapa do chroot a partir do último snapshot (padrão: 1)")
+    parser.add_argument("--factory-boot-entry", action="store_true",
+                        help="adiciona ao GRUB uma entrada de resgate (somente leitura) que inicia o snapshot de fábrica")
+    parser.add_argument("--build-offline-repo", metavar="DIR",
+                        help="instala normalmente e gera em DIR um repositório APT assinado com os pacotes usados")
+    parser.add_argument("--offline-repo", metavar="DIR",
+                        help="instala sem rede a partir de um repositório gerado com --build-offline-repo")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="não altera nada: imprime o plano ordenado de comandos e efeitos")
+    parser.add_argument("--record", metavar="ARQUIVO",
+                        help="grava em JSON cada comando e efeito executado (testes com arquivos golden)")
+    parser.add_argument("--trace", metavar="ARQUIVO",
+                        help="grava também uma cópia do trace de tempos em ARQUIVO")
+    parser.add_argument("--mirror", action="append", metavar="URL",
+                        help="espelho Debian candidato (pode repetir); o mais rápido é escolhido")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.dry_run:
+        System.executor = DryRunExecutor()
+        # Diário, cache e log do ensaio ficam numa área descartável
+        scratch = tempfile.mkdtemp(prefix="tocainstall-dry-run-")
+        atexit.register(shutil.rmtree, scratch, True)
+        CACHE_DIR = os.path.join(scratch, "cache")
+        JOURNAL_PATH = os.path.join(scratch, "journal.json")
+        LOG_PATH = os.path.join(scratch, "tocainstall.log")
+    if args.record:
+        System.executor = RecordingExecutor(System.executor)
+        atexit.register(System.executor.save, args.record)
     installer = TocaInstaller()
+    installer.trace_copy = args.trace
+    installer.golden_build_dir = args.build_golden
+    installer.golden_format = args.golden_format
+    installer.initramfs_modules = args.initramfs_modules
+    installer.initramfs_compress = args.initramfs_compress
+    installer.initramfs_level = args.initramfs_level
+    installer.layout = PartitionLayout(esp_mib=args.esp_size, swap_mib=args.swap_size)
+    if args.esp_size < 100:
+        print(f"{Style.FAIL}--esp-size deve ser pelo menos 100 (MiB).{Style.RESET}")
+        sys.exit(1)
+    if args.swap_size < 0:
+        print(f"{Style.FAIL}--swap-size não pode ser negativo.{Style.RESET}")
+        sys.exit(1)
+    installer.luks_unlock_ms = args.luks_unlock_ms
+    installer.trim = args.trim
+    installer.retries = max(0, args.retries)
+    installer.factory_boot_entry = args.factory_boot_entry
+    if args.subvolume:
+        installer.subvolumes = dict(item.partition("=")[::2] for item in args.subvolume)
+        errors = TocaInstaller.subvolume_errors(installer.subvolumes)
+        if errors:
+            for error in errors:
+                print(f"{Style.FAIL}--subvolume: {error}{Style.RESET}")
+            sys.exit(1)
+    if args.mirror:
+        installer.mirrors = args.mirror
+        installer.mirror = args.mirror[0]
+    installer.offline_build_dir = args.build_offline_repo
+    if args.offline_repo:
+        repo = OfflineRepo(args.offline_repo)
+        if not repo.valid():
+            print(f"{Style.FAIL}Repositório offline inválido ou não assinado: {repo.path}{Style.RESET}")
+            sys.exit(1)
+        installer.offline_repo = repo
+    if args.answers:
+        try:
+            answers = Answers.load(args.answers)
+            errors = answers.validate(System.list_disks(), require_disk=not args.target)
+        except (OSError, ValueError) as e:
+            errors = [str(e)]
+        if errors:
+            for error in errors:
+                print(f"{Style.FAIL}Arquivo de respostas: {error}{Style.RESET}")
+            sys.exit(1)
+        answers.apply(installer)
+    if args.target:
+        installer.target_disks = [os.path.realpath(t) for t in args.target]
+        if len(installer.target_disks) > 1:
+            installer.removable_boot = True
+            System.quiet = True
+    if args.resume:
+        if len(installer.target_disks) > 1:
+            print(f"{Style.FAIL}--resume não é suportado com vários discos.{Style.RESET}")
+            sys.exit(1)
+        if not installer.journal.load():
+            print(f"{Style.FAIL}Nenhum diário de instalação encontrado em {JOURNAL_PATH}.{Style.RESET}")
+            sys.exit(1)
+        installer.resuming = True
+    if args.golden_image:
+        installer.golden_image = GoldenImage(args.golden_image)
+        if System.executor.live:
+            # Antes de apagar qualquer disco: a imagem tem de ser a do manifesto
+            try:
+                installer.golden_image.verify()
+            except RuntimeError as e:
+                print(f"{Style.FAIL}Imagem dourada inválida: {e}{Style.RESET}")
+                sys.exit(1)
+        installer.suite = installer.golden_image.manifest.get("suite", installer.suite)
+    if installer.offline_repo:
+        # A suíte é a do repositório e não há espelhos a sondar
+        installer.suite = installer.offline_repo.suite
+        installer.mirror = installer.offline_repo.url
+        installer.mirrors = []
     installer.run()